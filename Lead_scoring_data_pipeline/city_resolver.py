@@ -0,0 +1,156 @@
+'''
+filename: city_resolver.py
+functions: normalize_city, resolve_city, resolve_city_tiers
+
+Resolution of the free text city_mapped values to the cities of
+city_tier_mapping. A city is looked up, in this order,
+    1. by its normalized name (lower case, no punctuation, single spaces)
+    2. through city_aliases, e.g. 'bangalore' -> 'bengaluru'
+    3. without a trailing word of city_suffixes, e.g. 'jaipur hq' -> 'jaipur'
+    4. by the closest name in character trigrams, when its dice similarity
+       reaches the fuzzy threshold, e.g. 'tiruchirappalli' -> 'tiruchirapalli'
+and the cities that are still not found are tier 3.
+
+Every distinct city is resolved once, resolve_city is memoized in memory
+and resolve_city_tiers keeps the resolved names in the
+'city_resolution_cache' table of the stage store across runs.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import functools
+import hashlib
+import re
+
+import numpy as np
+import pandas as pd
+
+from Lead_scoring_data_pipeline.mapping.city_tier_mapping import city_tier_mapping, city_aliases, city_suffixes
+
+
+CITY_RESOLUTION_TABLE = 'city_resolution_cache'
+DEFAULT_TIER = 3.0
+
+
+###############################################################################
+# Define the normalized index of the city tier mapping
+# ##############################################################################
+
+def normalize_city(name):
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', str(name).lower()).split())
+
+
+def trigrams(name):
+    padded = f'  {name} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+@functools.lru_cache(maxsize=None)
+def city_index():
+    '''
+    Compiles city_tier_mapping and city_aliases into a dict from normalized
+    name to mapped city, and a trigram index from every trigram to the
+    normalized names containing it.
+    '''
+    index = {normalize_city(city): city for city in city_tier_mapping}
+    index.update({normalize_city(alias): city for alias, city in city_aliases.items()})
+    trigram_index = {}
+    for name in index:
+        for trigram in trigrams(name):
+            trigram_index.setdefault(trigram, []).append(name)
+    return index, trigram_index
+
+
+def mapping_version():
+    # resolved names are only reused while the mapping stays the same
+    content = repr((sorted(city_tier_mapping.items()), sorted(city_aliases.items()), city_suffixes))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+###############################################################################
+# Define the function to resolve a single city
+# ##############################################################################
+
+@functools.lru_cache(maxsize=4096)
+def resolve_city(name, fuzzy_threshold=0.8):
+    '''
+    Returns the city of city_tier_mapping that name refers to, None when no
+    city is found.
+
+    SAMPLE USAGE
+        resolve_city('Bangalore ')  # 'bengaluru'
+    '''
+    index, trigram_index = city_index()
+    name = normalize_city(name)
+    if name in index:
+        return index[name]
+
+    words = name.split()
+    while len(words) > 1 and words[-1] in city_suffixes:
+        words = words[:-1]
+        if ' '.join(words) in index:
+            return index[' '.join(words)]
+
+    if fuzzy_threshold is None or fuzzy_threshold > 1:
+        return None
+    name_trigrams = trigrams(name)
+    shared = {}
+    for trigram in name_trigrams:
+        for candidate in trigram_index.get(trigram, []):
+            shared[candidate] = shared.get(candidate, 0) + 1
+    best_name, best_score = None, 0
+    for candidate, count in sorted(shared.items()):
+        score = 2 * count / (len(name_trigrams) + len(trigrams(candidate)))
+        if score > best_score:
+            best_name, best_score = candidate, score
+    if best_score >= fuzzy_threshold:
+        return index[best_name]
+    return None
+
+
+###############################################################################
+# Define the function to resolve the tiers of many cities
+# ##############################################################################
+
+def resolve_city_tiers(cities, store=None, fuzzy_threshold=0.8):
+    '''
+    This function resolves the tier of every distinct city.
+
+    INPUTS
+        cities : distinct city names, e.g. the categories of city_mapped
+        store : stage store keeping the 'city_resolution_cache' table, None
+                to only use the in memory cache
+        fuzzy_threshold : lowest trigram dice similarity of a fuzzy match,
+                          None to turn the fuzzy match off
+
+    OUTPUT
+        numpy array with the tier of every city, 3.0 for the cities that are
+        not found
+
+    SAMPLE USAGE
+        cities = df['city_mapped'].astype('category')
+        tiers = resolve_city_tiers(cities.cat.categories, store)
+    '''
+    cities = [str(city) for city in cities]
+    version = mapping_version()
+    resolved = {}
+    if store is not None and store.exists(CITY_RESOLUTION_TABLE):
+        cache = store.read_table(CITY_RESOLUTION_TABLE)
+        cache = cache[(cache['mapping_version'] == version) & (cache['fuzzy_threshold'] == str(fuzzy_threshold))]
+        resolved = dict(zip(cache['city'], cache['resolved_city']))
+
+    new_cities = [city for city in cities if city not in resolved]
+    for city in new_cities:
+        resolved[city] = resolve_city(city, fuzzy_threshold)
+
+    if store is not None and new_cities:
+        store.write_table(pd.DataFrame({'city': new_cities,
+                                        'resolved_city': [resolved[city] for city in new_cities],
+                                        'mapping_version': version,
+                                        'fuzzy_threshold': str(fuzzy_threshold)}),
+                          CITY_RESOLUTION_TABLE, if_exists='append')
+
+    return np.array([DEFAULT_TIER if pd.isna(resolved[city]) else float(city_tier_mapping[resolved[city]])
+                     for city in cities], dtype=np.float64)
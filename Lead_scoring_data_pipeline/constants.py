@@ -4,12 +4,110 @@ DB_FILE_NAME = 'lead_scoring_data_cleaning.db'
 UNIT_TEST_DB_FILE_NAME = 'unit_test_cases.db'
 DATA_DIRECTORY = '/home/airflow/dags/Lead_scoring_data_pipeline/data/'
 DATA_FILE = 'leadscoring_inference_final_v2.csv'
+
+# storage used to hand the dataframes from one stage to the next, 'sqlite'
+# keeps every stage as a table of DB_FILE_NAME, 'parquet' as compressed
+# parquet files under STAGE_STORE_DIRECTORY
+STAGE_STORE_BACKEND = 'sqlite'
+STAGE_STORE_DIRECTORY = '/home/airflow/dags/Lead_scoring_data_pipeline/stage_store/'
+
+# skip a stage when its input tables, mapping files and constants are the
+# same as in its last successful run, keeping the newest
+# STAGE_CACHE_MAX_ENTRIES cache entries of every stage
+STAGE_CACHE_ENABLED = True
+STAGE_CACHE_MAX_ENTRIES = 20
+
+# record the wall time, cpu time, peak memory, rows and bytes read and
+# written and the time spent in the stage store of every stage in the
+# 'pipeline_metrics' table, see telemetry.py. When
+# PROMETHEUS_TEXTFILE_DIRECTORY is set every stage also writes its metrics
+# there as a .prom file for the node exporter textfile collector
+TELEMETRY_ENABLED = True
+PROMETHEUS_TEXTFILE_DIRECTORY = None
+
+# city names are matched to city_tier_mapping after normalization and
+# aliases, falling back to the closest name whose trigram similarity is at
+# least CITY_FUZZY_THRESHOLD (None turns the fuzzy match off). With
+# CITY_RESOLUTION_CACHE the resolved names are kept in the stage store
+CITY_FUZZY_THRESHOLD = 0.8
+CITY_RESOLUTION_CACHE = True
+
 INTERACTION_MAPPING = '/home/airflow/dags/Lead_scoring_data_pipeline/mapping/interaction_mapping.csv'
 INDEX_COLUMNS = ['created_date','city_tier','first_platform_c','first_utm_medium_c','first_utm_source_c','total_leads_droppped','referred_lead', 'app_complete_flag']
 INDEX_COLUMNS_TRAINING = []
 INDEX_COLUMNS_INFERENCE = ['created_date','city_tier','first_platform_c','first_utm_medium_c','first_utm_source_c','total_leads_droppped','referred_lead']
 NOT_FEATURES = []
 
+# when True the DAG checks the raw data and model_input against their data
+# contracts in schema.py and fails on a violation, the raw csv is streamed in
+# chunks of VALIDATION_CHUNKSIZE rows
+CONTRACT_VALIDATION = True
+VALIDATION_CHUNKSIZE = 100000
+
+# number of csv rows read and written per chunk by load_data_into_db; None loads the whole file at once
+LOAD_CHUNKSIZE = 100000
+
+# when True load_data_into_db keeps a 64-bit fingerprint of every loaded row
+# in the stage store and drops the rows whose fingerprint is already there,
+# duplicates within the file as well as rows loaded by an earlier run
+ROW_FINGERPRINTS = True
+
+# when True every stage only processes rows with a created_date newer than the
+# high water mark stored for its output table and appends them, instead of
+# rebuilding the table from scratch
+INCREMENTAL_LOAD = False
+WATERMARK_TABLE = 'stage_watermarks'
+
+# when True the DAG runs city tier, categorical and interactions mapping as a
+# single in memory task (map_fused_transforms) reading loaded_data once.
+# FUSED_DEBUG_TABLES also writes the intermediate city_tier_mapped and
+# categorical_variables_mapped tables for debugging
+FUSED_TRANSFORMS = False
+FUSED_DEBUG_TABLES = False
+
+# when True the stages keep their dataframes in the compact dtypes derived
+# from the data contracts in schema.py (uint8 flags, int16 counts, category
+# strings, datetime64 created_date) and DTYPE_MEMORY_REPORT prints the memory
+# saved by every stage. The report measures the object columns value by
+# value, which costs about as much as the conversion, so it is off by default
+COMPACT_DTYPES = True
+DTYPE_MEMORY_REPORT = False
+
+# when True interactions_mapping reads categorical_variables_mapped in chunks
+# of INTERACTIONS_CHUNKSIZE rows and spills the mapped chunks to a temporary
+# directory under SPILL_DIRECTORY (None for the system temporary directory),
+# so the table never has to fit in memory. INTERACTIONS_GROUP_BY_INDEX also
+# collapses the rows with the same INDEX_COLUMNS into one, summing their
+# interactions, one of SPILL_PARTITIONS hash partitions at a time
+INTERACTIONS_OUT_OF_CORE = False
+INTERACTIONS_CHUNKSIZE = 100000
+INTERACTIONS_GROUP_BY_INDEX = False
+SPILL_PARTITIONS = 16
+SPILL_DIRECTORY = None
+
+# when True the mapping stages split tables of at least PARTITION_MIN_ROWS
+# rows by created_date, per month or with PARTITION_BY = 'hash' into
+# PARTITION_BUCKETS hash buckets, and run the partitions in
+# PARTITION_WORKERS processes (None for one per core). The results are
+# merged back in the original row order
+PARTITIONED_EXECUTION = False
+PARTITION_BY = 'month'
+PARTITION_BUCKETS = 64
+PARTITION_WORKERS = None
+PARTITION_MIN_ROWS = 100000
+
+# when True and STAGE_STORE_BACKEND is 'sqlite', map_city_tier and
+# map_categorical_vars build their tables inside the db with a CREATE TABLE AS
+# SELECT joined to small mapping tables, the rows are never read into pandas
+SQL_PUSHDOWN = False
+CITY_TIER_LOOKUP_TABLE = 'city_tier_lookup'
+SIGNIFICANT_LEVELS_TABLE = 'significant_levels'
+
+# drop duplicate rows after the categorical mapping, comparing only the
+# DEDUP_KEYS columns (None compares every column)
+DROP_DUPLICATES = True
+DEDUP_KEYS = None
+
 
 
 
@@ -7,14 +7,24 @@ import pandas as pd
 import os
 import sqlite3
 from sqlite3 import Error
+from datetime import datetime
 
 from Lead_scoring_data_pipeline.constants import *
 from Lead_scoring_data_pipeline.schema import *
+from Lead_scoring_data_pipeline.stage_store import get_stage_store, count_io
+from Lead_scoring_data_pipeline.telemetry import instrumented_stage
+
+TELEMETRY_DAG = 'Lead_Scoring_Data_Engineering_Pipeline'
+
+
+def open_stage_store():
+    return get_stage_store(STAGE_STORE_BACKEND, DB_PATH, DB_FILE_NAME, STAGE_STORE_DIRECTORY)
 
 ###############################################################################
 # Define function to validate raw data's schema
 # ############################################################################## 
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
 def raw_data_schema_check():
     '''
     This function check if all the columns mentioned in schema.py are present in
@@ -33,24 +43,176 @@ def raw_data_schema_check():
         else prints
         'Raw datas schema is NOT in line with the schema present in schema.py'
 
+    Only the header of the csv is read, the values are checked by
+    raw_data_contract_check.
     
     SAMPLE USAGE
         raw_data_schema_check
     '''
     try:
-        df = pd.read_csv(f"{DATA_DIRECTORY}{DATA_FILE}", index_col=[0])    
+        # nrows=0 parses the header only
+        df = pd.read_csv(f"{DATA_DIRECTORY}{DATA_FILE}", index_col=[0], nrows=0)
         if sorted(raw_data_schema) == sorted(df.columns) :
             print('Raw datas schema is in line with the schema present in schema.py')
         else :
             print('Raw datas schema is NOT in line with the schema present in schema.py')
     except Exception as e:
         print (f'Exception thrown in raw_data_schema_check : {e}')
-   
+
+
+###############################################################################
+# Define the data contract validator
+# ############################################################################## 
+
+def check_column(values, spec):
+    '''
+    Checks the values of a column against its spec in the data contract.
+    Returns the number of nulls and a dict with the number of violations of
+    every value rule ('dtype', 'nullable', 'levels', 'min', 'max', 'unique')
+    of spec.
+    '''
+    nulls = values.isna()
+    if spec['dtype'] == 'numeric' and not pd.api.types.is_numeric_dtype(values):
+        parsed = pd.to_numeric(values, errors='coerce')
+    elif spec['dtype'] == 'datetime' and not pd.api.types.is_datetime64_any_dtype(values):
+        parsed = pd.to_datetime(values, format=spec.get('format'), errors='coerce')
+    else:
+        parsed = values
+    null_count = int(nulls.sum())
+    # values that became null while parsing do not have the expected dtype
+    violations = {'dtype': int((parsed.isna() & ~nulls).sum()),
+                  'nullable': 0 if spec.get('nullable', True) else null_count}
+    if 'levels' in spec:
+        violations['levels'] = int((parsed.notna() & ~parsed.isin(spec['levels'])).sum())
+    if 'min' in spec:
+        violations['min'] = int((parsed < spec['min']).sum())
+    if 'max' in spec:
+        violations['max'] = int((parsed > spec['max']).sum())
+    if spec.get('unique', False):
+        violations['unique'] = int((parsed.notna() & parsed.duplicated()).sum())
+    return null_count, violations
+
+
+def validate_frame(df, contract, counts=None):
+    '''
+    This function checks every column of df against the data contract in a
+    single pass and adds the number of rows, nulls and violations per rule
+    to counts. Passing the counts of the previous chunk validates a table
+    chunk by chunk.
+
+    INPUTS
+        df : dataframe or chunk to validate
+        contract : data contract from schema.py
+        counts : counts returned for the previous chunks, None for the first
+
+    OUTPUT
+        dict with the number of 'rows', the number of 'nulls' per column and
+        the number of 'violations' per (column, rule)
+
+    SAMPLE USAGE
+        counts = None
+        for chunk in chunks:
+            counts = validate_frame(count_io('read', chunk), raw_data_contract, counts)
+    '''
+    if counts is None:
+        counts = {'rows': 0, 'nulls': {}, 'violations': {}}
+    counts['rows'] += df.shape[0]
+    for col, spec in contract.items():
+        if col not in df.columns:
+            continue
+        null_count, violations = check_column(df[col], spec)
+        counts['nulls'][col] = counts['nulls'].get(col, 0) + null_count
+        for rule, count in violations.items():
+            counts['violations'][(col, rule)] = counts['violations'].get((col, rule), 0) + count
+    return counts
+
+
+def contract_report(table_name, columns, counts, contract):
+    '''
+    Builds the validation report of a table from the counts of
+    validate_frame, one row per column and rule with the number of
+    violations and whether the rule passed.
+    '''
+    counts = counts or {'rows': 0, 'nulls': {}, 'violations': {}}
+    rows = []
+    for col, spec in contract.items():
+        if col not in columns:
+            rows.append((col, 'missing_column', int(spec.get('required', True))))
+            continue
+        for (violation_col, rule), count in counts['violations'].items():
+            if violation_col == col:
+                rows.append((col, rule, count))
+        if 'max_null_fraction' in spec:
+            null_count = counts['nulls'].get(col, 0)
+            null_fraction = null_count / counts['rows'] if counts['rows'] else 0
+            rows.append((col, 'max_null_fraction', null_count if null_fraction > spec['max_null_fraction'] else 0))
+    report = pd.DataFrame(rows, columns=['column_name', 'rule', 'violations'])
+    report.insert(0, 'table_name', table_name)
+    report.insert(0, 'run_at', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    report['rows'] = counts['rows']
+    report['passed'] = (report['violations'] == 0).astype(int)
+    return report
+
+
+def enforce_contract(report, table_name):
+    '''
+    Appends report to the 'validation_report' table of the stage store and
+    raises a ValueError when a rule of the contract failed, so that the
+    Airflow task fails before the next stages run.
+    '''
+    store = open_stage_store()
+    try:
+        store.write(report, 'validation_report', if_exists='append')
+    finally:
+        store.close()
+
+    failed = report[report['passed'] == 0]
+    for row in failed.itertuples():
+        print(f"{row.column_name}: {row.violations} violations of rule {row.rule}")
+    if failed.shape[0]:
+        raise ValueError(f"{table_name} is NOT in line with its data contract in schema.py, "
+                         f"{failed.shape[0]} rules failed")
+    print(f"{table_name} is in line with its data contract in schema.py")
+
+
+###############################################################################
+# Define function to validate raw data against its contract
+# ############################################################################## 
+
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+def raw_data_contract_check():
+    '''
+    This function checks leadscoring.csv against raw_data_contract in
+    schema.py. The csv is streamed in chunks of VALIDATION_CHUNKSIZE rows
+    and only the counts of nulls and violations are kept between chunks,
+    so the memory used does not grow with the size of the file.
+
+    INPUTS
+        DATA_DIRECTORY : path of the directory where 'leadscoring.csv' 
+                        file is present
+        VALIDATION_CHUNKSIZE : number of rows read per chunk
+        raw_data_contract : data contract of the raw data in 'schema.py'
+
+    OUTPUT
+        Appends the violations of every rule to the 'validation_report'
+        table and raises a ValueError when a rule failed
+
+    SAMPLE USAGE
+        raw_data_contract_check()
+    '''
+    file_path = f"{DATA_DIRECTORY}{DATA_FILE}"
+    columns = pd.read_csv(file_path, index_col=[0], nrows=0).columns
+    counts = None
+    for chunk in pd.read_csv(file_path, index_col=[0], chunksize=VALIDATION_CHUNKSIZE):
+        counts = validate_frame(count_io('read', chunk), raw_data_contract, counts)
+    enforce_contract(contract_report('raw_data', columns, counts, raw_data_contract), 'raw_data')
+
 
 ###############################################################################
 # Define function to validate model's input schema
 # ############################################################################## 
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
 def model_input_schema_check():
     '''
     This function check if all the columns mentioned in model_input_schema in 
@@ -72,11 +234,11 @@ def model_input_schema_check():
     SAMPLE USAGE
         model_input_schema_check
     '''
-    print("Connecting to database")
-    cnx = sqlite3.connect(DB_PATH+DB_FILE_NAME)
-    print("Reading data from model_input table")
-    model_input = pd.read_sql('select * from model_input', cnx)
-    model_input_columns = list(model_input.columns)
+    print("Connecting to stage store")
+    store = open_stage_store()
+    print("Reading the columns of model_input table")
+    # only the table metadata is read, not the rows
+    model_input_columns = store.columns('model_input')
     print("model_input column length: ", len(model_input_columns))
     print("model_input_schema length: ", len(model_input_schema))
     
@@ -91,9 +253,37 @@ def model_input_schema_check():
     else:
         print("Models input schema is NOT in line with the schema present in schema.py")
     
-    print("Closing database connection")
-    cnx.close()
-    
+    print("Closing stage store")
+    store.close()
 
-    
-    
+
+###############################################################################
+# Define function to validate model's input against its contract
+# ############################################################################## 
+
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+def model_input_contract_check():
+    '''
+    This function checks the model_input table against model_input_contract
+    in schema.py.
+
+    INPUTS
+        DB_FILE_NAME : Name of the database file
+        DB_PATH : path where the db file should be present
+        model_input_contract : data contract of the models input in 'schema.py'
+
+    OUTPUT
+        Appends the violations of every rule to the 'validation_report'
+        table and raises a ValueError when a rule failed
+
+    SAMPLE USAGE
+        model_input_contract_check()
+    '''
+    store = open_stage_store()
+    try:
+        columns = store.columns('model_input')
+        model_input = store.read('model_input', columns=[col for col in model_input_contract if col in columns])
+    finally:
+        store.close()
+    counts = validate_frame(model_input, model_input_contract)
+    enforce_contract(contract_report('model_input', columns, counts, model_input_contract), 'model_input')
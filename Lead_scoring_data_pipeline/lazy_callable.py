@@ -0,0 +1,47 @@
+'''
+filename: lazy_callable.py
+functions: lazy_callable
+
+Task callables for the DAG files that import their module only when the
+task runs. The Airflow scheduler parses the DAG files every
+min_file_process_interval (30 seconds by default), importing utils.py there
+would load pandas, scipy, pyarrow, mlflow, lightgbm and sklearn on every
+parse. The DAG files import only airflow, the standard library and the
+constants.py of their pipeline, see benchmarks/dag_import_time.py for the
+check of their import time.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import importlib
+
+
+###############################################################################
+# Define the lazy task callable
+# ##############################################################################
+
+def lazy_callable(module_name, function_name):
+    '''
+    This function returns a callable that imports module_name and calls its
+    function_name when it is called.
+
+    INPUTS
+        module_name : module of the task function, e.g.
+                      'Lead_scoring_data_pipeline.utils'
+        function_name : name of the task function in the module
+
+    OUTPUT
+        callable without parameters, so that the PythonOperator does not
+        pass it the task context
+
+    SAMPLE USAGE
+        build_dbs = lazy_callable('Lead_scoring_data_pipeline.utils', 'build_dbs')
+        PythonOperator(task_id='building_db', python_callable=build_dbs, dag=dag)
+    '''
+    def task_callable():
+        return getattr(importlib.import_module(module_name), function_name)()
+
+    task_callable.__name__ = task_callable.__qualname__ = function_name
+    return task_callable
@@ -5,15 +5,17 @@
 
 from airflow import DAG
 from airflow.operators.python import PythonOperator
+from airflow.models.baseoperator import chain
 
 from datetime import datetime, timedelta
 
-from Lead_scoring_data_pipeline.utils import *
-from Lead_scoring_data_pipeline.data_validation_checks import *
+# the task functions are imported when their task runs, not when the
+# scheduler parses this file, see lazy_callable.py
 from Lead_scoring_data_pipeline.constants import *
-from Lead_scoring_data_pipeline.mapping.city_tier_mapping import *
-from Lead_scoring_data_pipeline.mapping.significant_categorical_level import *
-from Lead_scoring_data_pipeline.schema import *
+from Lead_scoring_data_pipeline.lazy_callable import lazy_callable
+
+UTILS = 'Lead_scoring_data_pipeline.utils'
+DATA_VALIDATION_CHECKS = 'Lead_scoring_data_pipeline.data_validation_checks'
 
 
 ###############################################################################
@@ -41,7 +43,7 @@ ML_data_cleaning_dag = DAG(
 ###############################################################################
 build_dbs_task = PythonOperator(
                             task_id = 'building_db',
-                            python_callable = build_dbs,
+                            python_callable = lazy_callable(UTILS, 'build_dbs'),
                             dag = ML_data_cleaning_dag)
 
 ###############################################################################
@@ -49,49 +51,82 @@ build_dbs_task = PythonOperator(
 # ##############################################################################
 raw_data_schema_check_task = PythonOperator(
                             task_id = 'checking_raw_data_schema',
-                            python_callable = raw_data_schema_check,
+                            python_callable = lazy_callable(DATA_VALIDATION_CHECKS, 'raw_data_schema_check'),
                             dag = ML_data_cleaning_dag)
 
+validation_tasks = []
+if CONTRACT_VALIDATION:
+    ###############################################################################
+    # Create a task for raw_data_contract_check() function with task_id 'checking_raw_data_contract'
+    # ##############################################################################
+    raw_data_contract_check_task = PythonOperator(
+                                task_id = 'checking_raw_data_contract',
+                                python_callable = lazy_callable(DATA_VALIDATION_CHECKS, 'raw_data_contract_check'),
+                                dag = ML_data_cleaning_dag)
+    validation_tasks = [raw_data_contract_check_task]
+
 ###############################################################################
 # Create a task for load_data_into_db() function with task_id 'loading_data'
 # #############################################################################
 load_data_into_db_task = PythonOperator(
                             task_id = 'loading_data',
-                            python_callable = load_data_into_db,
-                            dag = ML_data_cleaning_dag)
-
-###############################################################################
-# Create a task for map_city_tier() function with task_id 'mapping_city_tier'
-# ##############################################################################
-map_city_tier_task = PythonOperator(
-                            task_id = 'mapping_city_tier',
-                            python_callable = map_city_tier,
-                            dag = ML_data_cleaning_dag)
-
-###############################################################################
-# Create a task for map_categorical_vars() function with task_id 'mapping_categorical_vars'
-# ##############################################################################
-map_categorical_vars_task = PythonOperator(
-                            task_id = 'mapping_categorical_vars',
-                            python_callable = map_categorical_vars,
+                            python_callable = lazy_callable(UTILS, 'load_data_into_db'),
                             dag = ML_data_cleaning_dag)
 
-###############################################################################
-# Create a task for interactions_mapping() function with task_id 'mapping_interactions'
-# ##############################################################################
-interactions_mapping_task = PythonOperator(
-                            task_id = 'mapping_interactions',
-                            python_callable = interactions_mapping,
-                            dag = ML_data_cleaning_dag)
+if FUSED_TRANSFORMS:
+    ###############################################################################
+    # Create a task for map_fused_transforms() function with task_id 'mapping_fused_transforms'
+    # ##############################################################################
+    map_fused_transforms_task = PythonOperator(
+                                task_id = 'mapping_fused_transforms',
+                                python_callable = lazy_callable(UTILS, 'map_fused_transforms'),
+                                dag = ML_data_cleaning_dag)
+    mapping_tasks = [map_fused_transforms_task]
+else:
+    ###############################################################################
+    # Create a task for map_city_tier() function with task_id 'mapping_city_tier'
+    # ##############################################################################
+    map_city_tier_task = PythonOperator(
+                                task_id = 'mapping_city_tier',
+                                python_callable = lazy_callable(UTILS, 'map_city_tier'),
+                                dag = ML_data_cleaning_dag)
+
+    ###############################################################################
+    # Create a task for map_categorical_vars() function with task_id 'mapping_categorical_vars'
+    # ##############################################################################
+    map_categorical_vars_task = PythonOperator(
+                                task_id = 'mapping_categorical_vars',
+                                python_callable = lazy_callable(UTILS, 'map_categorical_vars'),
+                                dag = ML_data_cleaning_dag)
+
+    ###############################################################################
+    # Create a task for interactions_mapping() function with task_id 'mapping_interactions'
+    # ##############################################################################
+    interactions_mapping_task = PythonOperator(
+                                task_id = 'mapping_interactions',
+                                python_callable = lazy_callable(UTILS, 'interactions_mapping'),
+                                dag = ML_data_cleaning_dag)
+    mapping_tasks = [map_city_tier_task, map_categorical_vars_task, interactions_mapping_task]
 
 ###############################################################################
 # Create a task for model_input_schema_check() function with task_id 'checking_model_inputs_schema'
 # ##############################################################################
 model_input_schema_check_task = PythonOperator(
                             task_id = 'checking_model_inputs_schema',
-                            python_callable = model_input_schema_check,
+                            python_callable = lazy_callable(DATA_VALIDATION_CHECKS, 'model_input_schema_check'),
                             dag = ML_data_cleaning_dag)
 
+model_input_validation_tasks = []
+if CONTRACT_VALIDATION:
+    ###############################################################################
+    # Create a task for model_input_contract_check() function with task_id 'checking_model_inputs_contract'
+    # ##############################################################################
+    model_input_contract_check_task = PythonOperator(
+                                task_id = 'checking_model_inputs_contract',
+                                python_callable = lazy_callable(DATA_VALIDATION_CHECKS, 'model_input_contract_check'),
+                                dag = ML_data_cleaning_dag)
+    model_input_validation_tasks = [model_input_contract_check_task]
+
 ###############################################################################
 # Define the relation between the tasks
 # ##############################################################################
@@ -103,5 +138,6 @@ model_input_schema_check_task = PythonOperator(
 #map_categorical_vars_task.set_downstream(interactions_mapping_task)
 #interactions_mapping_task.set_downstream(model_input_schema_check_task)
 
-build_dbs_task >> raw_data_schema_check_task >> load_data_into_db_task >> map_city_tier_task >> map_categorical_vars_task >> interactions_mapping_task >> model_input_schema_check_task
+chain(build_dbs_task, raw_data_schema_check_task, *validation_tasks, load_data_into_db_task, *mapping_tasks,
+      model_input_schema_check_task, *model_input_validation_tasks)
 
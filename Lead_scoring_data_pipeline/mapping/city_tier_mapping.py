@@ -74,3 +74,39 @@ city_tier_mapping = {'bengaluru': 1,
      'varanasi': 3,
      'vellore': 3,
      'warangal': 3}
+
+
+# other names and spellings of the cities above, keyed by their normalized
+# form (lower case, single spaces, see city_resolver.normalize_city)
+city_aliases = {'bangalore': 'bengaluru',
+     'bengalooru': 'bengaluru',
+     'madras': 'chennai',
+     'secunderabad': 'hyderabad',
+     'calcutta': 'kolkata',
+     'bombay': 'mumbai',
+     'delhi': 'ncr',
+     'new delhi': 'ncr',
+     'gurgaon': 'ncr',
+     'gurugram': 'ncr',
+     'noida': 'ncr',
+     'greater noida': 'ncr',
+     'gautam buddha nagar': 'ncr',
+     'ghaziabad': 'ncr',
+     'poona': 'pune',
+     'cochin': 'kochi',
+     'ernakulam': 'kochi',
+     'calicut': 'kozhikode',
+     'trichy': 'tiruchirapalli',
+     'tiruchi': 'tiruchirapalli',
+     'baroda': 'vadodara',
+     'vizag': 'vishakapatnam',
+     'visakhapatnam': 'vishakapatnam',
+     'prayagraj': 'allahabad',
+     'hubli': 'hubli-dharwad',
+     'dharwad': 'hubli-dharwad',
+     'mysuru': 'mysore',
+     'puducherry': 'pondicherry',
+     'trivandrum': 'thiruvananthapuram'}
+
+# words trailing a city name that do not change the city, e.g. 'jaipur hq'
+city_suffixes = ['hq', 'region', 'city', 'district', 'urban', 'rural']
@@ -1,3 +1,6 @@
+from Lead_scoring_data_pipeline.mapping.significant_categorical_level import list_platform, list_medium, list_source
+
+
 raw_data_schema = ['created_date', 'city_mapped', 'first_platform_c',
            'first_utm_medium_c', 'first_utm_source_c', 'total_leads_droppped',
            'referred_lead', '1_on_1_industry_mentorship', 'call_us_button_clicked',
@@ -18,6 +21,48 @@ raw_data_schema = ['created_date', 'city_mapped', 'first_platform_c',
            'view_programs_page', 'whatsapp_chat_click', 'app_complete_flag']
 
 
-model_input_schema = ['total_leads_droppped', 'city_tier', 'referred_lead', 
+model_input_schema = ['lead_id', 'total_leads_droppped', 'city_tier', 'referred_lead', 
                     'first_platform_c', 'first_utm_medium_c', 'first_utm_source_c', 
                     'app_complete_flag']
+
+
+
+# data contracts checked by raw_data_contract_check and
+# model_input_contract_check in data_validation_checks.py. Every column has
+#   dtype : 'numeric', 'datetime' or 'string', values that cannot be parsed
+#           as the dtype are violations ('format' gives the datetime format)
+#   nullable : whether the column may contain nulls at all
+#   max_null_fraction : highest share of nulls allowed in the column
+#   levels : allowed values of the column
+#   min / max : allowed range of a numeric column
+#   required : whether the column must be present, True when not given
+#   unique : whether every value may appear only once (within a chunk when
+#            the table is validated in chunks)
+#   storage : pandas dtype the pipeline keeps the column in, when it is not
+#             the one derived by dtype_plan in utils.py
+raw_data_contract = {col: {'dtype': 'numeric', 'nullable': True, 'min': 0} for col in raw_data_schema}
+raw_data_contract.update({
+    'created_date': {'dtype': 'datetime', 'format': '%Y-%m-%d %H:%M:%S', 'nullable': False},
+    'city_mapped': {'dtype': 'string', 'nullable': True, 'max_null_fraction': 0.1},
+    'first_platform_c': {'dtype': 'string', 'nullable': False},
+    'first_utm_medium_c': {'dtype': 'string', 'nullable': False},
+    'first_utm_source_c': {'dtype': 'string', 'nullable': False},
+    'total_leads_droppped': {'dtype': 'numeric', 'nullable': True, 'max_null_fraction': 0.01, 'min': 0},
+    'referred_lead': {'dtype': 'numeric', 'nullable': True, 'max_null_fraction': 0.01, 'levels': [0, 1]},
+    # the inference data has no target
+    'app_complete_flag': {'dtype': 'numeric', 'nullable': False, 'levels': [0, 1], 'required': False},
+})
+
+
+model_input_contract = {
+    # id given to every lead by load_data_into_db, the key of the stage tables
+    'lead_id': {'dtype': 'numeric', 'nullable': False, 'min': 0, 'unique': True, 'storage': 'int64'},
+    'total_leads_droppped': {'dtype': 'numeric', 'nullable': False, 'min': 0},
+    # kept as float so that the one hot encoded columns stay city_tier_1.0 ...
+    'city_tier': {'dtype': 'numeric', 'nullable': False, 'levels': [1.0, 2.0, 3.0], 'storage': 'float32'},
+    'referred_lead': {'dtype': 'numeric', 'nullable': False, 'levels': [0, 1]},
+    'first_platform_c': {'dtype': 'string', 'nullable': False, 'levels': list_platform + ['others']},
+    'first_utm_medium_c': {'dtype': 'string', 'nullable': False, 'levels': list_medium + ['others']},
+    'first_utm_source_c': {'dtype': 'string', 'nullable': False, 'levels': list_source + ['others']},
+    'app_complete_flag': {'dtype': 'numeric', 'nullable': False, 'levels': [0, 1], 'required': False},
+}
@@ -0,0 +1,166 @@
+'''
+filename: stage_cache.py
+functions: cached_stage, stage_fingerprint
+
+Memoization of the pipeline stages. A stage is fingerprinted from the
+versions of its input tables in the stage store, the content of the files
+it depends on (mapping files, source code), the constants of its pipeline
+and optionally an extra value such as the version of the production model.
+When the fingerprint matches a previous successful run and the output
+tables are still the ones that run wrote, the stage is skipped and the
+previous outputs are reused.
+
+The cache entries are kept in the 'stage_cache' table of the stage store,
+only the newest STAGE_CACHE_MAX_ENTRIES entries of every stage are kept.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import functools
+import hashlib
+import inspect
+import json
+from datetime import datetime
+
+import pandas as pd
+
+
+STAGE_CACHE_TABLE = 'stage_cache'
+
+
+###############################################################################
+# Define the function to fingerprint a stage
+# ##############################################################################
+
+def file_hash(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def stage_fingerprint(store, input_tables, files, constants, extra=None):
+    '''
+    Returns the fingerprint of a stage, or None when the version of one of
+    its input tables is unknown, in which case the stage cannot be cached.
+    '''
+    hasher = hashlib.sha256()
+    for table_name in input_tables:
+        version = store.version(table_name)
+        if version is None:
+            return None
+        hasher.update(f'{table_name}={version}'.encode())
+    for file_path in files:
+        hasher.update(f'{file_path}={file_hash(file_path)}'.encode())
+    for name in sorted(constants):
+        hasher.update(f'{name}={constants[name]!r}'.encode())
+    hasher.update(repr(extra).encode())
+    return hasher.hexdigest()
+
+
+###############################################################################
+# Define the cache decorator
+# ##############################################################################
+
+def cached_stage(stage_name, open_store, input_tables, output_tables, files=(), extra=None):
+    '''
+    This decorator skips a stage callable when its inputs have not changed
+    since its last successful run.
+
+    INPUTS
+        stage_name : name of the stage in the 'stage_cache' table
+        open_store : function returning the stage store of the pipeline
+        input_tables : tables read by the stage
+        output_tables : tables written by the stage
+        files : files the stage depends on, the source file of the stage
+                is always added
+        extra : function returning any other input of the stage, e.g. the
+                version of the model used for prediction. When it raises
+                the stage runs without the cache
+
+    The constants of the pipeline are read from the globals of the stage
+    function, i.e. the upper case names imported from its constants.py, and
+    caching is turned on with STAGE_CACHE_ENABLED there.
+
+    A run only counts as successful when it rewrote every output table, so
+    stages that print their exceptions instead of raising are not cached
+    after a failure.
+
+    SAMPLE USAGE
+        @cached_stage('map_city_tier', open_stage_store, ['loaded_data'], ['city_tier_mapped'])
+        def map_city_tier():
+            ...
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            constants = {name: value for name, value in func.__globals__.items() if name.isupper()}
+            if not constants.get('STAGE_CACHE_ENABLED', False):
+                return func(*args, **kwargs)
+
+            try:
+                extra_value = extra() if extra else None
+            except Exception as e:
+                # e.g. the model registry cannot be reached, the stage is run
+                # as if it were not cached rather than failing the task
+                print(f"Cannot fingerprint {stage_name}, running it without the stage cache : {e}")
+                return func(*args, **kwargs)
+
+            store = open_store()
+            try:
+                stage_files = [inspect.getsourcefile(func)] + [f() if callable(f) else f for f in files]
+                fingerprint = stage_fingerprint(store, input_tables, stage_files, constants, extra_value)
+                output_versions = {table_name: store.version(table_name) for table_name in output_tables}
+                if fingerprint is not None and cache_hit(store, stage_name, fingerprint, output_versions):
+                    print(f"Inputs of {stage_name} unchanged since its last run, reusing {', '.join(output_tables)}")
+                    return None
+            finally:
+                store.close()
+
+            store = open_store()
+            try:
+                written_at = {table_name: store.written_at(table_name) for table_name in output_tables}
+            finally:
+                store.close()
+
+            result = func(*args, **kwargs)
+
+            store = open_store()
+            try:
+                new_versions = {table_name: store.version(table_name) for table_name in output_tables}
+                rewritten = all(store.written_at(t) is not None and store.written_at(t) != written_at[t]
+                                for t in output_tables)
+                if fingerprint is not None and rewritten:
+                    record_cache_entry(store, stage_name, fingerprint, new_versions,
+                                       constants.get('STAGE_CACHE_MAX_ENTRIES', 20))
+            finally:
+                store.close()
+            return result
+        return wrapper
+    return decorator
+
+
+def cache_hit(store, stage_name, fingerprint, output_versions):
+    if not store.exists(STAGE_CACHE_TABLE):
+        return False
+    entries = store.read_table(STAGE_CACHE_TABLE)
+    entries = entries[(entries['stage'] == stage_name) & (entries['fingerprint'] == fingerprint)]
+    # the outputs must still be the ones written by the cached run
+    return any(json.loads(versions) == output_versions for versions in entries['output_versions'])
+
+
+def record_cache_entry(store, stage_name, fingerprint, output_versions, max_entries):
+    entry = pd.DataFrame({'stage': [stage_name],
+                          'fingerprint': [fingerprint],
+                          'output_versions': [json.dumps(output_versions, sort_keys=True)],
+                          'created_at': [datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')]})
+    if store.exists(STAGE_CACHE_TABLE):
+        entries = store.read_table(STAGE_CACHE_TABLE)
+        entry = pd.concat([entries, entry], ignore_index=True)
+    # evict the oldest entries of the stage
+    entry = entry.sort_values('created_at')
+    entry = entry.groupby('stage', group_keys=False).tail(max_entries)
+    store.write_table(entry, STAGE_CACHE_TABLE)
@@ -0,0 +1,600 @@
+'''
+filename: stage_store.py
+functions: get_stage_store, content_hash, native_rows
+classes: StageStore, SQLiteStageStore, ParquetStageStore
+
+Storage used by the stages of the data, training and inference pipelines to
+hand dataframes over to each other. The backend is picked with
+STAGE_STORE_BACKEND in the constants.py of each pipeline:
+    'sqlite'  : one table per stage in the lead scoring sqlite db
+    'parquet' : one directory of compressed parquet files per stage, read
+                column by column
+
+Every write also records a version of the table, a hash of its content, in
+the 'stage_table_versions' table. The stage cache compares these versions
+to find out whether the input of a stage has changed.
+
+The stores also keep the 64-bit fingerprints of the rows loaded so far, in
+the indexed 'row_fingerprints' table (sqlite) or a sorted array file
+(parquet), so that a new row can be checked against the whole history
+without reading it.
+
+The stage tables are keyed by lead_id, the id every lead gets when it is
+loaded. In sqlite a table with a lead_id column has it as INTEGER PRIMARY
+KEY (the rowid, so lookups by lead_id are b-tree seeks), rows appended again
+with the same lead_id replace the old ones, and created_date is indexed for
+the incremental reads. The parquet files keep lead_id as a plain column.
+
+Sparse matrices, such as the one hot encoded features, are kept as
+<name>.npz files next to the tables (the db file or the parquet
+directories), holding the CSR arrays of the matrix with the lead_id of its
+rows and the names of its columns. They are versioned like the tables.
+
+The rows and bytes the stages read and write through a store, and the time
+spent in the backend doing so, are added up in IO_COUNTERS for the stage
+telemetry. The read_table and write_table methods of the backends are not
+counted, the store uses them directly for its own bookkeeping tables.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+TABLE_VERSIONS = 'stage_table_versions'
+FINGERPRINT_TABLE = 'row_fingerprints'
+KEY_COLUMN = 'lead_id'
+INDEXED_COLUMNS = ['created_date']
+
+# running totals of the process, telemetry diffs them around a stage
+IO_COUNTERS = {'rows_read': 0, 'rows_written': 0, 'bytes_read': 0, 'bytes_written': 0,
+               'sqlite_seconds': 0.0, 'parquet_seconds': 0.0}
+
+
+def content_hash(df, hasher=None):
+    '''
+    Updates hasher (a new sha256 when None) with the column names and the row
+    hashes of df and returns it.
+    '''
+    hasher = hasher or hashlib.sha256()
+    hasher.update(repr(list(df.columns)).encode())
+    hasher.update(pd.util.hash_pandas_object(hashable_frame(df), index=False).values.tobytes())
+    return hasher
+
+
+def hashable_frame(df):
+    # pandas hashes the nullable integer columns of the dtype plan through
+    # python objects, as float64 (exact up to 32 bits) they hash as numpy
+    # columns do
+    masked = [column for column in df.columns
+              if pd.api.types.is_extension_array_dtype(df[column].dtype)
+              and df[column].dtype.kind in 'iub' and df[column].dtype.itemsize <= 4]
+    if not masked:
+        return df
+    return df.assign(**{column: df[column].to_numpy(dtype=np.float64, na_value=np.nan) for column in masked})
+
+
+def native_rows(df):
+    '''
+    Returns the rows of df as tuples of the python values sqlite3 binds
+    directly, None for the missing values and timestamps as the text to_sql
+    writes for them. Every column is converted as a whole, which is much
+    faster than df.astype(object) on the nullable and categorical dtypes.
+    '''
+    columns = []
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series.dtype):
+            values = series.astype(str).to_numpy(dtype=object)
+        elif pd.api.types.is_extension_array_dtype(series.dtype) and hasattr(series.dtype, 'numpy_dtype'):
+            values = series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0).astype(object)
+        else:
+            values = series.to_numpy(dtype=object)
+        missing = series.isna().to_numpy()
+        if missing.any():
+            values[missing] = None
+        columns.append(values.tolist())
+    return zip(*columns)
+
+
+def count_io(direction, df, seconds=0.0, backend=None):
+    '''
+    Adds the rows and the in memory bytes of df to the 'read' or 'written'
+    counters of IO_COUNTERS, and seconds to the time of the backend.
+    '''
+    IO_COUNTERS[f'rows_{direction}'] += df.shape[0]
+    IO_COUNTERS[f'bytes_{direction}'] += int(df.memory_usage(index=False).sum())
+    if backend is not None:
+        IO_COUNTERS[f'{backend}_seconds'] += seconds
+    return df
+
+
+def count_sparse_io(direction, matrix, seconds, backend):
+    # the bytes of a sparse matrix are those of its CSR arrays
+    IO_COUNTERS[f'rows_{direction}'] += matrix.shape[0]
+    IO_COUNTERS[f'bytes_{direction}'] += matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    IO_COUNTERS[f'{backend}_seconds'] += seconds
+    return matrix
+
+
+###############################################################################
+# Define the versioning shared by the backends
+# ##############################################################################
+
+class StageStore:
+    '''
+    Versioned writes on top of the write_table and write_table_chunks methods
+    of a backend, and counted reads and writes.
+    '''
+
+    def read(self, table_name, columns=None, since=None):
+        '''
+        Reads table_name, only the given columns when columns is set and only
+        the rows with a created_date after since when since is set.
+        '''
+        start = time.perf_counter()
+        df = self.read_table(table_name, columns=columns, since=since)
+        return count_io('read', df, time.perf_counter() - start, self.backend)
+
+    def read_chunks(self, table_name, chunksize, columns=None, since=None):
+        '''
+        Same as read, but yields the rows in dataframes of at most chunksize
+        rows.
+        '''
+        chunks = self.read_table_chunks(table_name, chunksize, columns=columns, since=since)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield count_io('read', chunk, time.perf_counter() - start, self.backend)
+
+    def version_record(self, table_name):
+        if not self.exists(TABLE_VERSIONS):
+            return None
+        versions = self.read_table(TABLE_VERSIONS)
+        versions = versions[versions['table_name'] == table_name]
+        return versions.iloc[0] if versions.shape[0] else None
+
+    def version(self, table_name):
+        record = self.version_record(table_name)
+        return None if record is None else record['version']
+
+    def written_at(self, table_name):
+        # time of the last write, which changes even when the content does not
+        record = self.version_record(table_name)
+        return None if record is None else int(record['written_at'])
+
+    def record_version(self, table_name, hasher, previous_version=None):
+        # an append chains the hash of the new rows to the previous version
+        if previous_version is not None:
+            hasher.update(previous_version.encode())
+        version = pd.DataFrame({'table_name': [table_name], 'version': [hasher.hexdigest()],
+                                'written_at': [time.time_ns()]})
+        if self.exists(TABLE_VERSIONS):
+            versions = self.read_table(TABLE_VERSIONS)
+            version = pd.concat([versions[versions['table_name'] != table_name], version])
+        self.write_table(version, TABLE_VERSIONS)
+
+    def write(self, df, table_name, if_exists='replace'):
+        previous_version = self.version(table_name) if if_exists == 'append' else None
+        start = time.perf_counter()
+        self.write_table(df, table_name, if_exists=if_exists)
+        count_io('written', df, time.perf_counter() - start, self.backend)
+        self.record_version(table_name, content_hash(df), previous_version)
+
+    def write_chunks(self, chunks, table_name, if_exists='replace'):
+        '''
+        Writes an iterable of dataframes to table_name as one unit, readers
+        keep seeing the previous table until every chunk is written. Returns
+        the number of rows written.
+        '''
+        previous_version = self.version(table_name) if if_exists == 'append' else None
+        hasher = hashlib.sha256()
+        # time spent producing the chunks is not time spent in the backend
+        upstream_seconds = [0.0]
+
+        def hashed_chunks():
+            for chunk in chunks_iterator(chunks, upstream_seconds):
+                content_hash(chunk, hasher)
+                count_io('written', chunk)
+                yield chunk
+
+        start = time.perf_counter()
+        total_rows = self.write_table_chunks(hashed_chunks(), table_name, if_exists=if_exists)
+        IO_COUNTERS[f'{self.backend}_seconds'] += time.perf_counter() - start - upstream_seconds[0]
+        self.record_version(table_name, hasher, previous_version)
+        return total_rows
+
+    def sparse_path(self, table_name):
+        return os.path.join(self.sparse_directory, f'{table_name}.npz')
+
+    def sparse_exists(self, table_name):
+        return os.path.isfile(self.sparse_path(table_name))
+
+    def write_sparse(self, matrix, keys, columns, table_name):
+        '''
+        Writes a scipy sparse matrix to table_name.npz with the lead_id of its
+        rows (keys) and the names of its columns. The file is replaced
+        atomically and versioned like a table.
+        '''
+        matrix = matrix.tocsr()
+        arrays = {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr,
+                  'shape': np.array(matrix.shape, dtype=np.int64),
+                  'keys': np.asarray(keys, dtype=np.int64),
+                  'columns': np.array(columns, dtype=str)}
+        start = time.perf_counter()
+        staging_path = os.path.join(self.sparse_directory, f'.{table_name}.{uuid.uuid4().hex}.npz')
+        np.savez_compressed(staging_path, **arrays)
+        os.replace(staging_path, self.sparse_path(table_name))
+        count_sparse_io('written', matrix, time.perf_counter() - start, self.backend)
+
+        hasher = hashlib.sha256()
+        for name, array in arrays.items():
+            hasher.update(f'{name}:{array.dtype}:{array.shape}'.encode())
+            hasher.update(np.ascontiguousarray(array).tobytes())
+        self.record_version(table_name, hasher)
+
+    def read_sparse(self, table_name):
+        '''
+        Reads table_name.npz and returns the CSR matrix, the lead_id of its
+        rows and the list of its column names.
+        '''
+        from scipy import sparse
+        start = time.perf_counter()
+        with np.load(self.sparse_path(table_name)) as arrays:
+            matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                       shape=tuple(arrays['shape']))
+            keys, columns = arrays['keys'], arrays['columns'].tolist()
+        count_sparse_io('read', matrix, time.perf_counter() - start, self.backend)
+        return matrix, keys, columns
+
+
+def chunks_iterator(chunks, seconds):
+    # yields the chunks, adding the time taken to produce them to seconds[0]
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        seconds[0] += time.perf_counter() - start
+        if chunk is None:
+            return
+        yield chunk
+
+
+###############################################################################
+# Define the sqlite backend
+# ##############################################################################
+
+class SQLiteStageStore(StageStore):
+    '''
+    Stores every stage as a table of the sqlite db DB_PATH + DB_FILE_NAME.
+    '''
+
+    backend = 'sqlite'
+
+    def __init__(self, db_path, db_file_name):
+        self.cnx = sqlite3.connect(db_path + db_file_name)
+        self.sparse_directory = db_path
+
+    def exists(self, table_name):
+        row = self.cnx.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone()
+        return row is not None
+
+    def columns(self, table_name):
+        return [row[1] for row in self.cnx.execute(f'PRAGMA table_info("{table_name}")')]
+
+    def read_table(self, table_name, columns=None, since=None):
+        select = '*' if columns is None else ', '.join(f'"{column}"' for column in columns)
+        query = f'select {select} from "{table_name}"'
+        if since is None:
+            return pd.read_sql(query, self.cnx)
+        return pd.read_sql(query + ' where created_date > ?', self.cnx, params=(str(since),))
+
+    def read_table_chunks(self, table_name, chunksize, columns=None, since=None):
+        select = '*' if columns is None else ', '.join(f'"{column}"' for column in columns)
+        query = f'select {select} from "{table_name}"'
+        params = None
+        if since is not None:
+            query, params = query + ' where created_date > ?', (str(since),)
+        yield from pd.read_sql(query, self.cnx, params=params, chunksize=chunksize)
+
+    def max_value(self, table_name, column):
+        return self.cnx.execute(f'SELECT MAX("{column}") FROM "{table_name}"').fetchone()[0]
+
+    def write_table(self, df, table_name, if_exists='replace'):
+        if KEY_COLUMN in df.columns:
+            # keyed tables are declared with their primary key and indexes
+            self.write_table_chunks([df], table_name, if_exists=if_exists)
+            return
+        df.to_sql(name=table_name, con=self.cnx, if_exists=if_exists, index=False)
+
+    def index_table(self, table_name):
+        # a lead_id that is not the primary key, as in the tables built by
+        # write_query, gets a unique index instead
+        table_info = list(self.cnx.execute(f'PRAGMA table_info("{table_name}")'))
+        columns = [row[1] for row in table_info]
+        if KEY_COLUMN in columns and not any(row[1] == KEY_COLUMN and row[5] for row in table_info):
+            self.cnx.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "ix_{table_name}_{KEY_COLUMN}" '
+                             f'ON "{table_name}" ("{KEY_COLUMN}")')
+        for column in INDEXED_COLUMNS:
+            if column in columns:
+                self.cnx.execute(f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_{column}" ON "{table_name}" ("{column}")')
+
+    def write_table_chunks(self, chunks, table_name, if_exists='replace'):
+        # all the chunks are written inside one transaction
+        total_rows = 0
+        insert = 'INSERT'
+        try:
+            self.cnx.execute('BEGIN')
+            if if_exists == 'replace':
+                self.cnx.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            for chunk in chunks:
+                if total_rows == 0:
+                    keys = [KEY_COLUMN] if KEY_COLUMN in chunk.columns else None
+                    self.cnx.execute(pd.io.sql.get_schema(chunk, table_name, keys=keys, con=self.cnx).replace('CREATE TABLE', 'CREATE TABLE IF NOT EXISTS', 1))
+                    # a lead appended again replaces its previous row, a new
+                    # table is filled with plain inserts
+                    insert = 'INSERT OR REPLACE' if keys and if_exists == 'append' else 'INSERT'
+                # plain executemany keeps every chunk inside the transaction,
+                # unlike to_sql which commits after each call
+                placeholders = ','.join(['?'] * chunk.shape[1])
+                self.cnx.executemany(f'{insert} INTO "{table_name}" VALUES ({placeholders})', native_rows(chunk))
+                total_rows += chunk.shape[0]
+            if total_rows:
+                self.index_table(table_name)
+            self.cnx.commit()
+        except Exception:
+            self.cnx.rollback()
+            raise
+        return total_rows
+
+    def query(self, sql, params=()):
+        # small lookups only, the rows are not counted as stage reads
+        return pd.read_sql(sql, self.cnx, params=params)
+
+    def write_query(self, select, table_name, if_exists='replace', params=(), input_tables=()):
+        '''
+        Writes the rows of the select statement to table_name inside the
+        database, with a CREATE TABLE AS SELECT or, when appending to an
+        existing table, an INSERT INTO ... SELECT, so the rows are never
+        loaded into pandas. As the content is not hashed, the version of the
+        table is derived from the statement, its parameters and the versions
+        of the input_tables it reads. Returns the number of rows written.
+        '''
+        previous_version = self.version(table_name) if if_exists == 'append' else None
+        hasher = hashlib.sha256(repr((select, tuple(params))).encode())
+        for input_table in input_tables:
+            hasher.update(f'{input_table}={self.version(input_table)}'.encode())
+
+        start = time.perf_counter()
+        try:
+            self.cnx.execute('BEGIN')
+            if if_exists == 'append' and self.exists(table_name):
+                columns = [d[0] for d in self.cnx.execute(f'SELECT * FROM ({select}) LIMIT 0', params).description]
+                insert = 'INSERT OR REPLACE' if KEY_COLUMN in columns else 'INSERT'
+                column_list = ', '.join(f'"{column}"' for column in columns)
+                total_rows = self.cnx.execute(f'{insert} INTO "{table_name}" ({column_list}) {select}', params).rowcount
+            else:
+                self.cnx.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+                self.cnx.execute(f'CREATE TABLE "{table_name}" AS {select}', params)
+                total_rows = self.cnx.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+            self.index_table(table_name)
+            self.cnx.commit()
+        except Exception:
+            self.cnx.rollback()
+            raise
+        IO_COUNTERS['rows_written'] += total_rows
+        IO_COUNTERS['sqlite_seconds'] += time.perf_counter() - start
+
+        self.record_version(table_name, hasher, previous_version)
+        return total_rows
+
+    def seen_fingerprints(self, fingerprints):
+        '''
+        Returns a boolean array telling which of the int64 fingerprints are
+        already stored, looked up through the primary key index.
+        '''
+        if not self.exists(FINGERPRINT_TABLE):
+            return np.zeros(len(fingerprints), dtype=bool)
+        # the DELETE and INSERT below open a transaction when none is open,
+        # it is ended here or the next BEGIN of write_table_chunks fails. A
+        # lookup from inside write_chunks stays in the transaction of the
+        # write, committing it would store the chunks written so far
+        in_transaction = self.cnx.in_transaction
+        self.cnx.execute('CREATE TEMP TABLE IF NOT EXISTS new_fingerprints (fingerprint INTEGER PRIMARY KEY)')
+        self.cnx.execute('DELETE FROM new_fingerprints')
+        self.cnx.executemany('INSERT OR IGNORE INTO new_fingerprints VALUES (?)', ((int(f),) for f in fingerprints))
+        seen = [row[0] for row in self.cnx.execute(
+            f'SELECT fingerprint FROM new_fingerprints JOIN "{FINGERPRINT_TABLE}" USING (fingerprint)')]
+        if not in_transaction:
+            self.cnx.commit()
+        return np.isin(fingerprints, np.array(seen, dtype=np.int64))
+
+    def add_fingerprints(self, fingerprints, reset=False):
+        # reset drops the fingerprints of the rows loaded before
+        if reset:
+            self.cnx.execute(f'DROP TABLE IF EXISTS "{FINGERPRINT_TABLE}"')
+        self.cnx.execute(f'CREATE TABLE IF NOT EXISTS "{FINGERPRINT_TABLE}" (fingerprint INTEGER PRIMARY KEY)')
+        self.cnx.executemany(f'INSERT OR IGNORE INTO "{FINGERPRINT_TABLE}" VALUES (?)',
+                             ((int(f),) for f in fingerprints))
+        self.cnx.commit()
+
+    def close(self):
+        self.cnx.close()
+
+
+###############################################################################
+# Define the parquet backend
+# ##############################################################################
+
+class ParquetStageStore(StageStore):
+    '''
+    Stores every stage as a directory of zstd compressed parquet files under
+    STAGE_STORE_DIRECTORY. Appends add a new file to the directory, replaces
+    build the new directory next to the old one and swap it in at the end.
+    '''
+
+    backend = 'parquet'
+
+    def __init__(self, directory, compression='zstd'):
+        self.directory = directory
+        self.sparse_directory = directory
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+
+    def table_path(self, table_name):
+        return os.path.join(self.directory, table_name)
+
+    def exists(self, table_name):
+        return os.path.isdir(self.table_path(table_name))
+
+    def schema(self, table_name):
+        # the part files of a table may disagree on columns that were all null
+        # in one of them, so the schema of the table is the unified schema of
+        # every part file
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        path = self.table_path(table_name)
+        schemas = [pq.read_schema(os.path.join(path, f)) for f in sorted(os.listdir(path)) if f.endswith('.parquet')]
+        if not schemas:
+            return pa.schema([])
+        return pa.unify_schemas(schemas, promote_options='permissive')
+
+    def columns(self, table_name):
+        return self.schema(table_name).names
+
+    def max_value(self, table_name, column):
+        import pyarrow.compute as pc
+        return pc.max(self.dataset(table_name)[0].to_table(columns=[column])[column]).as_py()
+
+    def read_table(self, table_name, columns=None, since=None):
+        dataset, row_filter = self.dataset(table_name, since)
+        return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+    def read_table_chunks(self, table_name, chunksize, columns=None, since=None):
+        dataset, row_filter = self.dataset(table_name, since)
+        for batch in dataset.to_batches(columns=columns, filter=row_filter, batch_size=chunksize):
+            if batch.num_rows:
+                yield batch.to_pandas()
+
+    def dataset(self, table_name, since=None):
+        # returns the pyarrow dataset of table_name and the filter keeping the
+        # rows with a created_date after since
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        schema = self.schema(table_name)
+        dataset = ds.dataset(self.table_path(table_name), schema=schema, format='parquet')
+        row_filter = None
+        if since is not None:
+            # created_date is a timestamp when the stage kept it as datetime64
+            if pa.types.is_timestamp(schema.field('created_date').type):
+                since = pd.Timestamp(since).to_pydatetime()
+            else:
+                since = str(since)
+            row_filter = ds.field('created_date') > since
+        return dataset, row_filter
+
+    def write_part(self, df, path, part_name):
+        df.to_parquet(os.path.join(path, f'part-{part_name}.parquet'),
+                      compression=self.compression, index=False)
+
+    def write_table(self, df, table_name, if_exists='replace'):
+        self.write_table_chunks([df], table_name, if_exists=if_exists)
+
+    def write_table_chunks(self, chunks, table_name, if_exists='replace'):
+        # one part file per chunk, written to a staging directory that is
+        # moved in place once every chunk is written
+        staging_path = self.table_path(f'.{table_name}.{uuid.uuid4().hex}')
+        os.makedirs(staging_path)
+        # part files are named after the write time and the chunk number so
+        # that reading the directory in name order gives the rows back in the
+        # order they were appended
+        write_time = time.time_ns()
+        total_rows = 0
+        try:
+            for part_number, chunk in enumerate(chunks):
+                self.write_part(chunk, staging_path, f'{write_time:020d}-{part_number:06d}')
+                total_rows += chunk.shape[0]
+            path = self.table_path(table_name)
+            if if_exists == 'append' and self.exists(table_name):
+                for f in os.listdir(staging_path):
+                    os.replace(os.path.join(staging_path, f), os.path.join(path, f))
+                shutil.rmtree(staging_path)
+            else:
+                if self.exists(table_name):
+                    old_path = self.table_path(f'.{table_name}.{uuid.uuid4().hex}.old')
+                    os.replace(path, old_path)
+                    os.replace(staging_path, path)
+                    shutil.rmtree(old_path)
+                else:
+                    os.replace(staging_path, path)
+        except Exception:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+        return total_rows
+
+    def fingerprint_path(self):
+        return os.path.join(self.directory, f'{FINGERPRINT_TABLE}.npy')
+
+    def seen_fingerprints(self, fingerprints):
+        '''
+        Returns a boolean array telling which of the int64 fingerprints are
+        already stored, by binary search in the memory mapped sorted array.
+        '''
+        if not os.path.isfile(self.fingerprint_path()):
+            return np.zeros(len(fingerprints), dtype=bool)
+        stored = np.load(self.fingerprint_path(), mmap_mode='r')
+        if stored.shape[0] == 0:
+            return np.zeros(len(fingerprints), dtype=bool)
+        positions = np.minimum(np.searchsorted(stored, fingerprints), stored.shape[0] - 1)
+        return np.asarray(stored[positions]) == fingerprints
+
+    def add_fingerprints(self, fingerprints, reset=False):
+        # reset drops the fingerprints of the rows loaded before
+        fingerprints = np.asarray(fingerprints, dtype=np.int64)
+        if not reset and os.path.isfile(self.fingerprint_path()):
+            fingerprints = np.concatenate([np.load(self.fingerprint_path()), fingerprints])
+        staging_path = os.path.join(self.directory, f'.{FINGERPRINT_TABLE}.{uuid.uuid4().hex}.npy')
+        np.save(staging_path, np.unique(fingerprints))
+        os.replace(staging_path, self.fingerprint_path())
+
+    def close(self):
+        pass
+
+
+###############################################################################
+# Define the function to open the configured stage store
+# ##############################################################################
+
+def get_stage_store(backend, db_path, db_file_name, directory):
+    '''
+    This function opens the stage store of the given backend.
+
+    INPUTS
+        backend : 'sqlite' or 'parquet', STAGE_STORE_BACKEND in constants.py
+        db_path : path where the sqlite db file is present
+        db_file_name : name of the sqlite db file
+        directory : directory of the parquet files, STAGE_STORE_DIRECTORY
+
+    OUTPUT
+        A SQLiteStageStore or ParquetStageStore, to be closed by the caller
+
+    SAMPLE USAGE
+        store = get_stage_store(STAGE_STORE_BACKEND, DB_PATH, DB_FILE_NAME, STAGE_STORE_DIRECTORY)
+    '''
+    if backend == 'sqlite':
+        return SQLiteStageStore(db_path, db_file_name)
+    if backend == 'parquet':
+        return ParquetStageStore(directory)
+    raise ValueError(f'Unknown stage store backend: {backend}')
@@ -0,0 +1,211 @@
+'''
+filename: telemetry.py
+functions: instrumented_stage, stage_metrics, write_prometheus_textfile
+
+Performance telemetry of the stages of the data, training and inference
+DAGs. Every instrumented stage appends one row to the 'pipeline_metrics'
+table of the stage store with
+    wall_seconds : elapsed time of the stage
+    cpu_seconds : cpu time of the stage, including the worker processes it
+                  waited for
+    peak_rss_mb : peak resident memory of the task process during the
+                  stage, on linux the peak is reset when the stage starts,
+                  elsewhere it is the peak of the task process so far
+    children_peak_rss_mb : largest peak resident memory of the worker
+                  processes the task process has waited for so far, e.g.
+                  the partition workers. It cannot be reset, it is a
+                  running maximum over the stages run in the task process
+                  and only concerns the stage when it grew during it
+    rows_in, rows_out : rows read and written through the stage store and
+                        the raw csv
+    bytes_read, bytes_written : in memory size of these rows
+    sqlite_seconds, parquet_seconds : time spent inside the stage store
+    status : 'success' or 'failed' when the stage raised
+
+so that a regression shows up as a change in the history of a stage.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import functools
+import inspect
+import os
+import resource
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+from Lead_scoring_data_pipeline.stage_store import IO_COUNTERS
+
+
+PIPELINE_METRICS_TABLE = 'pipeline_metrics'
+PROMETHEUS_PREFIX = 'lead_scoring_stage'
+
+
+###############################################################################
+# Define the functions to measure a stage
+# ##############################################################################
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def reset_peak_rss():
+    # writing 5 to clear_refs resets VmHWM, the peak resident memory of this
+    # process only, the peak of the children is kept by the kernel
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+# ru_maxrss is in kilobytes on linux and in bytes on macos
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_rss_mb():
+    # ru_maxrss is also carried over from the parent process on linux, so
+    # VmHWM is used there
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+    try:
+        with open('/proc/self/status') as f:
+            own = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        pass
+    return own / 2 ** 20
+
+
+def children_peak_rss_mb():
+    # the largest ru_maxrss of the waited for children, never reset
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * MAXRSS_UNIT / 2 ** 20
+
+
+def snapshot():
+    return dict(IO_COUNTERS, wall_seconds=time.perf_counter(), cpu_seconds=cpu_seconds())
+
+
+def stage_metrics(dag_name, stage_name, status, start, end):
+    '''
+    Returns the 'pipeline_metrics' row of a stage from the snapshots taken
+    before and after it.
+    '''
+    return pd.DataFrame({'run_at': [datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')],
+                         'dag': [dag_name],
+                         'stage': [stage_name],
+                         'status': [status],
+                         'wall_seconds': [end['wall_seconds'] - start['wall_seconds']],
+                         'cpu_seconds': [end['cpu_seconds'] - start['cpu_seconds']],
+                         'peak_rss_mb': [peak_rss_mb()],
+                         'children_peak_rss_mb': [children_peak_rss_mb()],
+                         'rows_in': [end['rows_read'] - start['rows_read']],
+                         'rows_out': [end['rows_written'] - start['rows_written']],
+                         'bytes_read': [end['bytes_read'] - start['bytes_read']],
+                         'bytes_written': [end['bytes_written'] - start['bytes_written']],
+                         'sqlite_seconds': [end['sqlite_seconds'] - start['sqlite_seconds']],
+                         'parquet_seconds': [end['parquet_seconds'] - start['parquet_seconds']]})
+
+
+def write_prometheus_textfile(metrics, directory):
+    '''
+    Writes the metrics of a stage as gauges to
+    directory/lead_scoring_<dag>_<stage>.prom, for the textfile collector of
+    the prometheus node exporter. The file is replaced atomically so that
+    the collector never reads half of it.
+    '''
+    row = metrics.iloc[0]
+    labels = f'dag="{row["dag"]}",stage="{row["stage"]}"'
+    lines = []
+    for column in metrics.columns:
+        if column in ('run_at', 'dag', 'stage', 'status'):
+            continue
+        lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{column} gauge')
+        lines.append(f'{PROMETHEUS_PREFIX}_{column}{{{labels}}} {float(row[column])}')
+    lines.append(f'# TYPE {PROMETHEUS_PREFIX}_success gauge')
+    lines.append(f'{PROMETHEUS_PREFIX}_success{{{labels}}} {int(row["status"] == "success")}')
+    lines.append(f'# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge')
+    lines.append(f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds{{{labels}}} {time.time()}')
+
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, f'lead_scoring_{row["dag"]}_{row["stage"]}.prom')
+    staging_path = os.path.join(directory, f'.{uuid.uuid4().hex}.prom.tmp')
+    with open(staging_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(staging_path, file_path)
+
+
+###############################################################################
+# Define the telemetry decorator
+# ##############################################################################
+
+def instrumented_stage(dag_name, open_store):
+    '''
+    This decorator records the performance metrics of a stage callable in
+    the 'pipeline_metrics' table.
+
+    INPUTS
+        dag_name : name of the DAG the stage belongs to
+        open_store : function returning the stage store of the pipeline
+
+    The stage is named after the function. Telemetry is turned on with
+    TELEMETRY_ENABLED and the prometheus export with
+    PROMETHEUS_TEXTFILE_DIRECTORY in the constants.py of the pipeline, read
+    from the globals of the stage function as in cached_stage. It is put
+    above cached_stage so that a cache hit is recorded as well.
+
+    SAMPLE USAGE
+        @instrumented_stage('data_pipeline', open_stage_store)
+        @cached_stage('map_city_tier', open_stage_store, ['loaded_data'], ['city_tier_mapped'])
+        def map_city_tier():
+            ...
+    '''
+    def decorator(func):
+        # the constants are those of the module of the stage, not of the
+        # decorators it is wrapped in
+        constants = inspect.unwrap(func).__globals__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not constants.get('TELEMETRY_ENABLED', False):
+                return func(*args, **kwargs)
+
+            reset_peak_rss()
+            start = snapshot()
+            status = 'failed'
+            try:
+                result = func(*args, **kwargs)
+                status = 'success'
+                return result
+            finally:
+                metrics = stage_metrics(dag_name, func.__name__, status, start, snapshot())
+                record_metrics(metrics, open_store, constants.get('PROMETHEUS_TEXTFILE_DIRECTORY'))
+        return wrapper
+    return decorator
+
+
+def record_metrics(metrics, open_store, textfile_directory=None):
+    # a failure to record the metrics must not fail the stage
+    try:
+        store = open_store()
+        try:
+            if store.exists(PIPELINE_METRICS_TABLE) and \
+                    set(metrics.columns) - set(store.columns(PIPELINE_METRICS_TABLE)):
+                # a table recorded before a metric was added is rewritten
+                # with the new column, empty for the old rows
+                history = store.read_table(PIPELINE_METRICS_TABLE)
+                store.write_table(pd.concat([history, metrics], ignore_index=True), PIPELINE_METRICS_TABLE)
+            else:
+                store.write_table(metrics, PIPELINE_METRICS_TABLE, if_exists='append')
+        finally:
+            store.close()
+        if textfile_directory is not None:
+            write_prometheus_textfile(metrics, textfile_directory)
+    except Exception as e:
+        print(f'Exception thrown in record_metrics : {e}')
@@ -4,9 +4,14 @@
 
 
 import pandas as pd
+import numpy as np
+from scipy import sparse
 import os
+import shutil
+import tempfile
 import sqlite3
 from sqlite3 import Error
+from concurrent.futures import ProcessPoolExecutor
 
 import warnings
 warnings.filterwarnings('ignore')
@@ -14,12 +19,175 @@ warnings.filterwarnings('ignore')
 from Lead_scoring_data_pipeline.mapping.significant_categorical_level import *
 from Lead_scoring_data_pipeline.constants import *
 from Lead_scoring_data_pipeline.mapping.city_tier_mapping import *
+from Lead_scoring_data_pipeline.schema import raw_data_contract, model_input_contract
+from Lead_scoring_data_pipeline.stage_store import get_stage_store, count_io
+from Lead_scoring_data_pipeline.stage_cache import cached_stage
+from Lead_scoring_data_pipeline.telemetry import instrumented_stage
+from Lead_scoring_data_pipeline.city_resolver import resolve_city_tiers
+
+MAPPING_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mapping')
+CITY_TIER_MAPPING_FILE = os.path.join(MAPPING_DIRECTORY, 'city_tier_mapping.py')
+CITY_RESOLVER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'city_resolver.py')
+SIGNIFICANT_CATEGORICAL_LEVEL_FILE = os.path.join(MAPPING_DIRECTORY, 'significant_categorical_level.py')
+# dag the stages are recorded under in the 'pipeline_metrics' table
+TELEMETRY_DAG = 'Lead_Scoring_Data_Engineering_Pipeline'
 
 
 def load_data(file_path):
     if 'test' in file_path:
-        return pd.read_csv(file_path)
-    return pd.read_csv(file_path,index_col=[0])
+        return count_io('read', pd.read_csv(file_path))
+    return count_io('read', pd.read_csv(file_path,index_col=[0]))
+
+def load_data_in_chunks(file_path, chunksize):
+    if 'test' in file_path:
+        chunks = pd.read_csv(file_path, chunksize=chunksize)
+    else:
+        chunks = pd.read_csv(file_path, index_col=[0], chunksize=chunksize)
+    return (count_io('read', chunk) for chunk in chunks)
+
+def fill_lead_nulls(df):
+    df['total_leads_droppped'] = df['total_leads_droppped'].fillna(0)
+    df['referred_lead'] = df['referred_lead'].fillna(0)
+    return df
+
+def dtype_plan(*contracts):
+    '''
+    Derives the pandas dtype of every column of the data contracts in
+    schema.py, the first contract wins when a column is in several of them.
+    Flags become uint8, counts int16 (the nullable UInt8 / Int16 when the
+    column may hold nulls), strings category and datetimes datetime64.
+    '''
+    plan = {}
+    for contract in reversed(contracts):
+        for column, spec in contract.items():
+            nullable = spec.get('nullable', True)
+            if 'storage' in spec:
+                plan[column] = spec['storage']
+            elif spec['dtype'] == 'datetime':
+                plan[column] = 'datetime64[ns]'
+            elif spec['dtype'] == 'string':
+                plan[column] = 'category'
+            elif set(spec.get('levels', [])) <= {0, 1} and 'levels' in spec:
+                plan[column] = 'UInt8' if nullable else 'uint8'
+            else:
+                plan[column] = 'Int16' if nullable else 'int16'
+    return plan
+
+DTYPE_PLAN = dtype_plan(raw_data_contract, model_input_contract)
+
+def apply_dtype_plan(df):
+    for column, dtype in DTYPE_PLAN.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        if dtype == 'datetime64[ns]':
+            df[column] = pd.to_datetime(df[column])
+        elif dtype == 'category':
+            df[column] = df[column].astype('category')
+        else:
+            # counts read back from sqlite with nulls are object columns of
+            # ints and None, through float64 they convert without a python
+            # loop over the values
+            values = df[column].astype('float64') if df[column].dtype == object else pd.to_numeric(df[column])
+            if dtype in ('Int16', 'UInt8') and values.dtype == np.float64:
+                df[column] = nullable_integers(values, dtype)
+            else:
+                df[column] = values.astype(dtype)
+    return df
+
+def nullable_integers(values, dtype):
+    # the nullable integer array built from the float values and their nan
+    # mask, astype checks every value for a missing value one by one
+    numbers = values.to_numpy()
+    mask = np.isnan(numbers)
+    filled = np.where(mask, 0, numbers)
+    integers = filled.astype(pd.api.types.pandas_dtype(dtype).numpy_dtype)
+    if not np.array_equal(integers, filled):
+        raise TypeError(f'cannot safely cast non-equivalent float64 to {dtype}')
+    return pd.Series(pd.arrays.IntegerArray(integers, mask), index=values.index, name=values.name)
+
+def compact_frame(df, memory=None):
+    '''
+    Converts df to the dtypes of DTYPE_PLAN when COMPACT_DTYPES is set. When
+    memory is given, the memory used by df before and after the conversion is
+    added to memory[0] and memory[1], see report_memory_saved.
+    '''
+    if not COMPACT_DTYPES:
+        return df
+    if memory is None or not DTYPE_MEMORY_REPORT:
+        return apply_dtype_plan(df)
+    memory[0] += df.memory_usage(deep=True).sum()
+    df = apply_dtype_plan(df)
+    memory[1] += df.memory_usage(deep=True).sum()
+    return df
+
+def report_memory_saved(stage, memory):
+    if COMPACT_DTYPES and DTYPE_MEMORY_REPORT:
+        print(f"{stage}: {memory[0] / 2**20:.2f} MB as read, {memory[1] / 2**20:.2f} MB with the dtype plan, "
+              f"{(memory[0] - memory[1]) / 2**20:.2f} MB saved")
+
+def row_fingerprints(df):
+    '''
+    Returns the 64-bit fingerprint of every row of df as int64. The columns
+    are hashed in name order, numbers as float64 and everything else as
+    text, so that a row gets the same fingerprint whatever dtypes its file
+    or chunk was read in. lead_id is not part of the row.
+    '''
+    canonical = {}
+    for column in sorted(key_free_columns(df)):
+        if pd.api.types.is_numeric_dtype(df[column]):
+            canonical[column] = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            canonical[column] = df[column].astype(str).to_numpy()
+    return pd.util.hash_pandas_object(pd.DataFrame(canonical), index=False).to_numpy().view(np.int64)
+
+def key_columns(df):
+    # lead_id, the key of the stage tables, when df has it
+    return ['lead_id'] if 'lead_id' in df.columns else []
+
+def key_free_columns(df):
+    return [column for column in df.columns if column != 'lead_id']
+
+def next_lead_id(store, if_exists):
+    # ids go on from the last loaded lead when appending, from 0 otherwise
+    if if_exists == 'append' and 'lead_id' in store.columns('loaded_data'):
+        last_lead_id = store.max_value('loaded_data', 'lead_id')
+        if last_lead_id is not None:
+            return int(last_lead_id) + 1
+    return 0
+
+def assign_lead_ids(df, first_lead_id):
+    '''
+    Inserts the lead_id column in front of df, numbering its rows from
+    first_lead_id in file order.
+    '''
+    df.insert(0, 'lead_id', np.arange(first_lead_id, first_lead_id + df.shape[0], dtype=np.int64))
+    return df
+
+def drop_loaded_rows(store, df, check_history, run_fingerprints):
+    '''
+    Drops the rows of df whose fingerprint was already loaded earlier in
+    this run (run_fingerprints) or, when check_history, in an earlier run
+    (the fingerprints of the stage store), and adds the fingerprints of the
+    kept rows to run_fingerprints. run_fingerprints is a one item list with
+    the sorted int64 array of the fingerprints of the run, looked up by
+    binary search. Only the fingerprints of df are looked up, the rows
+    loaded before are never read.
+    '''
+    fingerprints = row_fingerprints(df)
+    keep = ~pd.Series(fingerprints).duplicated().to_numpy()
+    loaded = run_fingerprints[0]
+    if loaded.shape[0]:
+        # searched in sorted order, the binary searches then stay in cache
+        order = np.argsort(fingerprints)
+        ordered = fingerprints[order]
+        positions = np.minimum(np.searchsorted(loaded, ordered), loaded.shape[0] - 1)
+        keep[order[loaded[positions] == ordered]] = False
+    if check_history:
+        keep &= ~store.seen_fingerprints(fingerprints)
+    # the kept fingerprints are new to the run, they are merged in sorted
+    kept = np.sort(fingerprints[keep])
+    run_fingerprints[0] = np.insert(loaded, np.searchsorted(loaded, kept), kept)
+    return df[keep]
 
 def check_if_table_has_value(cnx, table_name):
     check_table = pd.read_sql(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}';", cnx).shape[0]
@@ -28,10 +196,60 @@ def check_if_table_has_value(cnx, table_name):
     else:
         return False
 
+def open_stage_store():
+    return get_stage_store(STAGE_STORE_BACKEND, DB_PATH, DB_FILE_NAME, STAGE_STORE_DIRECTORY)
+
+def get_watermark(store, table_name):
+    if not store.exists(WATERMARK_TABLE):
+        return None
+    watermarks = store.read_table(WATERMARK_TABLE)
+    watermarks = watermarks[watermarks['table_name'] == table_name]
+    return watermarks['high_water_mark'].iloc[0] if watermarks.shape[0] else None
+
+def set_watermark(store, table_name, df):
+    # created_date is stored as 'YYYY-MM-DD HH:MM:SS' text so max() and the
+    # '>' comparison in read_incremental follow the chronological order
+    if df.shape[0] == 0:
+        return
+    watermark = pd.DataFrame({'table_name': [table_name], 'high_water_mark': [str(df['created_date'].max())]})
+    if store.exists(WATERMARK_TABLE):
+        watermarks = store.read_table(WATERMARK_TABLE)
+        watermark = pd.concat([watermarks[watermarks['table_name'] != table_name], watermark])
+    store.write_table(watermark, WATERMARK_TABLE)
+
+def incremental_watermark(store, output_table):
+    # high water mark of the rows already processed into output_table, None
+    # when the whole table is rebuilt
+    if INCREMENTAL_LOAD and store.exists(output_table):
+        return get_watermark(store, output_table)
+    return None
+
+def read_incremental(store, input_table, output_table):
+    '''
+    Reads the rows of input_table that the stage writing output_table has not
+    processed yet. Returns the dataframe together with the write mode the
+    stage should use, 'append' for an incremental batch and 'replace' when
+    the whole table is rebuilt.
+    '''
+    watermark = incremental_watermark(store, output_table)
+    if watermark is None:
+        df, if_exists = store.read(input_table), 'replace'
+    else:
+        print(f"Reading rows of {input_table} created after {watermark}")
+        df, if_exists = store.read(input_table, since=watermark), 'append'
+
+    # the store gives back int64 / float64 / object columns, convert them to
+    # the dtype plan again
+    memory = [0, 0]
+    df = compact_frame(df, memory)
+    report_memory_saved(f"{input_table} read for {output_table}", memory)
+    return df, if_exists
+
 ###############################################################################
 # Define the function to build database
 # ##############################################################################
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
 def build_dbs():
     '''
     This function checks if the db file with specified name is present 
@@ -82,6 +300,9 @@ def build_dbs():
 # Define function to load the csv file to the database
 # ##############################################################################
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+@cached_stage('load_data_into_db', open_stage_store, [], ['loaded_data'],
+              files=[lambda: f"{DATA_DIRECTORY}{DATA_FILE}"])
 def load_data_into_db():
     '''
     Thie function loads the data present in data directory into the db
@@ -89,43 +310,122 @@ def load_data_into_db():
     It also replaces any null values present in 'toal_leads_dropped' and
     'referred_lead' columns with 0.
 
+    If LOAD_CHUNKSIZE is set the csv is streamed in chunks of that many rows,
+    each chunk is processed on its own and appended to 'loaded_data', so the
+    peak memory does not depend on the size of the file. All the chunks are
+    written in a single transaction, readers keep seeing the previous table
+    until the whole file has been loaded.
+
+    With INCREMENTAL_LOAD only the rows created after the high water mark of
+    'loaded_data' are appended to the existing table and the mark is moved to
+    the newest created_date that was loaded.
+
+    With COMPACT_DTYPES the rows are converted to the dtypes of DTYPE_PLAN
+    before they are stored.
+
+    With ROW_FINGERPRINTS every row is fingerprinted with a 64-bit hash and
+    the rows already loaded are dropped: duplicates within the file and,
+    when appending, rows loaded by an earlier run. The fingerprints are kept
+    in the stage store and are rebuilt when 'loaded_data' is replaced.
+
+    Every loaded row gets a lead_id, numbered in file order and going on
+    from the last loaded lead when appending. The later stages carry it
+    through to 'model_input', 'features', 'target' and 'predictions', and
+    it is the primary key of the stage tables.
+
 
     INPUTS
         DB_FILE_NAME : Name of the database file
         DB_PATH : path where the db file should be
-        DATA_DIRECTORY : path of the directory where 'leadscoring.csv' 
+        DATA_DIRECTORY : path of the directory where 'leadscoring.csv'
                         file is present
-        
+        LOAD_CHUNKSIZE : number of rows read per chunk, None to read the
+                        whole file at once
+        INCREMENTAL_LOAD : append only the rows newer than the stored
+                        high water mark
+        ROW_FINGERPRINTS : drop the rows that were already loaded
+
 
     OUTPUT
         Saves the processed dataframe in the db in a table named 'loaded_data'.
-        If the table with the same name already exsists then the function 
+        If the table with the same name already exsists then the function
         replaces it.
 
 
     SAMPLE USAGE
         load_data_into_db()
     '''
-    
+
+    store = None
     try:
-        cnx = sqlite3.connect(DB_PATH + DB_FILE_NAME)
+        store = open_stage_store()
 
-        
-        print("Loading data from " + f"{DATA_DIRECTORY}{DATA_FILE}")
-        df_lead_scoring = load_data(f"{DATA_DIRECTORY}{DATA_FILE}")
+        watermark = None
+        if INCREMENTAL_LOAD and store.exists('loaded_data'):
+            watermark = get_watermark(store, 'loaded_data')
+            print("Loading rows created after " + str(watermark))
+        if_exists = 'replace' if watermark is None else 'append'
 
-        print("Processing total_leads_droppped and referred_lead columns")    
-        df_lead_scoring['total_leads_droppped'] = df_lead_scoring['total_leads_droppped'].fillna(0)
-        df_lead_scoring['referred_lead'] = df_lead_scoring['referred_lead'].fillna(0)
+        run_fingerprints = [np.empty(0, dtype=np.int64)]
+        first_lead_id = next_lead_id(store, if_exists)
+
+        if LOAD_CHUNKSIZE is None:
+            print("Loading data from " + f"{DATA_DIRECTORY}{DATA_FILE}")
+            df_lead_scoring = load_data(f"{DATA_DIRECTORY}{DATA_FILE}")
+            if watermark is not None:
+                df_lead_scoring = df_lead_scoring[df_lead_scoring['created_date'] > watermark]
+            if ROW_FINGERPRINTS:
+                total_rows = df_lead_scoring.shape[0]
+                df_lead_scoring = drop_loaded_rows(store, df_lead_scoring, if_exists == 'append', run_fingerprints)
+                print(f"Dropped {total_rows - df_lead_scoring.shape[0]} rows that were already loaded")
+
+            print("Processing total_leads_droppped and referred_lead columns")
+            df_lead_scoring = assign_lead_ids(fill_lead_nulls(df_lead_scoring), first_lead_id)
+            memory = [0, 0]
+            df_lead_scoring = compact_frame(df_lead_scoring, memory)
+            report_memory_saved('load_data_into_db', memory)
+
+            print("Storing processed df to loaded_data table")
+            store.write(df_lead_scoring, 'loaded_data', if_exists=if_exists)
+            set_watermark(store, 'loaded_data', df_lead_scoring)
+        else:
+            print("Streaming data from " + f"{DATA_DIRECTORY}{DATA_FILE}" + f" in chunks of {LOAD_CHUNKSIZE} rows")
+            high_water_marks = []
+            memory = [0, 0]
+            dropped_rows = [0]
+            lead_ids = [first_lead_id]
+
+            def processed_chunks():
+                for chunk in load_data_in_chunks(f"{DATA_DIRECTORY}{DATA_FILE}", LOAD_CHUNKSIZE):
+                    if watermark is not None:
+                        chunk = chunk[chunk['created_date'] > watermark]
+                    if ROW_FINGERPRINTS:
+                        chunk_rows = chunk.shape[0]
+                        chunk = drop_loaded_rows(store, chunk, if_exists == 'append', run_fingerprints)
+                        dropped_rows[0] += chunk_rows - chunk.shape[0]
+                    if chunk.shape[0] == 0:
+                        continue
+                    high_water_marks.append(chunk['created_date'].max())
+                    chunk = assign_lead_ids(fill_lead_nulls(chunk), lead_ids[0])
+                    lead_ids[0] += chunk.shape[0]
+                    yield compact_frame(chunk, memory)
+
+            total_rows = store.write_chunks(processed_chunks(), 'loaded_data', if_exists=if_exists)
+            set_watermark(store, 'loaded_data', pd.DataFrame({'created_date': high_water_marks}))
+            print(f"Stored {total_rows} processed rows to loaded_data table")
+            if ROW_FINGERPRINTS:
+                print(f"Dropped {dropped_rows[0]} rows that were already loaded")
+            report_memory_saved('load_data_into_db', memory)
+
+        if ROW_FINGERPRINTS:
+            # only once the rows are stored, a failed load must not mark them as loaded
+            store.add_fingerprints(run_fingerprints[0], reset=if_exists == 'replace')
 
-        print("Storing processed df to loaded_data table")    
-        df_lead_scoring.to_sql(name='loaded_data', con=cnx, if_exists='replace', index=False)    
-        
     except Exception as e:
         print (f'Exception thrown in load_data_into_db : {e}')
     finally:
-        if cnx:        
-            cnx.close()
+        if store:
+            store.close()
 
 
 
@@ -133,7 +433,24 @@ def load_data_into_db():
 # Define function to map cities to their respective tiers
 # ##############################################################################
 
-    
+
+def apply_city_tier_mapping(df, store=None):
+    # the tiers are resolved once per distinct city and broadcast through the
+    # categorical codes, null cities are tier 3 through the trailing 3.0
+    # picked by their code -1
+    cities = df["city_mapped"].astype('category')
+    tiers = resolve_city_tiers(cities.cat.categories, store if CITY_RESOLUTION_CACHE else None,
+                               CITY_FUZZY_THRESHOLD)
+    tiers = np.append(tiers, 3.0)
+    df["city_tier"] = tiers[cities.cat.codes.to_numpy()]
+
+    # we do not need city_mapped later
+    return compact_frame(df.drop(['city_mapped'], axis = 1))
+
+
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+@cached_stage('map_city_tier', open_stage_store, ['loaded_data'], ['city_tier_mapped'],
+              files=[CITY_TIER_MAPPING_FILE, CITY_RESOLVER_FILE])
 def map_city_tier():
     '''
     This function maps all the cities to their respective tier as per the
@@ -142,11 +459,21 @@ def map_city_tier():
     file then the function maps that particular city to 3.0 which represents
     tier-3.
 
+    The cities are matched through city_resolver.py, which normalizes the
+    names, follows city_aliases, drops suffixes like 'hq' and falls back to
+    a trigram fuzzy match (CITY_FUZZY_THRESHOLD). Each distinct city is
+    resolved once and, with CITY_RESOLUTION_CACHE, remembered in the
+    'city_resolution_cache' table.
+
+    With SQL_PUSHDOWN and the sqlite store the table is built inside the db
+    by map_city_tier_in_db, joining the rows to the resolved tiers.
+
 
     INPUTS
         DB_FILE_NAME : Name of the database file
         DB_PATH : path where the db file should be
         city_tier_mapping : a dictionary that maps the cities to their tier
+        city_aliases : other names of the cities in city_tier_mapping
 
     
     OUTPUT
@@ -154,39 +481,74 @@ def map_city_tier():
         'city_tier_mapped'. If the table with the same name already 
         exsists then the function replaces it.
 
+        With INCREMENTAL_LOAD only the rows created after the high water mark
+        of the output table are processed and appended to it.
+
     
     SAMPLE USAGE
         map_city_tier()
 
     '''
     
+    store = None
     try:
-        cnx = sqlite3.connect(DB_PATH + DB_FILE_NAME)
-        
+        store = open_stage_store()
+
+        if use_pushdown(store):
+            print("Mapping city_mapped to tiers inside the db")
+            total_rows = map_city_tier_in_db(store)
+            print(f"Stored {total_rows} mapped rows to table city_tier_mapped")
+            return
+
         print("Loading loaded_data table")
-        loaded_data = pd.read_sql('select * from loaded_data', cnx)        
+        loaded_data, if_exists = read_incremental(store, 'loaded_data', 'city_tier_mapped')
 
         print("Mapping city_mapped to tiers")
-        loaded_data["city_tier"] = loaded_data["city_mapped"].map(city_tier_mapping)
-        loaded_data["city_tier"] = loaded_data["city_tier"].fillna(3.0)
-
-        # we do not need city_mapped later
-        loaded_data = loaded_data.drop(['city_mapped'], axis = 1)
+        if use_partitions(loaded_data):
+            warm_city_resolution(loaded_data, store)
+            loaded_data = run_partitioned(loaded_data, apply_city_tier_mapping)
+        else:
+            loaded_data = apply_city_tier_mapping(loaded_data, store)
 
         print("Storing mapped df to table city_tier_mapped")
-        loaded_data.to_sql(name='city_tier_mapped', con=cnx, if_exists='replace', index=False)
-        
+        store.write(loaded_data, 'city_tier_mapped', if_exists=if_exists)
+        set_watermark(store, 'city_tier_mapped', loaded_data)
+
     except Exception as e:
         print (f'Exception thrown in map_city_tier : {e}')
     finally:
-        if cnx:        
-            cnx.close()
+        if store:
+            store.close()
 
 ###############################################################################
 # Define function to map insignificant categorial variables to "others"
 # ##############################################################################
 
+def bucket_categorical_column(series, levels):
+    # levels outside the significant list (and nulls) get code -1 from
+    # Categorical, which is then pointed at the trailing 'others' category
+    categories = list(levels) + ['others']
+    codes = pd.Categorical(series, categories=categories).codes.copy()
+    codes[codes == -1] = len(levels)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+def apply_categorical_mapping(df, drop_duplicates=None, dedup_keys=None):
+    # all the levels below 90 percentage are assgined to a single level called
+    # others, the columns are rewritten in place so the row order is kept
+    for column, levels in significant_levels.items():
+        df[column] = bucket_categorical_column(df[column], levels)
+
+    if drop_duplicates is None:
+        drop_duplicates = DROP_DUPLICATES
+    if drop_duplicates:
+        # rows are duplicates whatever their lead_id
+        df = df.drop_duplicates(subset=dedup_keys or DEDUP_KEYS or key_free_columns(df))
+    return df
+
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+@cached_stage('map_categorical_vars', open_stage_store, ['city_tier_mapped'], ['categorical_variables_mapped'],
+              files=[SIGNIFICANT_CATEGORICAL_LEVEL_FILE])
 def map_categorical_vars():
     '''
     This function maps all the insignificant variables present in 'first_platform_c'
@@ -201,12 +563,19 @@ def map_categorical_vars():
         list_platform : list of all the significant platform.
         list_medium : list of all the significat medium
         list_source : list of all rhe significant source
+        DROP_DUPLICATES : drop the duplicate rows after mapping
+        DEDUP_KEYS : columns compared to find duplicates, None for all columns
 
         **NOTE : list_platform, list_medium & list_source are all constants and
                  must be stored in 'significant_categorical_level.py'
                  file. The significant levels are calculated by taking top 90
                  percentils of all the levels. For more information refer
                  'data_cleaning.ipynb' notebook.
+
+        The three columns are bucketed in place through categorical codes, so
+        the rows keep the order of 'city_tier_mapped'. With SQL_PUSHDOWN and
+        the sqlite store they are bucketed inside the db by
+        map_categorical_vars_in_db instead.
   
 
     OUTPUT
@@ -214,61 +583,107 @@ def map_categorical_vars():
         'categorical_variables_mapped'. If the table with the same name already 
         exsists then the function replaces it.
 
+        With INCREMENTAL_LOAD only the rows created after the high water mark
+        of the output table are processed and appended to it.
+
     
     SAMPLE USAGE
         map_categorical_vars()
     '''
+    store = None
     try:
-        cnx = sqlite3.connect(DB_PATH + DB_FILE_NAME)
-        
+        store = open_stage_store()
+
+        if use_pushdown(store):
+            print('Mapping first_platform_c, first_utm_medium_c, first_utm_source_c inside the db')
+            total_rows = map_categorical_vars_in_db(store)
+            print(f"Stored {total_rows} mapped rows to table categorical_variables_mapped")
+            return
+
         print("Loading city_tier_mapped table")
-        city_tier_mapped = pd.read_sql('select * from city_tier_mapped', cnx)        
+        city_tier_mapped, if_exists = read_incremental(store, 'city_tier_mapped', 'categorical_variables_mapped')
 
         print('Mapping first_platform_c, first_utm_medium_c, first_utm_source_c')
-        # all the levels below 90 percentage are assgined to a single level called others
-        # get rows for levels which are not present in list_platform
-        new_df = city_tier_mapped[~city_tier_mapped['first_platform_c'].isin(list_platform)] 
-        new_df['first_platform_c'] = "others" # replace the value of these levels to others
-        # get rows for levels which are present in list_platform
-        old_df = city_tier_mapped[city_tier_mapped['first_platform_c'].isin(list_platform)] 
-        city_tier_mapped = pd.concat([new_df, old_df]) # concatenate new_df and old_df to get the final dataframe
-
-
-        # all the levels below 90 percentage are assgined to a single level called others
-        # get rows for levels which are not present in list_medium
-        new_df = city_tier_mapped[~city_tier_mapped['first_utm_medium_c'].isin(list_medium)] 
-        new_df['first_utm_medium_c'] = "others" # replace the value of these levels to others
-        # get rows for levels which are present in list_medium
-        old_df = city_tier_mapped[city_tier_mapped['first_utm_medium_c'].isin(list_medium)] 
-        city_tier_mapped = pd.concat([new_df, old_df]) # concatenate new_df and old_df to get the final dataframe
-
-
-        # all the levels below 90 percentage are assgined to a single level called others
-        # get rows for levels which are not present in list_source
-        new_df = city_tier_mapped[~city_tier_mapped['first_utm_source_c'].isin(list_source)] 
-        new_df['first_utm_source_c'] = "others" # replace the value of these levels to others
-        # get rows for levels which are present in list_source
-        old_df = city_tier_mapped[city_tier_mapped['first_utm_source_c'].isin(list_source)] 
-        city_tier_mapped = pd.concat([new_df, old_df]) # concatenate new_df and old_df to get the final dataframe
-
-        city_tier_mapped = city_tier_mapped.drop_duplicates()                    
+        if use_partitions(city_tier_mapped):
+            city_tier_mapped = run_partitioned(city_tier_mapped, apply_categorical_mapping)
+        else:
+            city_tier_mapped = apply_categorical_mapping(city_tier_mapped)
+
         print("Storing mapped df to table categorical_variables_mapped")
-        city_tier_mapped.to_sql(name='categorical_variables_mapped', con=cnx, if_exists='replace', index=False)   
-        
+        store.write(city_tier_mapped, 'categorical_variables_mapped', if_exists=if_exists)
+        set_watermark(store, 'categorical_variables_mapped', city_tier_mapped)
+
     except Exception as e:
         print (f'Exception thrown in map_categorical_vars : {e}')
     finally:
-        if cnx:        
-            cnx.close()
+        if store:
+            store.close()
 
 
 ##############################################################################
 # Define function that maps interaction columns into 4 types of interactions
 # #############################################################################
+def load_interaction_matrix(file_path):
+    '''
+    Compiles the interaction mapping file into a sparse 0/1 matrix with one
+    row per interaction column and one column per interaction group, so that
+    the grouped sums of a lead are its interaction values times the matrix.
+    Returns the interaction columns, the (sorted) group names and the matrix.
+    '''
+    df_event_mapping = pd.read_csv(file_path, index_col=[0]).dropna(subset=['interaction_mapping'])
+    interaction_types = df_event_mapping.index.tolist()
+    groups = sorted(df_event_mapping['interaction_mapping'].unique())
+    group_position = {group: i for i, group in enumerate(groups)}
+    columns = [group_position[group] for group in df_event_mapping['interaction_mapping']]
+    matrix = sparse.csr_matrix((np.ones(len(columns)), (np.arange(len(columns)), columns)),
+                               shape=(len(interaction_types), len(groups)))
+    return interaction_types, groups, matrix
+
+def apply_interactions_mapping(df, interaction_matrix):
+    '''
+    Maps the interaction columns of df into the interaction groups compiled by
+    load_interaction_matrix. Every lead keeps its own row. Returns the mapped
+    dataframe along with the trimmed 'model_input' dataframe.
+    '''
+    #check if 'app_complete_flag' is present in the dataframe and if it is
+    #present use the index columns with 'app_complete_flag' else use the
+    #inference index columns which do not have it.
+    if 'app_complete_flag' in df.columns:
+        index_columns = INDEX_COLUMNS
+    else:
+        index_columns = INDEX_COLUMNS_INFERENCE
+
+    interaction_types, groups, matrix = interaction_matrix
+    present = [i for i, column in enumerate(interaction_types) if column in df.columns]
+
+    print("Summing the interaction columns into their interaction groups")
+    # nulls in the interaction columns count as no interaction
+    values = df[[interaction_types[i] for i in present]].to_numpy(dtype=np.float64, na_value=0)
+    group_sums = values @ matrix[present]
+    if COMPACT_DTYPES:
+        # int32 as a group sums up to ~40 int16 counts
+        group_sums = group_sums.astype(np.int32)
+
+    # the rows keep the index of df, so that partitions can be merged back
+    df_mapped = df[key_columns(df) + index_columns].copy()
+    df_mapped[groups] = group_sums
+
+    print("Selecting a smaller subset of columns for model traning part, excluding created_date")
+    # these columns were derived after rapid expermentation where we excluded columns with relatively low significance
+    dataset_trimmed = df_mapped[key_columns(df) + index_columns[1:]]
+    return df_mapped, dataset_trimmed
+
+
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+@cached_stage('interactions_mapping', open_stage_store, ['categorical_variables_mapped'],
+              ['interactions_mapped', 'model_input'], files=[lambda: INTERACTION_MAPPING])
 def interactions_mapping():
     '''
     This function maps the interaction columns into 4 unique interaction columns
     These mappings are present in 'interaction_mapping.csv' file. 
+    The mapping file is compiled into a 0/1 matrix and the grouped interaction
+    sums of every lead are computed as one matrix product, each lead keeps its
+    own row.
 
 
     INPUTS
@@ -276,10 +691,10 @@ def interactions_mapping():
         DB_PATH : path where the db file should be present
         INTERACTION_MAPPING : path to the csv file containing interaction's
                                    mappings
-        INDEX_COLUMNS_TRAINING : list of columns to be used as index while pivoting and
-                                 unpivoting during training
-        INDEX_COLUMNS_INFERENCE: list of columns to be used as index while pivoting and
-                                 unpivoting during inference
+        INDEX_COLUMNS : list of columns kept next to the interaction groups
+                        during training
+        INDEX_COLUMNS_INFERENCE: list of columns kept next to the interaction groups
+                                 during inference
         NOT_FEATURES: Features which have less significance and needs to be dropped
                                  
         NOTE : Since while inference we will not have 'app_complete_flag' which is
@@ -298,51 +713,399 @@ def interactions_mapping():
         It also drops all the features that are not requried for training model and 
         writes it in a table named 'model_input'
 
+        With INCREMENTAL_LOAD only the rows created after the high water mark
+        of the output table are processed and appended to it.
+
+        With INTERACTIONS_OUT_OF_CORE the table is processed in chunks that
+        are spilled to disk, see map_interactions_out_of_core.
+
     
     SAMPLE USAGE
         interactions_mapping()
     '''
     
-    print("Connecting to database")
-    cnx = sqlite3.connect(DB_PATH + DB_FILE_NAME)
+    print("Connecting to stage store")
+    store = open_stage_store()
+    if INTERACTIONS_OUT_OF_CORE:
+        try:
+            map_interactions_out_of_core(store, load_interaction_matrix(INTERACTION_MAPPING))
+        finally:
+            print("Closing stage store")
+            store.close()
+        return
+
     print("Reading data from categorical_variables_mapped table")
-    categorical_variables_mapped = pd.read_sql('select * from categorical_variables_mapped', cnx)
+    categorical_variables_mapped, if_exists = read_incremental(store, 'categorical_variables_mapped', 'interactions_mapped')
+    if categorical_variables_mapped.shape[0] == 0:
+        print("No new rows in categorical_variables_mapped table")
+        store.close()
+        return
     
     # read the interaction mapping file
-    print("Reading interaction_mapping from categorical_variables_mapped table")
-    df_event_mapping = pd.read_csv(INTERACTION_MAPPING, index_col=[0])
-    
-    #check if 'app_complete_flag' is present in 'categorical_variables_mapped' table and 
-    #if it is present pass a list with 'app_complete_flag' in it as index_column else 
-    #pass a list without 'app_complete_flag' in it.
-    if 'app_complete_flag' not in categorical_variables_mapped.columns.tolist():
-        index_columns.remove('app_complete_flag')
-    
-    print("Unpivoting the interaction columns and put the values in rows")
-    df_unpivot = pd.melt(categorical_variables_mapped, id_vars=INDEX_COLUMNS, 
-                         var_name='interaction_type', value_name='interaction_value')
-    print("Handling the nulls in the interaction value column")
-    df_unpivot['interaction_value'] = df_unpivot['interaction_value'].fillna(0)
-    print("Mapping interaction type column with the mapping file to get interaction mapping")
-    df = pd.merge(df_unpivot, df_event_mapping, on='interaction_type', how='left')
-    print("Dropping the interaction type column as it is not needed")
-    df = df.drop(['interaction_type'], axis=1)
-    print("Pivoting the interaction mapping column values to individual columns in the dataset")
-    df_pivot = df.pivot_table(values='interaction_value', index=INDEX_COLUMNS, columns='interaction_mapping', aggfunc='sum')
-    df_pivot = df_pivot.reset_index()
-    
+    print("Reading interaction_mapping file")
+    interaction_matrix = load_interaction_matrix(INTERACTION_MAPPING)
+
+    if use_partitions(categorical_variables_mapped):
+        df_mapped, dataset_trimmed = run_partitioned(categorical_variables_mapped, apply_interactions_mapping,
+                                                     interaction_matrix)
+    else:
+        df_mapped, dataset_trimmed = apply_interactions_mapping(categorical_variables_mapped, interaction_matrix)
+
     print("Saving the processed dataframe in the db in a table named 'interactions_mapped'")
-    df_pivot.to_sql(name='interactions_mapped', con=cnx, if_exists='replace',index=False)
-    
-    print("Selecting a smaller subset of columns for model traning part, excluding created_date")
-    # these columns were derived after rapid expermentation where we excluded columns with relatively low significance
-    dataset_trimmed = df_pivot[INDEX_COLUMNS[1:]]
+    store.write(df_mapped, 'interactions_mapped', if_exists=if_exists)
+
     print("Storing shortened df to table model_input")
-    dataset_trimmed.to_sql(name='model_input', con=cnx, if_exists='replace', index=False) 
-    
-    print("Closing database connection")
-    cnx.close()
-    
+    store.write(dataset_trimmed, 'model_input', if_exists=if_exists)
+    set_watermark(store, 'interactions_mapped', df_mapped)
 
-    
-   
+    print("Closing stage store")
+    store.close()
+
+
+
+##############################################################################
+# Define functions that map the interactions out of core
+# #############################################################################
+def spill_chunk(df, spill_directory, chunk_number, partitions):
+    # hash partitions the rows by their index columns, so that all the rows
+    # of a group end up in the same partition
+    index_columns = [column for column in INDEX_COLUMNS if column in df.columns]
+    if partitions == 1:
+        keys = np.zeros(df.shape[0], dtype=np.int64)
+    else:
+        keys = pd.util.hash_pandas_object(df[index_columns], index=False).to_numpy() % partitions
+    for partition, positions in pd.Series(np.arange(df.shape[0])).groupby(keys).indices.items():
+        partition_directory = os.path.join(spill_directory, f'partition-{partition:04d}')
+        os.makedirs(partition_directory, exist_ok=True)
+        df.iloc[positions].to_pickle(os.path.join(partition_directory, f'chunk-{chunk_number:06d}.pkl'))
+
+def spilled_files(spill_directory):
+    for partition_directory in sorted(os.listdir(spill_directory)):
+        files = sorted(os.listdir(os.path.join(spill_directory, partition_directory)))
+        yield [os.path.join(spill_directory, partition_directory, f) for f in files]
+
+def aggregate_partition(files):
+    # sums the interaction groups of the rows sharing the same index columns,
+    # the group keeps the lead_id of its first lead
+    df = compact_frame(pd.concat([pd.read_pickle(f) for f in files], ignore_index=True))
+    index_columns = [column for column in INDEX_COLUMNS if column in df.columns]
+    groups = [column for column in key_free_columns(df) if column not in index_columns]
+    aggregations = dict.fromkeys(groups, 'sum')
+    aggregations.update(dict.fromkeys(key_columns(df), 'min'))
+    df = df.groupby(index_columns, sort=True, dropna=False, observed=True).agg(aggregations).reset_index()
+    return df[key_columns(df) + index_columns + groups]
+
+def map_interactions_out_of_core(store, interaction_matrix):
+    '''
+    This function maps the interactions of 'categorical_variables_mapped'
+    without holding the table in memory. It is read in chunks of
+    INTERACTIONS_CHUNKSIZE rows, every chunk is mapped and spilled to a
+    temporary directory under SPILL_DIRECTORY, then the spilled chunks are
+    streamed into 'interactions_mapped' and 'model_input'. Spilling keeps the
+    stage store from being read and written at the same time.
+
+    With INTERACTIONS_GROUP_BY_INDEX the rows sharing the same INDEX_COLUMNS
+    are collapsed into one row with the sum of their interaction groups. The
+    mapped chunks are then hash partitioned by the index columns into
+    SPILL_PARTITIONS partitions and every partition is grouped on its own,
+    so only one partition is in memory at a time.
+
+    SAMPLE USAGE
+        map_interactions_out_of_core(store, load_interaction_matrix(INTERACTION_MAPPING))
+    '''
+    watermark = incremental_watermark(store, 'interactions_mapped')
+    if_exists = 'replace' if watermark is None else 'append'
+    if watermark is not None:
+        print(f"Reading rows of categorical_variables_mapped created after {watermark}")
+
+    spill_directory = tempfile.mkdtemp(prefix='interactions_mapping-', dir=SPILL_DIRECTORY)
+    try:
+        print(f"Mapping categorical_variables_mapped in chunks of {INTERACTIONS_CHUNKSIZE} rows")
+        partitions = SPILL_PARTITIONS if INTERACTIONS_GROUP_BY_INDEX else 1
+        high_water_marks = []
+        chunks = store.read_chunks('categorical_variables_mapped', INTERACTIONS_CHUNKSIZE, since=watermark)
+        for chunk_number, chunk in enumerate(chunks):
+            if chunk.shape[0] == 0:
+                continue
+            chunk = compact_frame(chunk)
+            high_water_marks.append(chunk['created_date'].max())
+            df_mapped, _ = apply_interactions_mapping(chunk, interaction_matrix)
+            spill_chunk(df_mapped, spill_directory, chunk_number, partitions)
+        if not high_water_marks:
+            print("No new rows in categorical_variables_mapped table")
+            return
+
+        output_files = []
+
+        def mapped_chunks():
+            for files in spilled_files(spill_directory):
+                if INTERACTIONS_GROUP_BY_INDEX:
+                    df_mapped = aggregate_partition(files)
+                    output_files.append(files[0] + '.grouped')
+                    df_mapped.to_pickle(output_files[-1])
+                    yield df_mapped
+                else:
+                    for f in files:
+                        output_files.append(f)
+                        yield pd.read_pickle(f)
+
+        print("Saving the processed dataframe in the db in a table named 'interactions_mapped'")
+        total_rows = store.write_chunks(mapped_chunks(), 'interactions_mapped', if_exists=if_exists)
+        print(f"Stored {total_rows} rows to interactions_mapped table")
+
+        def model_input_chunks():
+            for f in output_files:
+                df_mapped = pd.read_pickle(f)
+                yield df_mapped[key_columns(df_mapped) + [column for column in INDEX_COLUMNS[1:] if column in df_mapped.columns]]
+
+        print("Storing shortened df to table model_input")
+        store.write_chunks(model_input_chunks(), 'model_input', if_exists=if_exists)
+        set_watermark(store, 'interactions_mapped', pd.DataFrame({'created_date': high_water_marks}))
+    finally:
+        shutil.rmtree(spill_directory, ignore_errors=True)
+
+
+##############################################################################
+# Define functions that run the mapping stages inside sqlite
+# #############################################################################
+def use_pushdown(store):
+    if not SQL_PUSHDOWN:
+        return False
+    if store.backend != 'sqlite':
+        print(f"SQL_PUSHDOWN needs the sqlite stage store, mapping in pandas with the {store.backend} store")
+        return False
+    return True
+
+def pushdown_filter(store, output_table, alias):
+    # WHERE clause, parameters and write mode of an incremental batch
+    watermark = incremental_watermark(store, output_table)
+    if watermark is None:
+        return '', (), 'replace'
+    print(f"Mapping rows created after {watermark}")
+    return f' WHERE {alias}.created_date > ?', (str(watermark),), 'append'
+
+def set_pushdown_watermark(store, output_table):
+    df = store.query(f'SELECT MAX(created_date) AS created_date FROM "{output_table}"')
+    set_watermark(store, output_table, df.dropna())
+
+def map_city_tier_in_db(store):
+    '''
+    Builds city_tier_mapped from loaded_data with one CREATE TABLE AS SELECT.
+    Only the distinct cities are read into python, resolved through
+    city_resolver.py and stored in the CITY_TIER_LOOKUP_TABLE the rows are
+    joined to, cities missing from it (and null cities) are tier 3.
+    '''
+    where, params, if_exists = pushdown_filter(store, 'city_tier_mapped', 'l')
+    cities = store.query(f'SELECT DISTINCT l.city_mapped FROM loaded_data AS l{where}', params)['city_mapped'].dropna()
+    tiers = resolve_city_tiers(cities, store if CITY_RESOLUTION_CACHE else None, CITY_FUZZY_THRESHOLD)
+    store.write(pd.DataFrame({'city_mapped': cities.astype(str), 'city_tier': tiers}), CITY_TIER_LOOKUP_TABLE)
+
+    columns = ', '.join(f'l."{col}"' for col in store.columns('loaded_data') if col != 'city_mapped')
+    select = (f'SELECT {columns}, COALESCE(t.city_tier, 3.0) AS city_tier '
+              f'FROM loaded_data AS l LEFT JOIN "{CITY_TIER_LOOKUP_TABLE}" AS t ON l.city_mapped = t.city_mapped'
+              f'{where} ORDER BY l.rowid')
+    total_rows = store.write_query(select, 'city_tier_mapped', if_exists, params,
+                                   input_tables=['loaded_data', CITY_TIER_LOOKUP_TABLE])
+    set_pushdown_watermark(store, 'city_tier_mapped')
+    return total_rows
+
+def map_categorical_vars_in_db(store):
+    '''
+    Builds categorical_variables_mapped from city_tier_mapped with one
+    CREATE TABLE AS SELECT. The significant levels are stored in the
+    SIGNIFICANT_LEVELS_TABLE and every other level (and null) becomes
+    'others' in a CASE. With DROP_DUPLICATES only the first row of every
+    group of DEDUP_KEYS is kept, as drop_duplicates does.
+    '''
+    where, params, if_exists = pushdown_filter(store, 'categorical_variables_mapped', 'c')
+    store.write(pd.DataFrame([(column, level) for column, levels in significant_levels.items() for level in levels],
+                             columns=['column_name', 'level']), SIGNIFICANT_LEVELS_TABLE)
+
+    columns = store.columns('city_tier_mapped')
+    expressions = []
+    for col in columns:
+        if col in significant_levels:
+            expressions.append(f'CASE WHEN c."{col}" IN (SELECT level FROM "{SIGNIFICANT_LEVELS_TABLE}" '
+                               f"WHERE column_name = '{col}') THEN c.\"{col}\" ELSE 'others' END AS \"{col}\"")
+        else:
+            expressions.append(f'c."{col}"')
+    mapped = f'SELECT c.rowid AS source_row, {", ".join(expressions)} FROM city_tier_mapped AS c{where}'
+
+    output_columns = ', '.join(f'"{col}"' for col in columns)
+    select = f'WITH mapped AS ({mapped}) SELECT {output_columns} FROM mapped'
+    if DROP_DUPLICATES:
+        keys = ', '.join(f'"{col}"' for col in (DEDUP_KEYS or [col for col in columns if col != 'lead_id']))
+        select += f' WHERE source_row IN (SELECT MIN(source_row) FROM mapped GROUP BY {keys})'
+    select += ' ORDER BY source_row'
+
+    total_rows = store.write_query(select, 'categorical_variables_mapped', if_exists, params,
+                                   input_tables=['city_tier_mapped', SIGNIFICANT_LEVELS_TABLE])
+    set_pushdown_watermark(store, 'categorical_variables_mapped')
+    return total_rows
+
+
+##############################################################################
+# Define functions that run the transforms on partitions of the data
+# #############################################################################
+def partitions_keep_duplicates_together():
+    # rows are partitioned by created_date, so a duplicate always lands in
+    # the partition of the row it duplicates unless created_date is left out
+    # of the DEDUP_KEYS
+    return not (DROP_DUPLICATES and DEDUP_KEYS and 'created_date' not in DEDUP_KEYS)
+
+def warm_city_resolution(df, store):
+    # resolve the cities once in the parent process, through the persistent
+    # cache of the store, the worker processes forked afterwards find them in
+    # the memoized resolve_city
+    cities = df['city_mapped'].astype('category').cat.categories
+    resolve_city_tiers(cities, store if CITY_RESOLUTION_CACHE else None, CITY_FUZZY_THRESHOLD)
+
+def use_partitions(df):
+    if not PARTITIONED_EXECUTION or df.shape[0] < PARTITION_MIN_ROWS:
+        return False
+    if not partitions_keep_duplicates_together():
+        print("DEDUP_KEYS do not include created_date, running the transforms in a single process")
+        return False
+    return True
+
+def partition_positions(df):
+    '''
+    Returns the row positions of every partition of df, in a fixed order.
+    The rows are partitioned by the month of created_date, or with
+    PARTITION_BY = 'hash' by a hash of created_date into PARTITION_BUCKETS
+    buckets, which spreads the rows evenly when there are few months.
+    '''
+    if PARTITION_BY == 'hash':
+        keys = pd.util.hash_pandas_object(df['created_date'], index=False).to_numpy() % PARTITION_BUCKETS
+    else:
+        keys = pd.to_datetime(df['created_date']).dt.strftime('%Y-%m').to_numpy()
+    groups = pd.Series(np.arange(df.shape[0])).groupby(keys, sort=True).indices
+    return [groups[key] for key in sorted(groups)]
+
+def merge_partitions(results):
+    # results are a dataframe or a tuple of dataframes per partition, every
+    # one is concatenated and put back in the row order of the input
+    if isinstance(results[0], tuple):
+        return tuple(merge_partitions([result[i] for result in results]) for i in range(len(results[0])))
+    return pd.concat(results).sort_index(kind='stable')
+
+def run_partitioned(df, transform, *args):
+    '''
+    This function runs transform(partition, *args) on the created_date
+    partitions of df in a ProcessPoolExecutor and merges the results back in
+    the row order of df, so that the output is the same as the one of
+    transform(df, *args) in a single process. transform must keep the index
+    of the rows it returns and return a dataframe or a tuple of dataframes.
+
+    INPUTS
+        PARTITION_BY : 'month' or 'hash'
+        PARTITION_BUCKETS : number of hash buckets
+        PARTITION_WORKERS : number of processes, None for one per core
+
+    SAMPLE USAGE
+        df = run_partitioned(df, apply_categorical_mapping)
+    '''
+    df = df.reset_index(drop=True)
+    partitions = [df.iloc[positions] for positions in partition_positions(df)]
+    print(f"Running {transform.__name__} on {len(partitions)} partitions")
+    with ProcessPoolExecutor(max_workers=PARTITION_WORKERS) as executor:
+        results = list(executor.map(transform, partitions, *[[arg] * len(partitions) for arg in args]))
+    return merge_partitions(results)
+
+
+##############################################################################
+# Define function that runs all the mapping steps in a single pass
+# #############################################################################
+def apply_fused_transforms(df, interaction_matrix, debug_tables=False, store=None):
+    '''
+    Runs the city tier, categorical and interactions mappings on df. Returns
+    the interactions mapped and model input dataframes, preceded by the city
+    tier mapped and categorical variables mapped ones when debug_tables.
+    '''
+    print("Mapping city_mapped to tiers")
+    df = apply_city_tier_mapping(df, store)
+    # the categorical mapping rewrites its columns in place
+    city_tier_mapped = df.copy() if debug_tables else None
+
+    print('Mapping first_platform_c, first_utm_medium_c, first_utm_source_c')
+    df = apply_categorical_mapping(df)
+    categorical_variables_mapped = df
+
+    df_mapped, dataset_trimmed = apply_interactions_mapping(df, interaction_matrix)
+    if debug_tables:
+        return city_tier_mapped, categorical_variables_mapped, df_mapped, dataset_trimmed
+    return df_mapped, dataset_trimmed
+
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+@cached_stage('map_fused_transforms', open_stage_store, ['loaded_data'], ['interactions_mapped', 'model_input'],
+              files=[CITY_TIER_MAPPING_FILE, CITY_RESOLVER_FILE, SIGNIFICANT_CATEGORICAL_LEVEL_FILE,
+                     lambda: INTERACTION_MAPPING])
+def map_fused_transforms():
+    '''
+    This function runs the city tier mapping, the categorical variables mapping
+    and the interactions mapping one after the other on the same in memory
+    dataframe. 'loaded_data' is read once and only 'interactions_mapped' and
+    'model_input' are written, which saves the round trips through the
+    intermediate tables done by map_city_tier, map_categorical_vars and
+    interactions_mapping.
+
+
+    INPUTS
+        DB_FILE_NAME: Name of the database file
+        DB_PATH : path where the db file should be present
+        INTERACTION_MAPPING : path to the csv file containing interaction's
+                              mappings
+        FUSED_DEBUG_TABLES : also write the intermediate 'city_tier_mapped' and
+                             'categorical_variables_mapped' tables
+        PARTITIONED_EXECUTION : run the mappings on created_date partitions
+                                in a process pool, see run_partitioned
+
+
+    OUTPUT
+        Saves the processed dataframes in the db in tables named
+        'interactions_mapped' and 'model_input', the same way
+        interactions_mapping does.
+
+        With INCREMENTAL_LOAD only the rows of 'loaded_data' created after the
+        high water mark of 'interactions_mapped' are processed and appended.
+
+
+    SAMPLE USAGE
+        map_fused_transforms()
+    '''
+    print("Connecting to stage store")
+    store = open_stage_store()
+    try:
+        print("Loading loaded_data table")
+        df, if_exists = read_incremental(store, 'loaded_data', 'interactions_mapped')
+        if df.shape[0] == 0:
+            print("No new rows in loaded_data table")
+            return
+
+        print("Reading interaction_mapping file")
+        interaction_matrix = load_interaction_matrix(INTERACTION_MAPPING)
+
+        if use_partitions(df):
+            warm_city_resolution(df, store)
+            outputs = run_partitioned(df, apply_fused_transforms, interaction_matrix, FUSED_DEBUG_TABLES)
+        else:
+            outputs = apply_fused_transforms(df, interaction_matrix, FUSED_DEBUG_TABLES, store)
+        df_mapped, dataset_trimmed = outputs[-2:]
+
+        if FUSED_DEBUG_TABLES:
+            city_tier_mapped, categorical_variables_mapped = outputs[:2]
+            print("Storing debug table city_tier_mapped")
+            store.write(city_tier_mapped, 'city_tier_mapped', if_exists=if_exists)
+            set_watermark(store, 'city_tier_mapped', city_tier_mapped)
+            print("Storing debug table categorical_variables_mapped")
+            store.write(categorical_variables_mapped, 'categorical_variables_mapped', if_exists=if_exists)
+            set_watermark(store, 'categorical_variables_mapped', categorical_variables_mapped)
+
+        print("Saving the processed dataframe in the db in a table named 'interactions_mapped'")
+        store.write(df_mapped, 'interactions_mapped', if_exists=if_exists)
+        print("Storing shortened df to table model_input")
+        store.write(dataset_trimmed, 'model_input', if_exists=if_exists)
+        set_watermark(store, 'interactions_mapped', df_mapped)
+    finally:
+        print("Closing stage store")
+        store.close()
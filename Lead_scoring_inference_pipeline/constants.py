@@ -1,6 +1,37 @@
 DB_PATH = '/home/airflow/dags/Lead_scoring_data_pipeline/'
 DB_FILE_NAME = "lead_scoring_data_cleaning.db"
 
+# storage the stages hand their dataframes over through, 'sqlite' or 'parquet'
+# as in Lead_scoring_data_pipeline/constants.py
+STAGE_STORE_BACKEND = 'sqlite'
+STAGE_STORE_DIRECTORY = '/home/airflow/dags/Lead_scoring_data_pipeline/stage_store/'
+
+# skip a stage when its inputs are the same as in its last successful run,
+# see Lead_scoring_data_pipeline/stage_cache.py
+STAGE_CACHE_ENABLED = True
+STAGE_CACHE_MAX_ENTRIES = 20
+
+# record the metrics of every stage in the 'pipeline_metrics' table, see
+# Lead_scoring_data_pipeline/telemetry.py
+TELEMETRY_ENABLED = True
+PROMETHEUS_TEXTFILE_DIRECTORY = None
+
+# keep the encoded features as a sparse CSR matrix in features.npz next to
+# the stage tables instead of the dense 'features' table, see
+# Lead_scoring_training_pipeline/encoder.py, the same in both pipelines
+SPARSE_FEATURES = False
+
+# train and predict on the integer codes of FEATURES_TO_ENCODE as lightgbm
+# categorical features instead of their one hot encoding, the code
+# dictionary is logged with the model as CATEGORY_CODES_ARTIFACT, see
+# Lead_scoring_training_pipeline/encoder.py, the same in both pipelines
+NATIVE_CATEGORICAL = False
+CATEGORY_CODES_ARTIFACT = 'category_codes.json'
+
+# the model predicts the probability of app_complete_flag being 1, a lead is
+# predicted 1 above this threshold, the same in both pipelines
+PREDICTION_THRESHOLD = 0.5
+
 DB_FILE_MLFLOW_PATH = '/home/airflow/dags/Lead_scoring_training_pipeline/'
 DB_FILE_MLFLOW = "Lead_scoring_mlflow_production.db"
 
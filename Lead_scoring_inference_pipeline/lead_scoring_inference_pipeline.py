@@ -4,9 +4,15 @@
 
 from airflow import DAG
 from airflow.operators.python import PythonOperator
+from airflow.models.baseoperator import chain
 from datetime import datetime, timedelta
 
-from Lead_scoring_inference_pipeline.utils import *
+from Lead_scoring_inference_pipeline.constants import *
+# the task functions are imported when their task runs, not when the
+# scheduler parses this file, see Lead_scoring_data_pipeline/lazy_callable.py
+from Lead_scoring_data_pipeline.lazy_callable import lazy_callable
+
+UTILS = 'Lead_scoring_inference_pipeline.utils'
 
 ###############################################################################
 # Define default arguments and create an instance of DAG
@@ -28,14 +34,18 @@ Lead_scoring_inference_dag = DAG(
                 catchup = False
 )
 
-###############################################################################
-# Create a task for encode_data_task() function with task_id 'encoding_categorical_variables'
-# ##############################################################################
-encode_features_task = PythonOperator(
-                            task_id = 'encoding_categorical_variables',
-                            python_callable = encode_features,
-                            dag = Lead_scoring_inference_dag)
-
+encoding_tasks = []
+if not NATIVE_CATEGORICAL:
+    # with NATIVE_CATEGORICAL the category codes are computed by
+    # get_models_prediction, there is no encoding task
+    ###############################################################################
+    # Create a task for encode_data_task() function with task_id 'encoding_categorical_variables'
+    # ##############################################################################
+    encode_features_task = PythonOperator(
+                                task_id = 'encoding_categorical_variables',
+                                python_callable = lazy_callable(UTILS, 'encode_features'),
+                                dag = Lead_scoring_inference_dag)
+    encoding_tasks = [encode_features_task]
 
 
 ###############################################################################
@@ -43,7 +53,7 @@ encode_features_task = PythonOperator(
 # ##############################################################################
 get_models_prediction_task = PythonOperator(
             task_id = 'generating_models_prediction',
-            python_callable = get_models_prediction,
+            python_callable = lazy_callable(UTILS, 'get_models_prediction'),
             dag = Lead_scoring_inference_dag)
 
 
@@ -53,7 +63,7 @@ get_models_prediction_task = PythonOperator(
 # ##############################################################################
 prediction_ratio_check_task = PythonOperator(
             task_id = 'checking_model_prediction_ratio',
-            python_callable = prediction_ratio_check,
+            python_callable = lazy_callable(UTILS, 'prediction_ratio_check'),
             dag = Lead_scoring_inference_dag)
 
 
@@ -63,7 +73,7 @@ prediction_ratio_check_task = PythonOperator(
 # ##############################################################################
 input_features_check_task = PythonOperator(
             task_id = 'checking_input_features',
-            python_callable = input_features_check,
+            python_callable = lazy_callable(UTILS, 'input_features_check'),
             dag = Lead_scoring_inference_dag)
 
 
@@ -72,4 +82,4 @@ input_features_check_task = PythonOperator(
 # Define relation between tasks
 # ##############################################################################
 
-encode_features_task >> input_features_check_task >> get_models_prediction_task >> prediction_ratio_check_task
+chain(*encoding_tasks, input_features_check_task, get_models_prediction_task, prediction_ratio_check_task)
@@ -10,7 +10,9 @@ version: 1
 # ##############################################################################
 
 import mlflow
+import mlflow.artifacts
 import mlflow.sklearn
+import numpy as np
 import pandas as pd
 
 import sqlite3
@@ -20,12 +22,40 @@ import logging
 
 from datetime import datetime
 from Lead_scoring_inference_pipeline.constants import *
+from Lead_scoring_training_pipeline.encoder import compile_encoder, one_hot_encode, one_hot_encode_sparse
+from Lead_scoring_training_pipeline.encoder import category_encode
+from Lead_scoring_data_pipeline.stage_store import get_stage_store
+from Lead_scoring_data_pipeline.stage_cache import cached_stage
+from Lead_scoring_data_pipeline.telemetry import instrumented_stage
+
+TELEMETRY_DAG = 'Lead_scoring_inference_pipeline'
+
+def open_stage_store():
+    return get_stage_store(STAGE_STORE_BACKEND, DB_PATH, DB_FILE_NAME, STAGE_STORE_DIRECTORY)
+
+def production_model_version():
+    # the prediction has to be redone whenever a new model is put in production
+    mlflow.set_tracking_uri(TRACKING_URI)
+    client = mlflow.tracking.MlflowClient()
+    return [(v.version, v.run_id) for v in client.get_latest_versions(MODEL_NAME, stages=[STAGE])]
+
+def production_category_codes():
+    # the code dictionary the production model was trained with, logged by
+    # get_trained_model in NATIVE_CATEGORICAL mode
+    run_id = production_model_version()[0][1]
+    return mlflow.artifacts.load_dict(f'runs:/{run_id}/{CATEGORY_CODES_ARTIFACT}')
+
+def copied_columns():
+    # the columns of ONE_HOT_ENCODED_FEATURES taken from model_input as they are
+    return list(compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES))['copied'])
 
 ###############################################################################
 # Define the function to train the model
 # ##############################################################################
 
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+@cached_stage('inference_encode_features', open_stage_store, ['model_input'], ['features'])
 def encode_features():
     '''
     This function one hot encodes the categorical features present in our  
@@ -46,50 +76,51 @@ def encode_features():
     SAMPLE USAGE
         encode_features()
     '''
+    if NATIVE_CATEGORICAL:
+        print('NATIVE_CATEGORICAL is set, get_models_prediction encodes the category codes itself')
+        return
+
+    store = None
     try:
-        cnx = sqlite3.connect(DB_PATH+DB_FILE_NAME)
+        store = open_stage_store()
         print ("Reading data from model_input table")
-        df = pd.read_sql('select * from model_input', cnx)
+        # only read the columns that end up in the features
+        columns = [column for column in store.columns('model_input')
+                   if column in FEATURES_TO_ENCODE or column in ONE_HOT_ENCODED_FEATURES or column == 'lead_id']
+        df = store.read('model_input', columns=columns)
         print("Table model_input columns: ", df.columns)
-        print("Converting 'city_tier' column from float to category in model_input dataframe")
-        df['city_tier'] = df.city_tier.astype('category')
-
         print("One hot encoding features")
-        # Implement these steps to prevent dimension mismatch during inference
-        encoded_df = pd.DataFrame(columns= ONE_HOT_ENCODED_FEATURES) # from constants.py
-        placeholder_df = pd.DataFrame()
-
-        # One-Hot Encoding using get_dummies for the specified categorical features
-        for f in FEATURES_TO_ENCODE:
-            if(f in df.columns):
-                encoded = pd.get_dummies(df[f])
-                encoded = encoded.add_prefix(f + '_')
-                placeholder_df = pd.concat([placeholder_df, encoded], axis=1)
-            else:
-                print('Feature not found')
-
-        # Implement these steps to prevent dimension mismatch during inference
-        for feature in encoded_df.columns:
-            if feature in df.columns:
-                encoded_df[feature] = df[feature]
-            if feature in placeholder_df.columns:
-                encoded_df[feature] = placeholder_df[feature]
-
-        encoded_df.fillna(0,inplace=True)
+        # the same encoder as in the training pipeline, see
+        # Lead_scoring_training_pipeline/encoder.py
+        encoder = compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES))
+        if SPARSE_FEATURES:
+            matrix = one_hot_encode_sparse(df, encoder)
+            keys = df['lead_id'] if 'lead_id' in df.columns else np.arange(df.shape[0])
+            print("Shape of feature matrix:", matrix.shape, "non-zeros:", matrix.nnz)
+            store.write_sparse(matrix, keys, encoder['columns'], 'features')
+            print('features.npz created/replaced')
+            return
+
+        encoded_df = one_hot_encode(df, encoder)
+        if 'lead_id' in df.columns:
+            encoded_df.insert(0, 'lead_id', df['lead_id'])
         print("Encoded dataframe columns: ", encoded_df.columns)
 
-        encoded_df.to_sql(name='features', con=cnx,if_exists='replace',index=False)
+        store.write(encoded_df, 'features')
         print('features created/replaced')
     except Exception as e:
         print (f'Exception thrown in encode_features : {e}')
     finally:
-        if cnx:        
-            cnx.close()
+        if store:
+            store.close()
 
 ###############################################################################
 # Define the function to load the model from mlflow model registry
 # ##############################################################################
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+@cached_stage('get_models_prediction', open_stage_store, ['model_input'] if NATIVE_CATEGORICAL else ['features'],
+              ['predictions'], extra=production_model_version)
 def get_models_prediction():
     '''
     This function loads the model which is in production from mlflow registry and 
@@ -105,18 +136,19 @@ def get_models_prediction():
 
 
     OUTPUT
-        Store the predicted values along with input data into a table
+        Store the predicted values along with input data and the lead_id into a table
 
     SAMPLE USAGE
         load_model()
     '''
+    store = None
     try:
         print("Setting mlflow tracking uri: ", TRACKING_URI)
         mlflow.set_tracking_uri(TRACKING_URI)
         print("Setting mlflow experiment to name: ", EXPERIMENT)
         mlflow.set_experiment(EXPERIMENT)
         
-        cnx = sqlite3.connect(DB_PATH + DB_FILE_NAME)
+        store = open_stage_store()
         
         
         # Load model as a PyFuncModel.
@@ -126,30 +158,66 @@ def get_models_prediction():
         loaded_model = mlflow.pyfunc.load_model(model_uri)
         
         
-        # Predict on a Pandas DataFrame.
-        print ("Reading data from features table")
-        X = pd.read_sql('select * from features', cnx)
-        print('Making Prediction')
-        predictions = loaded_model.predict(pd.DataFrame(X))
-        print("Creating copy of input dataframe")
-        pred_df = X.copy()
+        if NATIVE_CATEGORICAL:
+            # the model input is encoded here with the code dictionary of the
+            # production model, there is no one hot encoding step
+            print("Loading the category code dictionary of the production model")
+            codes = production_category_codes()
+            print ("Reading data from model_input table")
+            columns = [column for column in store.columns('model_input')
+                       if column in codes or column in copied_columns() or column == 'lead_id']
+            df = store.read('model_input', columns=columns)
+            X = category_encode(df, codes, copied_columns())
+            print('Making Prediction')
+            predictions = loaded_model.predict(X)
+            pred_df = X
+            if 'lead_id' in df.columns:
+                pred_df.insert(0, 'lead_id', df['lead_id'])
+        elif SPARSE_FEATURES:
+            # the model predicts on the CSR matrix as it is, the predictions
+            # keep only the lead_id of their lead
+            print ("Reading data from features.npz")
+            X, keys, columns = store.read_sparse('features')
+            if columns != ONE_HOT_ENCODED_FEATURES:
+                raise ValueError('Columns of features.npz differ from ONE_HOT_ENCODED_FEATURES')
+            print('Making Prediction')
+            # lightgbm only takes float values in a CSR matrix
+            predictions = loaded_model.predict(X.astype(np.float32))
+            pred_df = pd.DataFrame({'lead_id': keys})
+        else:
+            # Predict on a Pandas DataFrame.
+            print ("Reading data from features table")
+            # the predictions keep the lead_id of their lead, so they can be
+            # joined back to it
+            key_columns = [column for column in store.columns('features') if column == 'lead_id']
+            X = store.read('features', columns=key_columns + ONE_HOT_ENCODED_FEATURES)
+            print('Making Prediction')
+            predictions = loaded_model.predict(pd.DataFrame(X[ONE_HOT_ENCODED_FEATURES]))
+            print("Creating copy of input dataframe")
+            pred_df = X.copy()
+
+        if 'lightgbm' in loaded_model.metadata.flavors:
+            # a lightgbm booster predicts probabilities, the models logged
+            # with mlflow.sklearn before predicted the class
+            predictions = (np.asarray(predictions) > PREDICTION_THRESHOLD).astype(int)
 
         print("Adding 'app_complete_flag' column in dataframe")
         pred_df['app_complete_flag'] = predictions
         
         print ("Saving the pred_df dataframe in the db in a table named 'predictions'")
-        pred_df.to_sql(name='predictions', con=cnx,if_exists='replace',index=False)
+        store.write(pred_df, 'predictions')
         print("Predictions are done and create/replaced Table")
     except Exception as e:
         print (f'Exception thrown in get_models_prediction : {e}')
     finally:
-        if cnx:        
-            cnx.close()
+        if store:
+            store.close()
 
 ###############################################################################
 # Define the function to check the distribution of output column
 # ##############################################################################
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
 def prediction_ratio_check():
     '''
     This function calculates the % of 1 and 0 predicted by the model and  
@@ -173,9 +241,9 @@ def prediction_ratio_check():
         prediction_col_check()
     '''
     
-    cnx = sqlite3.connect(DB_PATH+DB_FILE_NAME)
+    store = open_stage_store()
     print("Reading data from predictions table")
-    pred_df = pd.read_sql('select * from predictions', cnx)
+    pred_df = store.read('predictions', columns=['app_complete_flag'])
 
     print("Calculating the % of True(1) and False(0) scenarios predicted by the model")
     df_row_count = pred_df.shape[0]
@@ -199,13 +267,13 @@ def prediction_ratio_check():
     print("Closing file")
     f.close()
             
-    cnx.close()
+    store.close()
 
 ###############################################################################
 # Define the function to check the columns of input features
 # ##############################################################################
 
-
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
 def input_features_check():
     '''
     This function checks whether all the input columns are present in our new
@@ -228,16 +296,30 @@ def input_features_check():
         input_col_check()
     '''
     
+    store = None
     try:
 
         # Creating an object
         logger = logging.getLogger()
 
-        cnx = sqlite3.connect(DB_PATH + DB_FILE_NAME)
-        print('Loading features table')
-        features = pd.read_sql('select * from features', cnx)
+        store = open_stage_store()
+        expected_columns = ONE_HOT_ENCODED_FEATURES
+        if NATIVE_CATEGORICAL:
+            # the model inputs are the columns of model_input the category
+            # codes are computed from
+            print('Loading model_input table columns')
+            expected_columns = FEATURES_TO_ENCODE + copied_columns()
+            model_input_columns = store.columns('model_input')
+            features_columns = [column for column in expected_columns if column in model_input_columns]
+        elif SPARSE_FEATURES:
+            print('Loading features table columns')
+            features_columns = store.read_sparse('features')[2]
+        else:
+            print('Loading features table columns')
+            # lead_id is the key of the table, not an input of the model
+            features_columns = [column for column in store.columns('features') if column != 'lead_id']
 
-        if list(features.columns) == ONE_HOT_ENCODED_FEATURES:
+        if features_columns == expected_columns:
             logger.info('All the models input are present')
             print('All the models input are present')
         else:
@@ -247,6 +329,6 @@ def input_features_check():
     except Exception as e:
         print (f'Exception thrown in input_col_check : {e}')
     finally:
-        if cnx:        
-            cnx.close()
+        if store:
+            store.close()
    
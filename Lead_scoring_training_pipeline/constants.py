@@ -1,6 +1,71 @@
 DB_PATH = '/home/airflow/dags/Lead_scoring_data_pipeline/'
 DB_FILE_NAME = 'lead_scoring_data_cleaning.db'
 
+# storage the stages hand their dataframes over through, 'sqlite' or 'parquet'
+# as in Lead_scoring_data_pipeline/constants.py
+STAGE_STORE_BACKEND = 'sqlite'
+STAGE_STORE_DIRECTORY = '/home/airflow/dags/Lead_scoring_data_pipeline/stage_store/'
+
+# skip a stage when its inputs are the same as in its last successful run,
+# see Lead_scoring_data_pipeline/stage_cache.py
+STAGE_CACHE_ENABLED = True
+STAGE_CACHE_MAX_ENTRIES = 20
+
+# record the metrics of every stage in the 'pipeline_metrics' table, see
+# Lead_scoring_data_pipeline/telemetry.py
+TELEMETRY_ENABLED = True
+PROMETHEUS_TEXTFILE_DIRECTORY = None
+
+# keep the encoded features as a sparse CSR matrix in features.npz next to
+# the stage tables instead of the dense 'features' table, see
+# Lead_scoring_training_pipeline/encoder.py, the same in both pipelines
+SPARSE_FEATURES = False
+
+# train and predict on the integer codes of FEATURES_TO_ENCODE as lightgbm
+# categorical features instead of their one hot encoding, the code
+# dictionary is logged with the model as CATEGORY_CODES_ARTIFACT, see
+# Lead_scoring_training_pipeline/encoder.py, the same in both pipelines
+NATIVE_CATEGORICAL = False
+CATEGORY_CODES_ARTIFACT = 'category_codes.json'
+
+# keep the binned lightgbm training set of every features / target version,
+# see Lead_scoring_training_pipeline/dataset_cache.py
+DATASET_CACHE_ENABLED = True
+DATASET_CACHE_DIRECTORY = '/home/airflow/dags/Lead_scoring_training_pipeline/dataset_cache/'
+DATASET_CACHE_MAX_ENTRIES = 5
+
+# the model predicts the probability of app_complete_flag being 1, a lead is
+# predicted 1 above this threshold, the same in both pipelines
+PREDICTION_THRESHOLD = 0.5
+
+# hold out EARLY_STOPPING_VALIDATION_FRACTION of the training rows and stop
+# adding trees when their EARLY_STOPPING_METRIC has not improved for
+# EARLY_STOPPING_ROUNDS rounds, the model keeps the trees up to the best
+# iteration only. None trains num_boost_round trees on all the training rows
+EARLY_STOPPING_ROUNDS = 20
+EARLY_STOPPING_METRIC = 'auc'
+EARLY_STOPPING_VALIDATION_FRACTION = 0.2
+
+# search the model configuration before every training, see
+# Lead_scoring_training_pipeline/tuning.py. TUNING_TRIALS configurations of
+# TUNING_SEARCH_SPACE, applied on model_config, are raced by successive
+# halving from TUNING_MIN_ROUNDS boosting rounds, keeping 1 / TUNING_ETA of
+# them at every rung, in TUNING_WORKERS processes (all the cpus when None)
+# and within TUNING_BUDGET_SECONDS
+TUNING_ENABLED = False
+TUNING_TRIALS = 27
+TUNING_MIN_ROUNDS = 25
+TUNING_ETA = 3
+TUNING_WORKERS = None
+TUNING_BUDGET_SECONDS = 1800
+TUNING_VALIDATION_FRACTION = 0.2
+TUNING_SEED = 42
+TUNING_SEARCH_SPACE = {'learning_rate': ('log_uniform', 0.01, 0.3),
+                       'num_leaves': ('int', 8, 128),
+                       'min_child_samples': ('int', 5, 100),
+                       'colsample_bytree': ('uniform', 0.5, 1.0),
+                       'reg_lambda': ('log_uniform', 0.001, 10.0)}
+
 MLFLOW_PATH = '/home/MLOps_Assignment/mlruns/'
 DB_FILE_MLFLOW = 'Lead_scoring_mlflow_production.db'
 
@@ -0,0 +1,140 @@
+'''
+filename: dataset_cache.py
+functions: dataset_cache_key, load_cached_datasets, save_cached_datasets
+
+Cache of the binned training set of get_trained_model. Building an
+lgb.Dataset bins every feature, the cache keeps the constructed training set
+in the lightgbm binary format, <key>.bin, with the held out rows next to
+it, <key>.held_out.pkl, the test split and the validation split of the
+early stopping, in DATASET_CACHE_DIRECTORY.
+
+The key is a hash of
+    - the versions of the 'features' and 'target' tables, which are hashes
+      of their content, see Lead_scoring_data_pipeline/stage_store.py
+    - the train / test / validation split
+    - the lightgbm version and the parameters that change the binning
+      (DATASET_PARAMS) and the feature names and categorical features
+so that a retrain, a rerun after a failure or a sweep over the training
+parameters on the same features loads the binned set instead of reading the
+tables and binning them again. Only the DATASET_CACHE_MAX_ENTRIES most
+recently used entries are kept.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import hashlib
+import os
+import uuid
+
+import lightgbm as lgb
+import pandas as pd
+
+
+# parameters of model_config, or their aliases, used when the features are
+# binned, min_child_samples is one of them because lightgbm drops the
+# features it can never split on (feature_pre_filter)
+DATASET_PARAMS = ['max_bin', 'max_bin_by_feature', 'min_data_in_bin', 'subsample_for_bin',
+                  'bin_construct_sample_cnt', 'min_child_samples', 'min_data_in_leaf', 'min_data_per_leaf',
+                  'min_data', 'feature_pre_filter', 'use_missing', 'zero_as_missing', 'linear_tree',
+                  'random_state', 'seed', 'data_random_seed', 'forcedbins_filename']
+
+
+###############################################################################
+# Define the function to key the cache
+# ##############################################################################
+
+def dataset_cache_key(store, params, split, dataset_options):
+    '''
+    This function returns the key of the binned training set, or None when
+    the version of 'features' or 'target' is unknown, in which case the
+    training set is not cached.
+
+    INPUTS
+        store : stage store of the training pipeline
+        params : lightgbm parameters of the training
+        split : dict of the arguments of the train / test and validation
+                splits
+        dataset_options : other arguments of lgb.Dataset, e.g. feature_name
+                          and categorical_feature
+
+    SAMPLE USAGE
+        key = dataset_cache_key(store, params, {'test_size': 0.2, 'random_state': 100}, {})
+    '''
+    hasher = hashlib.sha256()
+    for table_name in ('features', 'target'):
+        version = store.version(table_name)
+        if version is None:
+            return None
+        hasher.update(f'{table_name}={version}'.encode())
+    hasher.update(f'lightgbm={lgb.__version__}'.encode())
+    for name in DATASET_PARAMS:
+        if name in params:
+            hasher.update(f'{name}={params[name]!r}'.encode())
+    hasher.update(repr(sorted(split.items())).encode())
+    hasher.update(repr(sorted(dataset_options.items())).encode())
+    return hasher.hexdigest()
+
+
+###############################################################################
+# Define the functions to load and save the binned training set
+# ##############################################################################
+
+def cache_paths(directory, key):
+    return os.path.join(directory, f'{key}.bin'), os.path.join(directory, f'{key}.held_out.pkl')
+
+
+def load_cached_datasets(directory, key, params, dataset_options):
+    '''
+    This function loads the binned training set and the held out rows of
+    key, with the lgb.Dataset arguments it was built with.
+
+    OUTPUT
+        (train_set, held_out), held_out the tuple saved with the training
+        set, or None when key is not in the cache or its files cannot be
+        read
+
+    SAMPLE USAGE
+        cached = load_cached_datasets(DATASET_CACHE_DIRECTORY, key, params, {})
+    '''
+    train_path, held_out_path = cache_paths(directory, key)
+    if not (os.path.isfile(train_path) and os.path.isfile(held_out_path)):
+        return None
+    try:
+        train_set = lgb.Dataset(train_path, params=params, **dataset_options).construct()
+        held_out = pd.read_pickle(held_out_path)
+    except Exception as e:
+        print(f'Exception thrown in load_cached_datasets : {e}')
+        return None
+    # the entries are evicted in least recently used order
+    for path in (train_path, held_out_path):
+        os.utime(path)
+    return train_set, held_out
+
+
+def save_cached_datasets(directory, key, train_set, held_out, max_entries):
+    '''
+    This function saves the training set, which it constructs, and the
+    held_out tuple of key, e.g. (X_test, y_test, X_valid, y_valid), then evicts the least recently used entries beyond
+    max_entries. The files are written under a temporary name and moved in
+    place so that a reader never sees half of them.
+
+    SAMPLE USAGE
+        save_cached_datasets(DATASET_CACHE_DIRECTORY, key, train_set, (X_test, y_test, None, None), 5)
+    '''
+    os.makedirs(directory, exist_ok=True)
+    train_path, held_out_path = cache_paths(directory, key)
+    staging = os.path.join(directory, f'.{uuid.uuid4().hex}')
+    train_set.save_binary(staging + '.bin')
+    pd.to_pickle(held_out, staging + '.held_out.pkl')
+    # the training set is moved last, an entry without it is never loaded
+    os.replace(staging + '.held_out.pkl', held_out_path)
+    os.replace(staging + '.bin', train_path)
+
+    entries = sorted((f for f in os.listdir(directory) if f.endswith('.bin') and not f.startswith('.')),
+                     key=lambda f: os.path.getmtime(os.path.join(directory, f)), reverse=True)
+    for f in entries[max_entries:]:
+        for path in cache_paths(directory, f[:-len('.bin')]):
+            if os.path.isfile(path):
+                os.remove(path)
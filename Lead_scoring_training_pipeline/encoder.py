@@ -0,0 +1,226 @@
+'''
+filename: encoder.py
+functions: compile_encoder, one_hot_encode, one_hot_encode_sparse, category_codes,
+           category_encode
+
+One hot encoder of the model inputs, shared by the encode_features stage of
+the training and of the inference pipeline so that both produce the same
+columns in the same order.
+
+The encoder is compiled once from FEATURES_TO_ENCODE and
+ONE_HOT_ENCODED_FEATURES: every column of ONE_HOT_ENCODED_FEATURES named
+<feature>_<level> for a feature of FEATURES_TO_ENCODE becomes the position
+of that level, the other columns are copied from the model input. Encoding
+is then one pass per feature: the levels of the rows are looked up in an
+index of the known levels and a 1 is scattered at (row, position) of a
+preallocated uint8 matrix. Levels that are not in ONE_HOT_ENCODED_FEATURES
+and missing values leave the row all zeros for the feature, as get_dummies
+followed by the reindex to ONE_HOT_ENCODED_FEATURES did.
+
+one_hot_encode_sparse builds the same matrix as a scipy CSR matrix from the
+non-zero entries, for SPARSE_FEATURES in constants.py.
+
+For NATIVE_CATEGORICAL in constants.py the features are not expanded at all:
+category_encode replaces every level by its integer code in the code
+dictionary returned by category_codes, the levels of the feature in
+ONE_HOT_ENCODED_FEATURES in order, and lightgbm splits on the codes as
+categories. Unknown levels and missing values get the code -1, which
+lightgbm treats as missing. The code dictionary is logged with the model so
+that the inference pipeline encodes with the dictionary of the model it
+loads.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import functools
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# the copied columns are counts and flags, stored in the same uint8 matrix
+UINT8_MAX = np.iinfo(np.uint8).max
+
+
+###############################################################################
+# Define the function to compile the encoder
+# ##############################################################################
+
+@functools.lru_cache(maxsize=None)
+def compile_encoder(features_to_encode, one_hot_encoded_features):
+    '''
+    This function compiles the lookup tables of the encoder.
+
+    INPUTS
+        features_to_encode : tuple of the categorical features of the model
+                             input, FEATURES_TO_ENCODE
+        one_hot_encoded_features : tuple of the columns of the encoded
+                                   matrix, ONE_HOT_ENCODED_FEATURES
+
+    OUTPUT
+        dict with
+            columns : the columns of the encoded matrix, in order
+            levels : for every feature to encode, the list of its levels and
+                     the array of their positions in the matrix
+            copied : for every other column, its position in the matrix
+
+    SAMPLE USAGE
+        encoder = compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES))
+    '''
+    levels = {feature: ([], []) for feature in features_to_encode}
+    copied = {}
+    for position, column in enumerate(one_hot_encoded_features):
+        # the longest feature name wins, for features that prefix each other
+        owners = [feature for feature in features_to_encode if column.startswith(feature + '_')]
+        if owners:
+            feature = max(owners, key=len)
+            levels[feature][0].append(column[len(feature) + 1:])
+            levels[feature][1].append(position)
+        else:
+            copied[column] = position
+
+    return {'columns': list(one_hot_encoded_features),
+            'levels': {feature: (names, np.array(positions, dtype=np.intp))
+                       for feature, (names, positions) in levels.items()},
+            'copied': copied}
+
+
+###############################################################################
+# Define the function to encode the model input
+# ##############################################################################
+
+def level_index(values, names):
+    # the levels are the suffixes of the column names, numeric features are
+    # matched by value so that 1, 1.0 and '1.0' are the same level
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        numbers = pd.to_numeric(pd.Series(names, dtype=object), errors='coerce')
+        return pd.Index(numbers.to_numpy(dtype=np.float64)), values.astype('float64').to_numpy()
+    return pd.Index(names), values.astype(object).to_numpy()
+
+
+def copied_values(values):
+    # the values of a copied column as uint8, missing values are 0; a value
+    # that does not fit would be changed silently by the cast, it is refused
+    numbers = pd.to_numeric(values).astype('float64').fillna(0).to_numpy()
+    invalid = (numbers < 0) | (numbers > UINT8_MAX) | (numbers != np.floor(numbers))
+    if invalid.any():
+        raise ValueError(f'Column {values.name} has values that are not integers from 0 to {UINT8_MAX}: '
+                         f'{sorted(set(numbers[invalid].tolist()))[:5]}')
+    return numbers.astype(np.uint8)
+
+
+def encoded_entries(df, encoder):
+    # yields the (rows, positions, values) of the non-zero entries of every
+    # encoded feature and copied column
+    rows = np.arange(len(df))
+    for feature, (names, positions) in encoder['levels'].items():
+        if feature not in df.columns:
+            print(feature + ',Feature not found')
+            continue
+        index, values = level_index(df[feature], names)
+        codes = index.get_indexer(values)
+        found = codes >= 0
+        yield rows[found], positions[codes[found]], np.ones(found.sum(), dtype=np.uint8)
+
+    for column, position in encoder['copied'].items():
+        if column in df.columns:
+            values = copied_values(df[column])
+            non_zero = np.flatnonzero(values)
+            yield non_zero, np.full(non_zero.shape[0], position, dtype=np.intp), values[non_zero]
+
+
+def one_hot_encode(df, encoder):
+    '''
+    This function one hot encodes df with a compiled encoder.
+
+    INPUTS
+        df : model input dataframe with the features to encode and the copied
+             columns
+        encoder : encoder returned by compile_encoder
+
+    OUTPUT
+        dataframe of uint8 columns encoder['columns'], on the index of df. The
+        copied columns have their missing values set to 0, a ValueError is
+        raised for a copied value that is not an integer from 0 to 255
+
+    SAMPLE USAGE
+        features = one_hot_encode(df, compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES)))
+    '''
+    matrix = np.zeros((len(df), len(encoder['columns'])), dtype=np.uint8)
+    for rows, positions, values in encoded_entries(df, encoder):
+        matrix[rows, positions] = values
+    return pd.DataFrame(matrix, columns=encoder['columns'], index=df.index, copy=False)
+
+
+def one_hot_encode_sparse(df, encoder):
+    '''
+    This function one hot encodes df with a compiled encoder into a CSR
+    matrix, built from the non-zero entries only, so that its size grows
+    with the number of non-zeros and not with rows x columns.
+
+    OUTPUT
+        scipy.sparse.csr_matrix of uint8 with the rows of df and the columns
+        encoder['columns'], same values as one_hot_encode
+
+    SAMPLE USAGE
+        matrix = one_hot_encode_sparse(df, compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES)))
+    '''
+    entries = list(encoded_entries(df, encoder))
+    rows = np.concatenate([np.empty(0, dtype=np.intp)] + [entry[0] for entry in entries])
+    positions = np.concatenate([np.empty(0, dtype=np.intp)] + [entry[1] for entry in entries])
+    values = np.concatenate([np.empty(0, dtype=np.uint8)] + [entry[2] for entry in entries])
+    return sparse.csr_matrix((values, (rows, positions)), shape=(len(df), len(encoder['columns'])))
+
+
+###############################################################################
+# Define the functions to encode the model input as category codes
+# ##############################################################################
+
+def category_codes(features_to_encode, one_hot_encoded_features):
+    '''
+    This function returns the code dictionary of the native categorical mode,
+    {feature: [level of code 0, level of code 1, ...]}, with the levels of
+    every feature in one_hot_encoded_features, so the same levels as the one
+    hot encoding. The dictionary is json serializable.
+
+    SAMPLE USAGE
+        codes = category_codes(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES))
+    '''
+    encoder = compile_encoder(tuple(features_to_encode), tuple(one_hot_encoded_features))
+    return {feature: list(names) for feature, (names, _) in encoder['levels'].items()}
+
+
+def category_encode(df, codes, copied_columns):
+    '''
+    This function encodes the model input with a code dictionary.
+
+    INPUTS
+        df : model input dataframe
+        codes : code dictionary returned by category_codes, or loaded from
+                the artifact of the model
+        copied_columns : columns copied from df as in one_hot_encode, e.g.
+                         total_leads_droppped and referred_lead
+
+    OUTPUT
+        dataframe on the index of df with an int32 column of codes for every
+        feature of codes, -1 for unknown levels and missing values, then the
+        uint8 copied columns
+
+    SAMPLE USAGE
+        features = category_encode(df, codes, ['total_leads_droppped', 'referred_lead'])
+    '''
+    columns = {}
+    for feature, names in codes.items():
+        if feature not in df.columns:
+            print(feature + ',Feature not found')
+            columns[feature] = np.full(len(df), -1, dtype=np.int32)
+            continue
+        index, values = level_index(df[feature], names)
+        columns[feature] = index.get_indexer(values).astype(np.int32)
+    for column in copied_columns:
+        values = df[column] if column in df.columns else pd.Series(0, index=df.index, name=column)
+        columns[column] = copied_values(values)
+    return pd.DataFrame(columns, index=df.index)
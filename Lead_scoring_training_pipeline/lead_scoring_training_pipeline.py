@@ -5,9 +5,16 @@ from airflow import DAG
 from airflow.operators.python import PythonOperator
 from airflow.operators.bash import BashOperator
 
+from airflow.models.baseoperator import chain
+
 from datetime import datetime, timedelta
 
-from Lead_scoring_training_pipeline.utils import *
+from Lead_scoring_training_pipeline.constants import *
+# the task functions are imported when their task runs, not when the
+# scheduler parses this file, see Lead_scoring_data_pipeline/lazy_callable.py
+from Lead_scoring_data_pipeline.lazy_callable import lazy_callable
+
+UTILS = 'Lead_scoring_training_pipeline.utils'
 
 ###############################################################################
 # Define default arguments and DAG
@@ -33,20 +40,31 @@ ML_training_dag = DAG(
 # ##############################################################################
 encode_features_task = PythonOperator(
                             task_id = 'encoding_categorical_variables',
-                            python_callable = encode_features,
+                            python_callable = lazy_callable(UTILS, 'encode_features'),
                             dag = ML_training_dag)
 
+tuning_tasks = []
+if TUNING_ENABLED:
+    ###############################################################################
+    # Create a task for tune_model_config() function with task_id 'tuning_model'
+    # ##############################################################################
+    tune_model_config_task = PythonOperator(
+                                task_id = 'tuning_model',
+                                python_callable = lazy_callable(UTILS, 'tune_model_config'),
+                                dag = ML_training_dag)
+    tuning_tasks = [tune_model_config_task]
+
 ###############################################################################
 # Create a task for get_trained_model() function with task_id 'training_model'
 # ##############################################################################
 get_trained_model_task = PythonOperator(
                             task_id = 'training_model',
-                            python_callable = get_trained_model,
+                            python_callable = lazy_callable(UTILS, 'get_trained_model'),
                             dag = ML_training_dag)
 
 
 ###############################################################################
 # Define relations between tasks
 # ##############################################################################
-encode_features_task >> get_trained_model_task
+chain(encode_features_task, *tuning_tasks, get_trained_model_task)
 
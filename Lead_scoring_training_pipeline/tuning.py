@@ -0,0 +1,272 @@
+'''
+filename: tuning.py
+functions: sample_configs, successive_halving, rung_rounds, save_tuned_config, tuned_model_config
+
+Hyperparameter search of the tune_model_config stage. TUNING_TRIALS
+configurations are drawn from TUNING_SEARCH_SPACE and raced by successive
+halving: every configuration is trained for TUNING_MIN_ROUNDS boosting
+rounds, the best 1 / TUNING_ETA of them by validation AUC are trained again
+for TUNING_ETA times more rounds, and so on up to the num_boost_round of
+model_config, so that most of the time goes to the promising ones.
+
+The trials run in a pool of TUNING_WORKERS processes. Every worker loads the
+same pre-binned training set from a lightgbm binary file once, and the
+validation data once, then trains the configurations it is handed. No trial
+is started after TUNING_BUDGET_SECONDS and the running ones stop at that
+deadline, a trial stopped early is not promoted. The workers are spawned
+processes, which import the __main__ module of the caller again: a script
+calling successive_halving must do it under if __name__ == '__main__'. When
+a worker dies, or the trials are still not back DEADLINE_GRACE_SECONDS after
+the deadline, the search ends with the best configuration found so far.
+
+The best configuration is saved in the 'tuned_model_config' table of the
+stage store, with the versions of the features and target it was tuned on,
+and get_trained_model trains with it while these versions do not change.
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+
+
+TUNED_MODEL_CONFIG_TABLE = 'tuned_model_config'
+
+# the training set and validation data of a worker process, see init_worker
+WORKER_DATA = {}
+
+# a trial stops training at the deadline but still predicts the validation
+# data, it is waited for this much longer
+DEADLINE_GRACE_SECONDS = 60
+
+
+###############################################################################
+# Define the function to draw the configurations
+# ##############################################################################
+
+def sample_configs(search_space, n_trials, seed):
+    '''
+    This function draws n_trials configurations from search_space.
+
+    INPUTS
+        search_space : dict of parameter name to
+                           ('uniform', low, high)
+                           ('log_uniform', low, high)
+                           ('int', low, high), high included
+                           ('choice', [values])
+        n_trials : number of configurations
+        seed : seed of the random generator
+
+    OUTPUT
+        list of dicts of parameters
+
+    SAMPLE USAGE
+        configs = sample_configs({'num_leaves': ('int', 8, 128)}, 27, 42)
+    '''
+    rng = np.random.default_rng(seed)
+    configs = []
+    for _ in range(n_trials):
+        config = {}
+        for name, (kind, *args) in search_space.items():
+            if kind == 'uniform':
+                config[name] = float(rng.uniform(args[0], args[1]))
+            elif kind == 'log_uniform':
+                config[name] = float(np.exp(rng.uniform(np.log(args[0]), np.log(args[1]))))
+            elif kind == 'int':
+                config[name] = int(rng.integers(args[0], args[1] + 1))
+            elif kind == 'choice':
+                config[name] = args[0][rng.integers(len(args[0]))]
+            else:
+                raise ValueError(f'Unknown kind of search space for {name}: {kind}')
+        configs.append(config)
+    return configs
+
+
+###############################################################################
+# Define the functions run by the worker processes
+# ##############################################################################
+
+def init_worker(train_path, dataset_params, dataset_options, X_valid, y_valid):
+    WORKER_DATA['train_set'] = lgb.Dataset(train_path, params=dataset_params, **dataset_options).construct()
+    WORKER_DATA['dataset_options'] = dataset_options
+    WORKER_DATA['X_valid'] = X_valid
+    WORKER_DATA['y_valid'] = y_valid
+
+
+def stop_at(deadline, stopped):
+    # lightgbm callback ending the training at the deadline, which it notes
+    # in stopped
+    def callback(env):
+        if time.time() >= deadline:
+            stopped.append(env.iteration)
+            raise lgb.callback.EarlyStopException(env.iteration, [])
+    return callback
+
+
+def run_trial(trial, params, num_boost_round, deadline):
+    '''
+    Trains params on the training set of the worker for num_boost_round
+    rounds, or until the deadline, and returns the validation AUC.
+    '''
+    start = time.perf_counter()
+    stopped = []
+    booster = lgb.train(params, WORKER_DATA['train_set'], num_boost_round=num_boost_round,
+                        callbacks=[stop_at(deadline, stopped)], **WORKER_DATA['dataset_options'])
+    # lightgbm also ends with fewer rounds when no leaf can be split any more,
+    # the trial is then complete
+    rounds = booster.current_iteration()
+    probabilities = booster.predict(WORKER_DATA['X_valid'], num_iteration=rounds)
+    return {'trial': trial,
+            'rounds': rounds,
+            'complete': not stopped,
+            'validation_auc': float(roc_auc_score(WORKER_DATA['y_valid'], probabilities)),
+            'seconds': time.perf_counter() - start}
+
+
+###############################################################################
+# Define the successive halving search
+# ##############################################################################
+
+def rung_rounds(min_rounds, max_rounds, eta):
+    # boosting rounds of every rung, min_rounds * eta ** k then max_rounds
+    rounds = []
+    while min_rounds < max_rounds:
+        rounds.append(min_rounds)
+        min_rounds *= eta
+    return rounds + [max_rounds]
+
+
+def successive_halving(configs, base_params, train_path, dataset_options, X_valid, y_valid,
+                       min_rounds, max_rounds, eta, workers, budget_seconds):
+    '''
+    This function races configs by successive halving on validation AUC.
+
+    INPUTS
+        configs : configurations returned by sample_configs
+        base_params : lightgbm parameters the configurations are applied on,
+                      the training set was built with them
+        train_path : lightgbm binary file of the training set
+        dataset_options : lgb.Dataset arguments the training set was built
+                          with
+        X_valid, y_valid : validation data
+        min_rounds, max_rounds : boosting rounds of the first and last rung
+        eta : 1 / eta of the configurations are promoted at every rung
+        workers : number of worker processes
+        budget_seconds : wall clock budget of the search
+
+    OUTPUT
+        (best, results), best the trial dict {'trial', 'params',
+        'validation_auc', 'rounds'} with the best validation AUC at the
+        highest rung completed, None when no trial completed, and results
+        the list of the result of every trial at every rung, with its
+        'rung', 'params' and 'status' ('promoted', 'pruned' or 'stopped'
+        for the trials stopped at the deadline and those of a rung cut
+        short by a dead or late worker)
+
+    SAMPLE USAGE
+        best, results = successive_halving(configs, params, '/tmp/train.bin', {}, X_valid, y_valid,
+                                           25, 200, 3, 4, 1800)
+    '''
+    deadline = time.time() + budget_seconds
+    # the cores are shared between the workers
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    survivors = list(enumerate(configs))
+    results = []
+    best = None
+
+    context = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                   initargs=(train_path, base_params, dataset_options, X_valid, y_valid))
+    interrupted = False
+    try:
+        for rung, rounds in enumerate(rung_rounds(min_rounds, max_rounds, eta)):
+            if time.time() >= deadline:
+                print(f'Tuning budget of {budget_seconds} seconds used up before rung {rung}')
+                break
+            rung_results = []
+            try:
+                futures = {executor.submit(run_trial, trial, dict(base_params, **config, n_jobs=threads),
+                                           rounds, deadline): config
+                           for trial, config in survivors}
+                for future in as_completed(futures, timeout=deadline - time.time() + DEADLINE_GRACE_SECONDS):
+                    rung_results.append(dict(future.result(), rung=rung, params=futures[future]))
+            except (BrokenProcessPool, TimeoutError) as e:
+                interrupted = True
+                print(f'Tuning stopped at rung {rung}, a worker died or did not return by the deadline: '
+                      f'{e!r}. A script running the tuning must call it under if __name__ == "__main__"')
+                for result in rung_results:
+                    result['status'] = 'stopped'
+                results.extend(rung_results)
+                break
+
+            complete = sorted((result for result in rung_results if result['complete']),
+                              key=lambda result: result['validation_auc'], reverse=True)
+            promoted = complete[:max(1, len(survivors) // eta)]
+            promoted_trials = {result['trial'] for result in promoted}
+            for result in rung_results:
+                result['status'] = 'stopped' if not result['complete'] else \
+                    'promoted' if result['trial'] in promoted_trials else 'pruned'
+            results.extend(rung_results)
+            print(f"Rung {rung}: {len(rung_results)} trials of {rounds} rounds, "
+                  f"best validation AUC {complete[0]['validation_auc'] if complete else float('nan'):.4f}")
+
+            if promoted:
+                best = {key: promoted[0][key] for key in ('trial', 'params', 'validation_auc', 'rounds')}
+            survivors = [(result['trial'], result['params']) for result in promoted]
+            if len(survivors) <= 1:
+                break
+    finally:
+        # waiting for a hung worker would hang the task, it is terminated
+        if interrupted:
+            terminate_workers(executor)
+        executor.shutdown(wait=not interrupted, cancel_futures=True)
+    return best, results
+
+
+def terminate_workers(executor):
+    # ProcessPoolExecutor has no public way to stop its running workers
+    for process in list((getattr(executor, '_processes', None) or {}).values()):
+        if process.is_alive():
+            process.terminate()
+
+
+###############################################################################
+# Define the functions to keep the tuned configuration
+# ##############################################################################
+
+def save_tuned_config(store, config, validation_auc):
+    '''
+    Saves config, the full model configuration, as the tuned configuration
+    of the current features and target.
+    '''
+    store.write(pd.DataFrame({'tuned_at': [datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
+                              'features_version': [store.version('features')],
+                              'target_version': [store.version('target')],
+                              'model_config': [json.dumps(config, sort_keys=True)],
+                              'validation_auc': [validation_auc]}),
+                TUNED_MODEL_CONFIG_TABLE)
+
+
+def tuned_model_config(store):
+    '''
+    Returns the tuned model configuration, or None when there is none or it
+    was tuned on other features or another target.
+    '''
+    if not store.exists(TUNED_MODEL_CONFIG_TABLE):
+        return None
+    tuned = store.read_table(TUNED_MODEL_CONFIG_TABLE).iloc[-1]
+    if tuned['features_version'] != store.version('features') or tuned['target_version'] != store.version('target'):
+        return None
+    return json.loads(tuned['model_config'])
@@ -1,6 +1,6 @@
 '''
 filename: utils.py
-functions: encode_features, get_train_model
+functions: encode_features, tune_model_config, get_train_model
 creator: shashank.gupta
 version: 1
 '''
@@ -16,11 +16,16 @@ import sqlite3
 from sqlite3 import Error
 
 import mlflow
+import mlflow.lightgbm
 import mlflow.sklearn
 
 from datetime import datetime
 from datetime import date
 
+import os
+import time
+import uuid
+
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import roc_auc_score
 import lightgbm as lgb
@@ -33,6 +38,17 @@ from sklearn.metrics import classification_report
 from sklearn.metrics import confusion_matrix
 
 from Lead_scoring_training_pipeline.constants import *
+from Lead_scoring_training_pipeline.encoder import compile_encoder, one_hot_encode, one_hot_encode_sparse
+from Lead_scoring_training_pipeline.encoder import category_codes, category_encode
+from Lead_scoring_training_pipeline.dataset_cache import dataset_cache_key, load_cached_datasets, save_cached_datasets
+from Lead_scoring_training_pipeline.tuning import sample_configs, successive_halving, save_tuned_config, tuned_model_config
+from Lead_scoring_data_pipeline.stage_store import get_stage_store
+from Lead_scoring_data_pipeline.stage_cache import cached_stage
+from Lead_scoring_data_pipeline.telemetry import instrumented_stage
+
+TELEMETRY_DAG = 'Lead_scoring_training_pipeline'
+# the test data of get_trained_model, never seen by the tuning
+TRAIN_TEST_SPLIT = {'test_size': 0.2, 'random_state': 100}
 
 
 #helper function
@@ -60,6 +76,9 @@ def create_sqlit_connection(db_path,db_file):
         if conn:
             conn.close()
 
+def open_stage_store():
+    return get_stage_store(STAGE_STORE_BACKEND, DB_PATH, DB_FILE_NAME, STAGE_STORE_DIRECTORY)
+
 def create_mlflow_experiment():
     experiment_name = EXPERIMENT
     
@@ -77,10 +96,75 @@ def create_mlflow_experiment():
     mlflow.set_experiment(experiment_name)
 
 
+def lightgbm_params(model_config):
+    '''
+    Returns the lgb.train parameters and number of boosting rounds of the
+    LGBMClassifier configuration model_config, the same model as
+    LGBMClassifier().set_params(**model_config).fit trains.
+    '''
+    params = {name: value for name, value in model_config.items()
+              if name not in ('n_estimators', 'num_boost_round', 'class_weight', 'importance_type', 'silent',
+                              'categorical_feature')}
+    # num_boost_round in the parameters takes precedence over n_estimators
+    return params, model_config.get('num_boost_round', model_config.get('n_estimators', 100))
+
+
+def training_data_options():
+    '''
+    Returns the lgb.Dataset arguments of the features, the code dictionary
+    of the categorical features (None unless NATIVE_CATEGORICAL) and
+    whether the features are sparse.
+    '''
+    dataset_options = {}
+    codes = None
+    if NATIVE_CATEGORICAL:
+        # the codes of the 'features' table were written with this
+        # dictionary, it is logged with the model for the inference pipeline
+        codes = category_codes(FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES)
+        copied = compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES))['copied']
+        # the names are needed to find the categorical features in a
+        # training set loaded from a binary file
+        dataset_options['feature_name'] = list(codes) + list(copied)
+        dataset_options['categorical_feature'] = list(codes)
+    # the category codes are few columns, they are always kept dense
+    sparse_features = SPARSE_FEATURES and not NATIVE_CATEGORICAL
+    if sparse_features:
+        # the column names of features.npz, so that the model has the same
+        # features as when trained on the dense table
+        dataset_options['feature_name'] = ONE_HOT_ENCODED_FEATURES
+    return dataset_options, codes, sparse_features
+
+
+def load_training_data(store, sparse_features):
+    # returns the features and the target of the same leads, in the same order
+    print("Loading 'target' table")
+    y = store.read('target')
+
+    if sparse_features:
+        print("Loading 'features.npz'")
+        X, keys, columns = store.read_sparse('features')
+        # lightgbm only takes float values in a CSR matrix
+        X = X.astype(np.float32)
+        if 'lead_id' in y.columns:
+            y = y.set_index('lead_id').reindex(keys)
+        return X, y
+
+    print("Loading 'features' table")
+    X = store.read('features')
+    if 'lead_id' in X.columns:
+        # the target of every lead is matched by its lead_id, which is not a
+        # feature of the model
+        X = X.set_index('lead_id')
+        y = y.set_index('lead_id').reindex(X.index)
+    return X, y
+
+
 ###############################################################################
 # Define the function to encode features
 # ##############################################################################
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+@cached_stage('training_encode_features', open_stage_store, ['model_input'], ['features', 'target'])
 def encode_features():
     '''
     This function one hot encodes the categorical features present in our  
@@ -106,59 +190,156 @@ def encode_features():
         pipeline from the pre-requisite module for this.
     '''
     
-    cnx = sqlite3.connect(DB_PATH + DB_FILE_NAME)
+    store = open_stage_store()
     print("Loading model_input table")
-    df = pd.read_sql('select * from model_input', cnx)
+    # only read the columns that end up in the features or the target
+    columns = [column for column in store.columns('model_input')
+               if column in FEATURES_TO_ENCODE or column in ONE_HOT_ENCODED_FEATURES
+               or column in ('lead_id', 'app_complete_flag')]
+    df = store.read('model_input', columns=columns)
     print("Table model_input columns: ", df.columns)
-    print("Converting 'city_tier' column from float to category in model_input dataframe")
-    df['city_tier'] = df.city_tier.astype('category')
-
-    print("One hot encoding features")
-   # Implement these steps to prevent dimension mismatch during inference
-    encoded_df = pd.DataFrame(columns= ONE_HOT_ENCODED_FEATURES) # from constants.py
-    placeholder_df = pd.DataFrame()
-
-    # One-Hot Encoding using get_dummies for the specified categorical features
-    for f in FEATURES_TO_ENCODE:
-        if(f in df.columns):
-            encoded = pd.get_dummies(df[f])
-            encoded = encoded.add_prefix(f + '_')
-            placeholder_df = pd.concat([placeholder_df, encoded], axis=1)
-        else:
-            print(f + ',Feature not found')
-
-    # Implement these steps to prevent dimension mismatch during inference
-    for feature in encoded_df.columns:
-        if feature in df.columns:
-            encoded_df[feature] = df[feature]
-        if feature in placeholder_df.columns:
-            encoded_df[feature] = placeholder_df[feature]
-
-    encoded_df.fillna(0, inplace=True)
-    print("Encoded dataframe columns: ", encoded_df.columns)
+    # the encoder is shared with the inference pipeline, see encoder.py
+    encoder = compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES))
+    # both tables keep the lead_id of their rows
+    key_columns = ['lead_id'] if 'lead_id' in df.columns else []
 
-    target = df[['app_complete_flag']]
+    target = df[key_columns + ['app_complete_flag']]
     print("Shape of target dataframe:", target.shape) 
     print("Storing target features to 'target' table")            
-    target.to_sql(name='target', con=cnx, if_exists='replace', index=False)
+    store.write(target, 'target')
+
+    if NATIVE_CATEGORICAL:
+        print("Encoding features as category codes")
+        codes = category_codes(FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES)
+        encoded_df = category_encode(df, codes, list(encoder['copied']))
+    elif SPARSE_FEATURES:
+        print("One hot encoding features")
+        matrix = one_hot_encode_sparse(df, encoder)
+        keys = df['lead_id'] if key_columns else np.arange(df.shape[0])
+        print("Shape of feature matrix:", matrix.shape, "non-zeros:", matrix.nnz)
+        print("Storing features to 'features.npz'")
+        store.write_sparse(matrix, keys, encoder['columns'], 'features')
+        store.close()
+        return
+    else:
+        print("One hot encoding features")
+        encoded_df = one_hot_encode(df, encoder)
+
+    if key_columns:
+        encoded_df.insert(0, 'lead_id', df['lead_id'])
+    print("Encoded dataframe columns: ", encoded_df.columns)
 
     print("Shape of feature dataframe:", encoded_df.shape) 
     print("Storing rest of features to 'feature' table")            
-    encoded_df.to_sql(name='features', con=cnx, if_exists='replace', index=False)   
-    cnx.close()
+    store.write(encoded_df, 'features')
+    store.close()
+
+
+###############################################################################
+# Define the function to tune the model configuration
+# ##############################################################################
+
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
+def tune_model_config():
+    '''
+    This function searches the model configuration that get_trained_model
+    trains with. Configurations drawn from TUNING_SEARCH_SPACE, applied on
+    model_config, are raced by successive halving on the AUC of a validation
+    split of the training data, in a pool of worker processes that share one
+    pre-binned training set, within TUNING_BUDGET_SECONDS. See tuning.py.
+
+    INPUTS
+        db_file_name : Name of the database file
+        db_path : path where the db file should be
+        TUNING_* : settings of the search in constants.py
+
+    OUTPUT
+        Logs every trial into a nested run of an mlflow run named
+        <EXPERIMENT>_tuning_<date>
+        Saves the best configuration in the 'tuned_model_config' table
+
+    SAMPLE USAGE
+        tune_model_config()
+    '''
+    print("Set MLflow tracking url and create/set experiment")
+    create_mlflow_experiment()
+
+    store = open_stage_store()
+    train_path = None
+    try:
+        params, max_rounds = lightgbm_params(model_config)
+        # the configurations change min_child_samples, so the features are
+        # not filtered on it when they are binned
+        params['feature_pre_filter'] = False
+        dataset_options, _, sparse_features = training_data_options()
+
+        X, y = load_training_data(store, sparse_features)
+        print("Splitting the training data into fit and validation data")
+        X_train, _, y_train, _ = train_test_split(X, y, **TRAIN_TEST_SPLIT)
+        X_fit, X_valid, y_fit, y_valid = train_test_split(X_train, y_train, test_size=TUNING_VALIDATION_FRACTION,
+                                                          random_state=TUNING_SEED)
+
+        print("Binning the fit data once for every trial")
+        os.makedirs(DATASET_CACHE_DIRECTORY, exist_ok=True)
+        train_path = os.path.join(DATASET_CACHE_DIRECTORY, f'.tuning.{uuid.uuid4().hex}.bin')
+        lgb.Dataset(X_fit, label=np.ravel(y_fit), params=params, **dataset_options).save_binary(train_path)
+
+        configs = sample_configs(TUNING_SEARCH_SPACE, TUNING_TRIALS, TUNING_SEED)
+        workers = TUNING_WORKERS or os.cpu_count() or 1
+        print(f"Racing {len(configs)} configurations in {workers} worker processes")
+        start = time.perf_counter()
+        best, results = successive_halving(configs, params, train_path, dataset_options, X_valid, np.ravel(y_valid),
+                                           TUNING_MIN_ROUNDS, max_rounds, TUNING_ETA, workers, TUNING_BUDGET_SECONDS)
+        elapsed = time.perf_counter() - start
+
+        run_name = EXPERIMENT + '_tuning_' + date.today().strftime("%d_%m_%Y_%H_%M_%S")
+        with mlflow.start_run(run_name=run_name):
+            print("Logging the trials in mlflow")
+            for trial, config in enumerate(configs):
+                trial_results = [result for result in results if result['trial'] == trial]
+                if not trial_results:
+                    continue
+                with mlflow.start_run(run_name=f'trial_{trial}', nested=True):
+                    mlflow.log_params(config)
+                    for result in trial_results:
+                        mlflow.log_metric('validation_auc', result['validation_auc'], step=result['rounds'])
+                    mlflow.set_tag('status', trial_results[-1]['status'])
+                    mlflow.set_tag('rung', trial_results[-1]['rung'])
+            mlflow.log_param('trials', len(configs))
+            mlflow.log_param('budget_seconds', TUNING_BUDGET_SECONDS)
+            mlflow.log_metric('tuning_seconds', elapsed)
+
+            if best is None:
+                print("No trial completed within the budget, keeping model_config")
+                return
+            tuned_config = dict(model_config, **best['params'])
+            print("Best configuration: ", best['params'], "validation AUC=", best['validation_auc'])
+            mlflow.log_params({f'best_{name}': value for name, value in best['params'].items()})
+            mlflow.log_metric('best_validation_auc', best['validation_auc'])
+            save_tuned_config(store, tuned_config, best['validation_auc'])
+    finally:
+        if train_path and os.path.isfile(train_path):
+            os.remove(train_path)
+        store.close()
 
 
 ###############################################################################
 # Define the function to train the model
 # ##############################################################################
 
+@instrumented_stage(TELEMETRY_DAG, open_stage_store)
 def get_trained_model():
     '''
     This function setups mlflow experiment to track the run of the training pipeline. It 
     also trains the model based on the features created in the previous function and 
     logs the train model into mlflow model registry for prediction. The input dataset is split
     into train and test data and the auc score calculated on the test data and
-    recorded as a metric in mlflow run.   
+    recorded as a metric in mlflow run. The binned training set and the test data
+    are reused from the dataset cache while the features and the target do not
+    change, see dataset_cache.py. Unless EARLY_STOPPING_ROUNDS is None, a
+    validation split of the train data stops the boosting once its
+    EARLY_STOPPING_METRIC stops improving, and only the trees up to the best
+    iteration are kept in the logged model.
 
     INPUTS
         db_file_name : Name of the database file
@@ -177,16 +358,56 @@ def get_trained_model():
     print("Set MLflow tracking url and create/set experiment")
     create_mlflow_experiment()
     
-    cnx = sqlite3.connect(DB_PATH + DB_FILE_NAME)
-    
-    print("Loading 'features' table")
-    X = pd.read_sql('select * from features', cnx)        
-
-    print("Loading 'target' table")
-    y = pd.read_sql('select * from target', cnx)        
-
-    print("Splitting data into train and test")
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size = 0.2, random_state = 100)
+    store = open_stage_store()
+
+    config = model_config
+    if TUNING_ENABLED:
+        tuned_config = tuned_model_config(store)
+        if tuned_config is not None:
+            print("Using the model configuration tuned on these features")
+            config = tuned_config
+    params, num_boost_round = lightgbm_params(config)
+    dataset_options, codes, sparse_features = training_data_options()
+    early_stopping = EARLY_STOPPING_ROUNDS is not None
+    if early_stopping:
+        params['metric'] = EARLY_STOPPING_METRIC
+
+    split = TRAIN_TEST_SPLIT
+    if early_stopping:
+        split = dict(TRAIN_TEST_SPLIT, validation_size=EARLY_STOPPING_VALIDATION_FRACTION)
+    cache_key = dataset_cache_key(store, params, split, dataset_options) if DATASET_CACHE_ENABLED else None
+    cached = load_cached_datasets(DATASET_CACHE_DIRECTORY, cache_key, params, dataset_options) if cache_key else None
+    if cached is not None:
+        print("Features unchanged, loading the binned training set from the dataset cache:", cache_key)
+        train_set, (X_test, y_test, X_valid, y_valid) = cached
+    else:
+        X, y = load_training_data(store, sparse_features)
+
+        print("Splitting data into train and test")
+        X_train, X_test, y_train, y_test = train_test_split(X, y, **TRAIN_TEST_SPLIT)
+        X_valid = y_valid = None
+        if early_stopping:
+            print("Splitting the train data into fit and validation data for early stopping")
+            X_train, X_valid, y_train, y_valid = train_test_split(X_train, y_train,
+                                                                  test_size=EARLY_STOPPING_VALIDATION_FRACTION,
+                                                                  random_state=TRAIN_TEST_SPLIT['random_state'])
+
+        print("Binning the training set")
+        train_set = lgb.Dataset(X_train, label=np.ravel(y_train), params=params, **dataset_options)
+        if cache_key:
+            print("Saving the binned training set to the dataset cache:", cache_key)
+            save_cached_datasets(DATASET_CACHE_DIRECTORY, cache_key, train_set, (X_test, y_test, X_valid, y_valid),
+                                 DATASET_CACHE_MAX_ENTRIES)
+
+    training_options = {}
+    if early_stopping:
+        # binned with the bins of the training set
+        valid_set = lgb.Dataset(X_valid, label=np.ravel(y_valid), reference=train_set, **dataset_options)
+        # the training booster is kept to count the rounds trained after the
+        # best iteration, the model is cut at the best iteration below
+        training_options = {'valid_sets': [valid_set], 'valid_names': ['validation'],
+                            'callbacks': [lgb.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)],
+                            'keep_training_booster': True}
 
     #Model Training
 
@@ -197,21 +418,42 @@ def get_trained_model():
     with mlflow.start_run(run_name=run_name) as run:
 
         #Model Training
-        print("Instantiated LGBMClassifier")
-        clf = lgb.LGBMClassifier()
-        print("Setting model configurations: ", model_config)
-        clf.set_params(**model_config)
-        print("Starting LGBMClassifier model training")
-        clf.fit(X_train, y_train)
+        print("Setting model configurations: ", config)
+        print("Starting LightGBM model training")
+        # lgb.train resets the feature names and categorical features of the
+        # training set unless they are passed again
+        model = lgb.train(params, train_set, num_boost_round=num_boost_round, **training_options, **dataset_options)
+        trained_rounds = model.current_iteration()
+        if early_stopping:
+            best_iteration = model.best_iteration or trained_rounds
+            validation_score = model.best_score['validation'][EARLY_STOPPING_METRIC]
+            print(f"Best iteration {best_iteration} of {trained_rounds} trained, validation "
+                  f"{EARLY_STOPPING_METRIC}= {validation_score}")
+            # only the trees up to the best iteration are logged and used
+            model = lgb.Booster(model_str=model.model_to_string(num_iteration=best_iteration))
 
         print("Logging model to mlflow with name as LightGBM")
-        mlflow.sklearn.log_model(sk_model=clf,artifact_path="models", registered_model_name='LightGBM')
+        mlflow.lightgbm.log_model(lgb_model=model, artifact_path="models", registered_model_name='LightGBM')
         print("Logging model params in mlflow")
-        mlflow.log_params(model_config)    
+        mlflow.log_params(config)    
+        mlflow.log_param('native_categorical', NATIVE_CATEGORICAL)
+        mlflow.log_param('tuned', config is not model_config)
+        mlflow.log_param('dataset_cache_hit', cached is not None)
+        mlflow.log_param('early_stopping_rounds', EARLY_STOPPING_ROUNDS)
+        mlflow.log_metric('trained_rounds', trained_rounds)
+        mlflow.log_metric('num_trees', model.num_trees())
+        if early_stopping:
+            mlflow.log_metric('best_iteration', best_iteration)
+            mlflow.log_metric('validation_' + EARLY_STOPPING_METRIC, validation_score)
+        if codes is not None:
+            print("Logging category code dictionary to mlflow as", CATEGORY_CODES_ARTIFACT)
+            mlflow.log_dict(codes, CATEGORY_CODES_ARTIFACT)
 
         # predict the results on training dataset
         print("Prediction on test data")
-        y_pred=clf.predict(X_test)
+        # the booster predicts the probability of app_complete_flag being 1
+        probabilities = model.predict(X_test)
+        y_pred = (probabilities > PREDICTION_THRESHOLD).astype(int)
 
         #Log metrics
         print("Calculating Metrics scores on test data")
@@ -219,7 +461,9 @@ def get_trained_model():
         precision = precision_score(y_pred, y_test,average= 'macro')
         recall = recall_score(y_pred, y_test, average= 'macro')
         f1 = f1_score(y_pred, y_test, average='macro')
-        auc = roc_auc_score(y_pred, y_test, average='weighted', multi_class='ovr')
+        # ranked on the probabilities, as the validation AUC of the tuning,
+        # a model can rank well with every probability below the threshold
+        auc = roc_auc_score(y_test, probabilities)
         cm = confusion_matrix(y_test, y_pred)
         tn = cm[0][0]
         fn = cm[1][0]
@@ -247,7 +491,7 @@ def get_trained_model():
         runID = run.info.run_uuid
         print("Inside MLflow Run with id {}".format(runID))
             
-    print("Closing database connection")        
-    cnx.close()
+    print("Closing stage store")
+    store.close()
 
    
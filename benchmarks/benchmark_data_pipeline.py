@@ -0,0 +1,230 @@
+'''
+filename: benchmark_data_pipeline.py
+functions: run_benchmark, scaling_exponents, compare_results
+
+Scaling benchmark of the stages of Lead_scoring_data_pipeline.utils. For
+every size a synthetic lead file is written with synthetic_leads.py and the
+stages run on it one after the other, each in a fresh process so that its
+peak memory is its own. The measurements are the rows of the
+'pipeline_metrics' table recorded by telemetry.py.
+
+The results are saved as JSON with, for every size and stage, the wall and
+cpu time, the throughput in rows per second and the peak memory, and, for
+every stage, the exponent of the fitted curve wall_seconds ~ rows ** k
+(1 for a stage that scales linearly). Two result files are compared with
+--compare.
+
+SAMPLE USAGE
+    python -m benchmarks.benchmark_data_pipeline --sizes 10000 100000 1000000 \
+        --output results.json
+    python -m benchmarks.benchmark_data_pipeline --sizes 1000000 \
+        --set STAGE_STORE_BACKEND="'parquet'" --compare results.json
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_leads import write_synthetic_leads
+
+
+STAGES = ['load_data_into_db', 'map_city_tier', 'map_categorical_vars', 'interactions_mapping']
+FUSED_STAGES = ['load_data_into_db', 'map_fused_transforms']
+
+
+###############################################################################
+# Define the functions to run the stages
+# ##############################################################################
+
+def configure(work_directory, overrides):
+    # points the pipeline at the benchmark directory, the stage cache is off
+    # so that every stage really runs
+    import Lead_scoring_data_pipeline.utils as utils
+    utils.DB_PATH = work_directory + '/'
+    utils.DATA_DIRECTORY = work_directory + '/'
+    utils.DATA_FILE = 'leadscoring.csv'
+    utils.STAGE_STORE_DIRECTORY = os.path.join(work_directory, 'stage_store') + '/'
+    utils.INTERACTION_MAPPING = os.path.join(utils.MAPPING_DIRECTORY, 'interaction_mapping.csv')
+    utils.STAGE_CACHE_ENABLED = False
+    utils.TELEMETRY_ENABLED = True
+    for name, value in overrides.items():
+        setattr(utils, name, value)
+    return utils
+
+
+def run_stage(stage, work_directory, overrides):
+    '''
+    Runs one stage in the benchmark directory and returns its output. Runs in
+    a worker process of its own.
+    '''
+    utils = configure(work_directory, overrides)
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        getattr(utils, stage)()
+    return output.getvalue()
+
+
+def last_metrics(work_directory, overrides, stage):
+    utils = configure(work_directory, overrides)
+    store = utils.open_stage_store()
+    try:
+        metrics = store.read_table('pipeline_metrics')
+    finally:
+        store.close()
+    return metrics[metrics['stage'] == stage].iloc[-1]
+
+
+def run_size(n_rows, work_directory, overrides, seed):
+    '''
+    This function runs every stage on n_rows synthetic leads and returns a
+    dict of measurements per stage.
+    '''
+    shutil.rmtree(work_directory, ignore_errors=True)
+    os.makedirs(work_directory)
+    write_synthetic_leads(os.path.join(work_directory, 'leadscoring.csv'), n_rows, seed=seed)
+
+    utils = configure(work_directory, overrides)
+    stages = FUSED_STAGES if utils.FUSED_TRANSFORMS else STAGES
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for stage in stages:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            output = executor.submit(run_stage, stage, work_directory, overrides).result()
+        metrics = last_metrics(work_directory, overrides, stage)
+        # the stages print their exceptions instead of raising them
+        failed = metrics['status'] != 'success' or 'Exception thrown' in output
+        results.append({'rows': n_rows,
+                        'stage': stage,
+                        'status': 'failed' if failed else 'success',
+                        'wall_seconds': float(metrics['wall_seconds']),
+                        'cpu_seconds': float(metrics['cpu_seconds']),
+                        'rows_per_second': n_rows / max(float(metrics['wall_seconds']), 1e-9),
+                        # every stage runs in a new process, the peak of its
+                        # children is the one of the stage
+                        'peak_rss_mb': max(float(metrics['peak_rss_mb']), float(metrics['children_peak_rss_mb'])),
+                        'rows_in': int(metrics['rows_in']),
+                        'rows_out': int(metrics['rows_out']),
+                        'store_seconds': float(metrics['sqlite_seconds'] + metrics['parquet_seconds'])})
+        print(f"{n_rows:>10} rows  {stage:<22} {results[-1]['status']:<8}"
+              f"{results[-1]['wall_seconds']:>9.2f} s {results[-1]['rows_per_second']:>12.0f} rows/s"
+              f"{results[-1]['peak_rss_mb']:>9.0f} MB")
+    return results
+
+
+###############################################################################
+# Define the functions to summarize the results
+# ##############################################################################
+
+def scaling_exponents(results):
+    '''
+    Returns, for every stage run at two sizes or more, the exponent k of the
+    least squares fit of log(wall_seconds) = k * log(rows) + c.
+    '''
+    df = pd.DataFrame(results)
+    df = df[(df['status'] == 'success') & (df['wall_seconds'] > 0)]
+    exponents = {}
+    for stage, runs in df.groupby('stage', sort=False):
+        if runs['rows'].nunique() > 1:
+            exponents[stage] = float(np.polyfit(np.log(runs['rows']), np.log(runs['wall_seconds']), 1)[0])
+    return exponents
+
+
+def compare_results(current, baseline):
+    '''
+    Prints the wall time of every stage and size against a baseline result
+    file, as the ratio current / baseline.
+    '''
+    baseline_runs = {(run['rows'], run['stage']): run for run in baseline['results']}
+    print(f"{'rows':>10}  {'stage':<22}{'baseline s':>12}{'current s':>12}{'ratio':>8}")
+    for run in current['results']:
+        base = baseline_runs.get((run['rows'], run['stage']))
+        if base is None:
+            continue
+        ratio = run['wall_seconds'] / max(base['wall_seconds'], 1e-9)
+        print(f"{run['rows']:>10}  {run['stage']:<22}{base['wall_seconds']:>12.2f}{run['wall_seconds']:>12.2f}{ratio:>8.2f}")
+
+
+def run_benchmark(sizes, overrides=None, work_directory=None, seed=42):
+    '''
+    This function runs the benchmark at every size.
+
+    INPUTS
+        sizes : numbers of synthetic leads
+        overrides : constants of Lead_scoring_data_pipeline.utils to set,
+                    e.g. {'STAGE_STORE_BACKEND': 'parquet'}
+        work_directory : directory of the synthetic files and stage stores,
+                         a temporary directory when None
+        seed : seed of the synthetic leads
+
+    OUTPUT
+        dict with the environment, the overrides, the measurements of every
+        run and the scaling exponent of every stage, ready for json.dump
+
+    SAMPLE USAGE
+        results = run_benchmark([10000, 100000])
+    '''
+    overrides = overrides or {}
+    root = work_directory or tempfile.mkdtemp(prefix='lead_scoring_benchmark_')
+    results = []
+    try:
+        for n_rows in sizes:
+            results.extend(run_size(n_rows, os.path.join(root, str(n_rows)), overrides, seed))
+    finally:
+        if work_directory is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    return {'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'environment': {'python': platform.python_version(),
+                            'pandas': pd.__version__,
+                            'numpy': np.__version__,
+                            'platform': platform.platform(),
+                            'cpu_count': os.cpu_count()},
+            'overrides': {name: repr(value) for name, value in overrides.items()},
+            'sizes': list(sizes),
+            'seed': seed,
+            'results': results,
+            'scaling_exponents': scaling_exponents(results)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data pipeline stages on synthetic leads.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--set', dest='overrides', action='append', default=[], metavar='NAME=VALUE',
+                        help='constant of the data pipeline to override, the value is a python literal')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--work-directory', default=None,
+                        help='keep the synthetic files and stage stores in this directory')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--compare', default=None, help='result file to compare the wall times against')
+    args = parser.parse_args()
+
+    import ast
+    overrides = {}
+    for override in args.overrides:
+        name, value = override.split('=', 1)
+        overrides[name] = ast.literal_eval(value)
+
+    current = run_benchmark(args.sizes, overrides, args.work_directory, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+    print('Scaling exponents: ' + ', '.join(f'{stage} {k:.2f}' for stage, k in current['scaling_exponents'].items()))
+    print(f'Saved the results to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(current, json.load(f))
@@ -0,0 +1,138 @@
+'''
+filename: dag_import_time.py
+functions: measure_dag_import, check_dag_imports
+
+Import time budget of the DAG files. Every DAG module is imported in a
+fresh interpreter started with python -X importtime, after airflow itself,
+so only the cost of the DAG file is measured, which is what the scheduler
+pays on every parse of the dags folder. A DAG fails the check when its
+import takes longer than the budget or loads one of HEAVY_MODULES, which
+only the task callables may import.
+
+Without airflow installed the DAG files cannot be imported, the project
+modules they import are measured instead.
+
+SAMPLE USAGE
+    python -m benchmarks.dag_import_time --budget-ms 100
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAG_MODULES = ['Lead_scoring_data_pipeline.lead_scoring_data_pipeline',
+               'Lead_scoring_training_pipeline.lead_scoring_training_pipeline',
+               'Lead_scoring_inference_pipeline.lead_scoring_inference_pipeline']
+HEAVY_MODULES = ['pandas', 'numpy', 'scipy', 'pyarrow', 'sklearn', 'lightgbm', 'mlflow', 'sqlite3']
+
+# runs in the fresh interpreter, prints the measurement as json
+MEASURE = '''
+import importlib, json, sys, time
+try:
+    for name in ("airflow", "airflow.operators.python", "airflow.operators.bash", "airflow.models.baseoperator"):
+        importlib.import_module(name)
+    airflow_available = True
+except ImportError:
+    airflow_available = False
+modules = [sys.argv[1]] if airflow_available else sys.argv[2:]
+before = set(sys.modules)
+start = time.perf_counter()
+for module in modules:
+    importlib.import_module(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({"airflow_available": airflow_available, "imported": modules,
+                  "seconds": elapsed, "new_modules": sorted(set(sys.modules) - before)}))
+'''
+
+
+###############################################################################
+# Define the functions to measure the DAG files
+# ##############################################################################
+
+def project_imports(dag_module):
+    # modules of this repo imported by the DAG file, from its source
+    path = os.path.join(REPO_DIRECTORY, *dag_module.split('.')) + '.py'
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module and node.module.startswith('Lead_scoring'):
+            modules.append(node.module)
+        elif isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names if alias.name.startswith('Lead_scoring'))
+    return modules
+
+
+def slowest_imports(importtime_log, modules, top=10):
+    # (cumulative microseconds, module) of the slowest modules the DAG
+    # imported, from the -X importtime lines
+    # 'import time: self [us] | cumulative | imported package'
+    timings = []
+    for line in importtime_log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() in modules:
+            timings.append((int(cumulative), name.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def measure_dag_import(dag_module):
+    '''
+    This function imports dag_module in a fresh interpreter and returns the
+    import time in seconds, the heavy modules it loaded and its slowest
+    imports.
+
+    SAMPLE USAGE
+        measure_dag_import('Lead_scoring_training_pipeline.lead_scoring_training_pipeline')
+    '''
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', MEASURE, dag_module,
+                              *project_imports(dag_module)],
+                             cwd=REPO_DIRECTORY, capture_output=True, text=True, check=True)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    new_modules = set(result.pop('new_modules'))
+    result['dag'] = dag_module
+    result['heavy_modules'] = [module for module in HEAVY_MODULES if module in new_modules]
+    result['slowest_imports'] = slowest_imports(process.stderr, new_modules)
+    return result
+
+
+def check_dag_imports(budget_seconds):
+    '''
+    This function measures every DAG file and returns the measurements and
+    whether they all stayed within the budget without heavy imports.
+    '''
+    results = [measure_dag_import(dag_module) for dag_module in DAG_MODULES]
+    passed = True
+    for result in results:
+        within_budget = result['seconds'] <= budget_seconds and not result['heavy_modules']
+        passed &= within_budget
+        print(f"{'ok  ' if within_budget else 'FAIL'} {result['dag']}: {result['seconds'] * 1000:.1f} ms"
+              + ('' if result['airflow_available'] else ' (airflow not installed, project imports only)')
+              + (f", heavy modules {', '.join(result['heavy_modules'])}" if result['heavy_modules'] else ''))
+        for cumulative, name in result['slowest_imports'][:5]:
+            print(f'        {cumulative / 1000:>8.1f} ms  {name}')
+    return results, passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the import time of the DAG files.')
+    parser.add_argument('--budget-ms', type=float, default=100,
+                        help='largest import time of a DAG file, after airflow is imported')
+    parser.add_argument('--output', default=None, help='json file to save the measurements to')
+    args = parser.parse_args()
+
+    results, passed = check_dag_imports(args.budget_ms / 1000)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'budget_ms': args.budget_ms, 'results': results}, f, indent=2)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,164 @@
+'''
+filename: synthetic_leads.py
+functions: fit_lead_profile, generate_leads, write_synthetic_leads
+
+Generator of synthetic lead files in the layout of leadscoring.csv
+(raw_data_schema in Lead_scoring_data_pipeline/schema.py), to run the data
+pipeline at sizes the sample files do not reach.
+
+The generator is fitted on reference files, by default the inference data
+and the unit test data of the repo:
+    - city_mapped, the utm / platform levels, total_leads_droppped,
+      referred_lead and app_complete_flag are drawn from their observed
+      frequencies, nulls included, so the level distributions and the city
+      names are the ones of the references
+    - the interaction columns are drawn as whole rows of the references,
+      which keeps their sparsity and the co-occurrence of the interactions
+    - created_date is spread over the date range of the references and
+      increases from chunk to chunk, as in a file exported in created order
+
+SAMPLE USAGE
+    python -m benchmarks.synthetic_leads /tmp/leadscoring.csv --rows 1000000
+'''
+
+###############################################################################
+# Import necessary modules
+# ##############################################################################
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from Lead_scoring_data_pipeline.schema import raw_data_schema
+
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REFERENCE_FILES = [os.path.join(REPO_DIRECTORY, 'Lead_scoring_data_pipeline', 'data', 'leadscoring_inference_final_v2.csv'),
+                   os.path.join(REPO_DIRECTORY, 'unit_test', 'leadscoring_test.csv')]
+
+INDEPENDENT_COLUMNS = ['city_mapped', 'first_platform_c', 'first_utm_medium_c', 'first_utm_source_c',
+                       'total_leads_droppped', 'referred_lead', 'app_complete_flag']
+INTERACTION_COLUMNS = [col for col in raw_data_schema
+                       if col not in INDEPENDENT_COLUMNS and col != 'created_date']
+
+
+###############################################################################
+# Define the function to fit the generator on reference files
+# ##############################################################################
+
+def read_reference(file_path):
+    # the unit test file has no index column
+    df = pd.read_csv(file_path, nrows=0)
+    if df.columns[0] == 'created_date':
+        return pd.read_csv(file_path)
+    return pd.read_csv(file_path, index_col=[0])
+
+
+def fit_lead_profile(reference_files=REFERENCE_FILES):
+    '''
+    This function collects the distributions the synthetic leads are drawn
+    from.
+
+    INPUTS
+        reference_files : lead files in the layout of leadscoring.csv, every
+                          column is fitted on the files that have it
+
+    OUTPUT
+        dict with, for every independent column, its values and their
+        frequencies, the interaction rows of the references and the range
+        of created_date
+
+    SAMPLE USAGE
+        profile = fit_lead_profile()
+    '''
+    references = [read_reference(file_path) for file_path in reference_files]
+
+    frequencies = {}
+    for col in INDEPENDENT_COLUMNS:
+        values = pd.concat([df[col] for df in references if col in df.columns])
+        counts = values.value_counts(dropna=False, normalize=True)
+        frequencies[col] = (counts.index.to_numpy(dtype=object), counts.to_numpy())
+
+    interactions = pd.concat([df.reindex(columns=INTERACTION_COLUMNS) for df in references
+                              if set(INTERACTION_COLUMNS) & set(df.columns)])
+    created_date = pd.to_datetime(pd.concat([df['created_date'] for df in references]))
+
+    return {'frequencies': frequencies,
+            'interactions': interactions.to_numpy(dtype=np.float64),
+            'start': created_date.min(),
+            'end': created_date.max()}
+
+
+###############################################################################
+# Define the functions to generate the synthetic leads
+# ##############################################################################
+
+def generate_leads(profile, n_rows, chunksize=500000, seed=42):
+    '''
+    This function generates n_rows synthetic leads.
+
+    INPUTS
+        profile : distributions returned by fit_lead_profile
+        n_rows : number of leads
+        chunksize : number of leads per yielded dataframe
+        seed : seed of the random generator, the same seed and chunksize
+               give the same leads
+
+    OUTPUT
+        yields dataframes with the columns of raw_data_schema, indexed by
+        the row number in the file
+
+    SAMPLE USAGE
+        for chunk in generate_leads(fit_lead_profile(), 1000000):
+            ...
+    '''
+    rng = np.random.default_rng(seed)
+    start, end = profile['start'].value, profile['end'].value
+    for chunk_start in range(0, n_rows, chunksize):
+        chunk_rows = min(chunksize, n_rows - chunk_start)
+
+        # every chunk covers its share of the date range, sorted within
+        low = start + (end - start) * chunk_start // n_rows
+        high = start + (end - start) * (chunk_start + chunk_rows) // n_rows
+        created_date = np.sort(rng.integers(low, high + 1, size=chunk_rows))
+        columns = {'created_date': pd.to_datetime(created_date).floor('s').strftime('%Y-%m-%d %H:%M:%S')}
+
+        for col in INDEPENDENT_COLUMNS:
+            values, probabilities = profile['frequencies'][col]
+            columns[col] = values[rng.choice(len(values), size=chunk_rows, p=probabilities)]
+
+        interactions = profile['interactions'][rng.integers(0, profile['interactions'].shape[0], size=chunk_rows)]
+        for position, col in enumerate(INTERACTION_COLUMNS):
+            columns[col] = interactions[:, position]
+
+        df = pd.DataFrame(columns, index=pd.RangeIndex(chunk_start, chunk_start + chunk_rows))
+        for col in ['total_leads_droppped', 'referred_lead', 'app_complete_flag']:
+            df[col] = pd.to_numeric(df[col])
+        yield df[raw_data_schema]
+
+
+def write_synthetic_leads(file_path, n_rows, chunksize=500000, seed=42, reference_files=REFERENCE_FILES):
+    '''
+    This function writes n_rows synthetic leads to file_path, in the layout
+    load_data_into_db reads, and returns file_path.
+
+    SAMPLE USAGE
+        write_synthetic_leads('/tmp/leadscoring.csv', 1000000)
+    '''
+    profile = fit_lead_profile(reference_files)
+    for chunk_number, chunk in enumerate(generate_leads(profile, n_rows, chunksize, seed)):
+        chunk.to_csv(file_path, mode='w' if chunk_number == 0 else 'a', header=chunk_number == 0)
+    return file_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic lead scoring csv.')
+    parser.add_argument('file_path')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunksize', type=int, default=500000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    write_synthetic_leads(args.file_path, args.rows, args.chunksize, args.seed)
+    print(f'Wrote {args.rows} synthetic leads to {args.file_path}')
@@ -0,0 +1,138 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import os
+import sys
+
+import pytest
+
+UNIT_TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# the pipeline packages are imported from the root of the repository
+sys.path.insert(0, os.path.dirname(UNIT_TEST_DIRECTORY))
+
+
+###############################################################################
+# Fixtures shared by the test cases of the pipeline packages
+# ##############################################################################
+
+@pytest.fixture
+def data_pipeline(tmp_path, monkeypatch):
+    """_summary_
+    Returns the utils module of the data pipeline with its database, stage
+    store and input file pointed to a temporary directory, the input file
+    being a copy of 'leadscoring_test.csv' which the test can rewrite.
+
+    SAMPLE USAGE
+        def test_stage(data_pipeline):
+            data_pipeline.load_data_into_db()
+    """
+    import pandas as pd
+    import Lead_scoring_data_pipeline.utils as utils
+
+    pd.read_csv(os.path.join(UNIT_TEST_DIRECTORY, 'leadscoring_test.csv')).to_csv(
+        tmp_path / 'leadscoring_test.csv', index=False)
+    monkeypatch.setattr(utils, 'DB_PATH', f'{tmp_path}/')
+    monkeypatch.setattr(utils, 'DATA_DIRECTORY', f'{tmp_path}/')
+    monkeypatch.setattr(utils, 'DATA_FILE', 'leadscoring_test.csv')
+    monkeypatch.setattr(utils, 'STAGE_STORE_DIRECTORY', f'{tmp_path}/stage_store/')
+    monkeypatch.setattr(utils, 'INTERACTION_MAPPING', os.path.join(UNIT_TEST_DIRECTORY, 'interaction_mapping.csv'))
+    return utils
+
+
+@pytest.fixture
+def training_pipeline(data_pipeline, tmp_path, monkeypatch):
+    """_summary_
+    Returns the utils module of the training pipeline reading the
+    'model_input' table the data pipeline built from 'leadscoring_test.csv'
+    in a temporary directory, with its dataset cache and a sqlite mlflow
+    tracking store in the same directory, which is made the working
+    directory.
+
+    SAMPLE USAGE
+        def test_stage(training_pipeline):
+            training_pipeline.encode_features()
+    """
+    import Lead_scoring_training_pipeline.utils as utils
+
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    data_pipeline.map_categorical_vars()
+    data_pipeline.interactions_mapping()
+    monkeypatch.setattr(utils, 'DB_PATH', data_pipeline.DB_PATH)
+    monkeypatch.setattr(utils, 'STAGE_STORE_DIRECTORY', data_pipeline.STAGE_STORE_DIRECTORY)
+    monkeypatch.setattr(utils, 'DATASET_CACHE_DIRECTORY', f'{tmp_path}/dataset_cache/')
+    monkeypatch.setattr(utils, 'TRACKING_URI', f'sqlite:///{tmp_path}/mlflow.db')
+    # mlflow stores the artifacts of a sqlite tracking store in ./mlruns
+    monkeypatch.chdir(tmp_path)
+    return utils
+
+
+@pytest.fixture
+def inference_pipeline(training_pipeline, tmp_path, monkeypatch):
+    """_summary_
+    Returns the utils module of the inference pipeline on the same database
+    and mlflow tracking store as the training_pipeline fixture.
+
+    SAMPLE USAGE
+        def test_stage(inference_pipeline):
+            inference_pipeline.encode_features()
+    """
+    import Lead_scoring_inference_pipeline.utils as utils
+
+    monkeypatch.setattr(utils, 'DB_PATH', training_pipeline.DB_PATH)
+    monkeypatch.setattr(utils, 'STAGE_STORE_DIRECTORY', training_pipeline.STAGE_STORE_DIRECTORY)
+    monkeypatch.setattr(utils, 'TRACKING_URI', training_pipeline.TRACKING_URI)
+    monkeypatch.setattr(utils, 'FILE_PATH', f'{tmp_path}/prediction_distribution.txt')
+    return utils
+
+
+@pytest.fixture
+def unit_test_cases():
+    """_summary_
+    Returns a function reading a table of 'unit_test_cases.db'.
+
+    SAMPLE USAGE
+        expected = unit_test_cases('loaded_data_test_case')
+    """
+    import sqlite3
+    import pandas as pd
+
+    def read_test_case(table_name):
+        cnx = sqlite3.connect(os.path.join(UNIT_TEST_DIRECTORY, 'unit_test_cases.db'))
+        try:
+            return pd.read_sql(f'select * from {table_name}', cnx)
+        finally:
+            cnx.close()
+    return read_test_case
+
+
+@pytest.fixture
+def assert_test_case(unit_test_cases):
+    """_summary_
+    Returns a function checking that a table written by the data pipeline
+    holds the same rows as its test case in 'unit_test_cases.db'. The
+    lead_id the stages add is left out and the rows are compared in sorted
+    order, as the partitioned and streamed stages may write them in another
+    order. Timestamps and categories, as the parquet store gives them back,
+    are compared as the text sqlite stores.
+
+    SAMPLE USAGE
+        assert_test_case(store.read('loaded_data'), 'loaded_data_test_case')
+    """
+    import pandas as pd
+
+    def canonical(df):
+        df = df.drop(columns='lead_id', errors='ignore')
+        for column in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[column].dtype):
+                df[column] = df[column].astype(str)
+            elif isinstance(df[column].dtype, pd.CategoricalDtype):
+                df[column] = df[column].astype(object)
+        return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+    def check(df, table_name):
+        expected = unit_test_cases(table_name)
+        assert list(df.drop(columns='lead_id', errors='ignore').columns) == list(expected.columns)
+        pd.testing.assert_frame_equal(canonical(df), canonical(expected), check_dtype=False)
+    return check
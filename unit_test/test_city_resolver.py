@@ -0,0 +1,70 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import numpy as np
+import pandas as pd
+
+from Lead_scoring_data_pipeline.city_resolver import resolve_city, resolve_city_tiers, CITY_RESOLUTION_TABLE
+from Lead_scoring_data_pipeline.mapping.city_tier_mapping import city_tier_mapping
+from Lead_scoring_data_pipeline.stage_store import get_stage_store
+
+import warnings
+warnings.filterwarnings("ignore")
+
+
+###############################################################################
+# Write test cases for resolve_city()
+# ##############################################################################
+
+def test_resolve_city():
+    """_summary_
+    This function checks the four ways a city is found: its normalized
+    name, an alias, its name without a suffix and the closest name in
+    trigrams, and that an unknown city is not found.
+    """
+    assert resolve_city('  MUMBAI ') == 'mumbai'
+    assert resolve_city('Bangalore') == 'bengaluru'
+    assert resolve_city('Jaipur HQ') == 'jaipur'
+    assert resolve_city('tiruchirappalli') == 'tiruchirapalli'
+    assert resolve_city('tiruchirappalli', None) is None
+    assert resolve_city('Atlantis') is None
+
+
+###############################################################################
+# Write test cases for resolve_city_tiers()
+# ##############################################################################
+
+def test_resolve_city_tiers_and_cache(tmp_path):
+    """_summary_
+    This function checks the tiers of resolved and unknown cities, and that
+    the resolved cities are kept in the 'city_resolution_cache' table once
+    per city and fuzzy threshold.
+    """
+    store = get_stage_store('sqlite', f'{tmp_path}/', 'city_resolver_test.db', f'{tmp_path}/stage_store/')
+    try:
+        cities = ['Mumbai', 'Jaipur HQ', 'Atlantis']
+        tiers = resolve_city_tiers(cities, store)
+        np.testing.assert_array_equal(tiers, [1.0, 2.0, 3.0])
+
+        resolve_city_tiers(cities + ['Bangalore'], store)
+        cache = store.read_table(CITY_RESOLUTION_TABLE)
+        assert sorted(cache['city']) == sorted(cities + ['Bangalore'])
+        assert pd.isna(cache.set_index('city').loc['Atlantis', 'resolved_city'])
+
+        resolve_city_tiers(cities, store, 0.9)
+        assert store.read_table(CITY_RESOLUTION_TABLE).shape[0] == 7
+    finally:
+        store.close()
+
+
+def test_city_tiers_of_test_leads(data_pipeline, unit_test_cases):
+    """_summary_
+    This function checks that apply_city_tier_mapping gives the test leads
+    the tiers of the 'city_tier_mapped_test_case' table.
+    """
+    loaded = unit_test_cases('loaded_data_test_case')
+    expected = unit_test_cases('city_tier_mapped_test_case')
+    mapped = data_pipeline.apply_city_tier_mapping(loaded.copy())
+    assert 'city_mapped' not in mapped.columns
+    np.testing.assert_array_equal(mapped['city_tier'].to_numpy(), expected['city_tier'].to_numpy())
@@ -0,0 +1,77 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import ast
+import importlib
+import os
+import sys
+
+import pytest
+
+from benchmarks.dag_import_time import DAG_MODULES, REPO_DIRECTORY, measure_dag_import
+from Lead_scoring_data_pipeline.lazy_callable import lazy_callable
+
+import warnings
+warnings.filterwarnings("ignore")
+
+
+###############################################################################
+# Write test cases for lazy_callable()
+# ##############################################################################
+
+def test_lazy_callable_imports_when_called(tmp_path, monkeypatch):
+    """_summary_
+    This function checks that the task callable is named after its function
+    and imports its module only when it is called.
+    """
+    (tmp_path / 'lazy_task_module.py').write_text('def task():\n    return "ran"\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'lazy_task_module', raising=False)
+
+    task = lazy_callable('lazy_task_module', 'task')
+    assert task.__name__ == 'task'
+    assert 'lazy_task_module' not in sys.modules
+    assert task() == 'ran'
+    assert 'lazy_task_module' in sys.modules
+    monkeypatch.delitem(sys.modules, 'lazy_task_module')
+
+
+###############################################################################
+# Write test cases for the DAG files
+# ##############################################################################
+
+def dag_tasks(dag_module):
+    # (module, function) of every lazy_callable of the DAG file, the module
+    # being a string constant of the file
+    path = os.path.join(REPO_DIRECTORY, *dag_module.split('.')) + '.py'
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    constants = {node.targets[0].id: node.value.value for node in tree.body
+                 if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant)
+                 and isinstance(node.targets[0], ast.Name)}
+    return [(constants[node.args[0].id], node.args[1].value) for node in ast.walk(tree)
+            if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'lazy_callable']
+
+
+@pytest.mark.parametrize('dag_module', DAG_MODULES)
+def test_dag_tasks_exist(dag_module):
+    """_summary_
+    This function checks that every task of the DAG file names a function of
+    its module.
+    """
+    tasks = dag_tasks(dag_module)
+    assert tasks
+    for module_name, function_name in tasks:
+        assert callable(getattr(importlib.import_module(module_name), function_name))
+
+
+@pytest.mark.parametrize('dag_module', DAG_MODULES)
+def test_dag_import_loads_no_heavy_module(dag_module):
+    """_summary_
+    This function checks that importing the DAG file, or without airflow the
+    project modules it imports, loads none of the heavy libraries.
+    """
+    result = measure_dag_import(dag_module)
+    assert result['heavy_modules'] == []
+    assert result['imported']
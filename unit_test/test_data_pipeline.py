@@ -0,0 +1,425 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import os
+
+import pandas as pd
+import pytest
+
+import warnings
+warnings.filterwarnings("ignore")
+
+
+def read_table(utils, table_name):
+    # the table as the next stage reads it back from the stage store
+    store = utils.open_stage_store()
+    try:
+        return store.read_table(table_name)
+    finally:
+        store.close()
+
+
+###############################################################################
+# Write test cases for the chunked load_data_into_db()
+# ##############################################################################
+
+@pytest.mark.parametrize('chunksize', [None, 30, 100000])
+def test_chunked_load_matches_test_case(data_pipeline, assert_test_case, monkeypatch, chunksize):
+    """_summary_
+    This function checks that 'loaded_data' holds the rows of the
+    'loaded_data_test_case' table whether the csv is read whole or streamed
+    in chunks smaller or larger than the file.
+    """
+    monkeypatch.setattr(data_pipeline, 'LOAD_CHUNKSIZE', chunksize)
+    data_pipeline.load_data_into_db()
+    assert_test_case(read_table(data_pipeline, 'loaded_data'), 'loaded_data_test_case')
+
+
+def test_chunks_of_the_file(data_pipeline):
+    """_summary_
+    This function checks that load_data_in_chunks gives back the rows of the
+    file in order, in chunks of at most chunksize rows.
+    """
+    file_path = data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE
+    chunks = list(data_pipeline.load_data_in_chunks(file_path, 30))
+    assert [chunk.shape[0] for chunk in chunks] == [30, 30, 30, 10]
+    whole = data_pipeline.load_data(file_path)
+    assert [row for chunk in chunks for row in chunk['created_date']] == whole['created_date'].tolist()
+
+
+###############################################################################
+# Write test cases for the watermark based incremental mode
+# ##############################################################################
+
+def run_stages(utils):
+    utils.load_data_into_db()
+    utils.map_city_tier()
+    utils.map_categorical_vars()
+    utils.interactions_mapping()
+
+
+def test_incremental_runs_match_test_cases(data_pipeline, assert_test_case, monkeypatch):
+    """_summary_
+    This function runs the data pipeline with INCREMENTAL_LOAD on the 60
+    oldest leads of 'leadscoring_test.csv' and then on the whole file. The
+    second run only processes the 40 newer leads, the tables end up as the
+    test cases and the high water mark of every table is the newest
+    created_date.
+    """
+    monkeypatch.setattr(data_pipeline, 'INCREMENTAL_LOAD', True)
+    data_file = data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE
+    leads = data_pipeline.load_data(data_file).sort_values('created_date')
+
+    leads.iloc[:60].to_csv(data_file, index=False)
+    run_stages(data_pipeline)
+    store = data_pipeline.open_stage_store()
+    try:
+        assert data_pipeline.get_watermark(store, 'loaded_data') == leads['created_date'].iloc[59]
+    finally:
+        store.close()
+
+    leads.to_csv(data_file, index=False)
+    run_stages(data_pipeline)
+    store = data_pipeline.open_stage_store()
+    try:
+        for table_name in ('loaded_data', 'city_tier_mapped', 'categorical_variables_mapped', 'interactions_mapped'):
+            assert data_pipeline.get_watermark(store, table_name) == leads['created_date'].max()
+    finally:
+        store.close()
+
+    assert_test_case(read_table(data_pipeline, 'loaded_data'), 'loaded_data_test_case')
+    assert_test_case(read_table(data_pipeline, 'city_tier_mapped'), 'city_tier_mapped_test_case')
+    assert_test_case(read_table(data_pipeline, 'categorical_variables_mapped'),
+                     'categorical_variables_mapped_test_case')
+    assert_test_case(read_table(data_pipeline, 'interactions_mapped'), 'interactions_mapped_test_case')
+
+
+def test_read_incremental_reads_newer_rows(data_pipeline, monkeypatch):
+    """_summary_
+    This function checks that read_incremental reads the whole input table
+    for an output table that does not exist yet, and only the rows created
+    after the high water mark of the output table once it exists.
+    """
+    monkeypatch.setattr(data_pipeline, 'INCREMENTAL_LOAD', True)
+    data_pipeline.load_data_into_db()
+    store = data_pipeline.open_stage_store()
+    try:
+        df, if_exists = data_pipeline.read_incremental(store, 'loaded_data', 'city_tier_mapped')
+        assert (df.shape[0], if_exists) == (100, 'replace')
+
+        watermark = sorted(df['created_date'].astype(str))[79]
+        store.write(df.iloc[:1], 'city_tier_mapped')
+        data_pipeline.set_watermark(store, 'city_tier_mapped', df[df['created_date'].astype(str) <= watermark])
+        df, if_exists = data_pipeline.read_incremental(store, 'loaded_data', 'city_tier_mapped')
+        assert (df.shape[0], if_exists) == (20, 'append')
+        assert (df['created_date'].astype(str) > watermark).all()
+    finally:
+        store.close()
+
+
+###############################################################################
+# Write test cases for the SQL_PUSHDOWN mode
+# ##############################################################################
+
+def test_pushdown_matches_test_cases(data_pipeline, assert_test_case, monkeypatch, capsys):
+    """_summary_
+    This function checks that map_city_tier and map_categorical_vars built
+    inside sqlite write the rows of their test cases, in full and in
+    incremental runs.
+    """
+    monkeypatch.setattr(data_pipeline, 'SQL_PUSHDOWN', True)
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    data_pipeline.map_categorical_vars()
+    assert "Mapping city_mapped to tiers inside the db" in capsys.readouterr().out
+    assert_test_case(read_table(data_pipeline, 'city_tier_mapped'), 'city_tier_mapped_test_case')
+    assert_test_case(read_table(data_pipeline, 'categorical_variables_mapped'),
+                     'categorical_variables_mapped_test_case')
+
+    monkeypatch.setattr(data_pipeline, 'INCREMENTAL_LOAD', True)
+    data_file = data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE
+    leads = data_pipeline.load_data(data_file).sort_values('created_date')
+    leads.iloc[:60].to_csv(data_file, index=False)
+    run_stages(data_pipeline)
+    leads.to_csv(data_file, index=False)
+    capsys.readouterr()
+    run_stages(data_pipeline)
+    assert "Mapping rows created after" in capsys.readouterr().out
+    assert_test_case(read_table(data_pipeline, 'city_tier_mapped'), 'city_tier_mapped_test_case')
+    assert_test_case(read_table(data_pipeline, 'categorical_variables_mapped'),
+                     'categorical_variables_mapped_test_case')
+    assert_test_case(read_table(data_pipeline, 'interactions_mapped'), 'interactions_mapped_test_case')
+
+
+def test_pushdown_falls_back_with_parquet(data_pipeline, assert_test_case, monkeypatch, capsys):
+    """_summary_
+    This function checks that SQL_PUSHDOWN maps in pandas with the parquet
+    stage store.
+    """
+    monkeypatch.setattr(data_pipeline, 'SQL_PUSHDOWN', True)
+    monkeypatch.setattr(data_pipeline, 'STAGE_STORE_BACKEND', 'parquet')
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    assert "mapping in pandas with the parquet store" in capsys.readouterr().out
+    assert_test_case(read_table(data_pipeline, 'city_tier_mapped'), 'city_tier_mapped_test_case')
+
+
+###############################################################################
+# Write test cases for map_fused_transforms()
+# ##############################################################################
+
+def written_times(utils):
+    store = utils.open_stage_store()
+    try:
+        return [store.written_at(table_name) for table_name in
+                ('city_tier_mapped', 'categorical_variables_mapped', 'interactions_mapped', 'model_input')]
+    finally:
+        store.close()
+
+
+def assert_same_rows(df, expected):
+    # the same rows, without the lead_id order the stages write them in
+    pd.testing.assert_frame_equal(df.sort_values('lead_id').reset_index(drop=True),
+                                  expected.sort_values('lead_id').reset_index(drop=True), check_dtype=False)
+
+
+def test_fused_transforms_match_test_cases(data_pipeline, assert_test_case, monkeypatch):
+    """_summary_
+    This function checks that map_fused_transforms writes the same
+    'interactions_mapped' and 'model_input' tables as the three mapping
+    stages, and with FUSED_DEBUG_TABLES the intermediate tables of the test
+    cases.
+    """
+    run_stages(data_pipeline)
+    model_input = read_table(data_pipeline, 'model_input')
+    written_at = written_times(data_pipeline)
+
+    monkeypatch.setattr(data_pipeline, 'FUSED_DEBUG_TABLES', True)
+    data_pipeline.map_fused_transforms()
+    # every table was written again by the fused stage
+    assert all(a != b for a, b in zip(written_at, written_times(data_pipeline)))
+    assert_test_case(read_table(data_pipeline, 'city_tier_mapped'), 'city_tier_mapped_test_case')
+    assert_test_case(read_table(data_pipeline, 'categorical_variables_mapped'),
+                     'categorical_variables_mapped_test_case')
+    assert_test_case(read_table(data_pipeline, 'interactions_mapped'), 'interactions_mapped_test_case')
+    assert_same_rows(read_table(data_pipeline, 'model_input'), model_input)
+
+
+###############################################################################
+# Write test cases for the categorical bucketing of map_categorical_vars()
+# ##############################################################################
+
+def test_bucket_categorical_column(data_pipeline):
+    """_summary_
+    This function checks that the significant levels are kept, in place,
+    and the other levels and the nulls become 'others'.
+    """
+    series = pd.Series(['b', None, 'a', 'z', 'a', 'y'])
+    bucketed = data_pipeline.bucket_categorical_column(series, ['a', 'b'])
+    assert list(bucketed) == ['b', 'others', 'a', 'others', 'a', 'others']
+    assert list(bucketed.categories) == ['a', 'b', 'others']
+
+
+def test_categorical_mapping_keeps_row_order(data_pipeline, assert_test_case):
+    """_summary_
+    This function checks that 'categorical_variables_mapped' holds the rows of
+    its test case, in the order of the rows of 'city_tier_mapped'.
+    """
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    data_pipeline.map_categorical_vars()
+    categorical_variables_mapped = read_table(data_pipeline, 'categorical_variables_mapped')
+    assert_test_case(categorical_variables_mapped, 'categorical_variables_mapped_test_case')
+
+    # the duplicates dropped, the rows keep their order
+    lead_ids = read_table(data_pipeline, 'city_tier_mapped')['lead_id']
+    kept = lead_ids[lead_ids.isin(categorical_variables_mapped['lead_id'])]
+    assert categorical_variables_mapped['lead_id'].tolist() == kept.tolist()
+
+
+###############################################################################
+# Write test cases for the sparse interactions_mapping()
+# ##############################################################################
+
+def test_interaction_groups_are_column_sums(data_pipeline, unit_test_cases):
+    """_summary_
+    This function checks that apply_interactions_mapping gives every lead
+    the sums of its interaction columns over each interaction group of the
+    mapping file, nulls counting as 0, computed here with a pandas groupby.
+    """
+    df = unit_test_cases('categorical_variables_mapped_test_case')
+    interaction_matrix = data_pipeline.load_interaction_matrix(data_pipeline.INTERACTION_MAPPING)
+    df_mapped, dataset_trimmed = data_pipeline.apply_interactions_mapping(df, interaction_matrix)
+
+    mapping = pd.read_csv(data_pipeline.INTERACTION_MAPPING, index_col=[0])['interaction_mapping'].dropna()
+    mapping = mapping[mapping.index.isin(df.columns)]
+    expected = df[mapping.index].fillna(0).T.groupby(mapping).sum().T.rename_axis(columns=None)
+    pd.testing.assert_frame_equal(df_mapped[expected.columns], expected, check_dtype=False)
+    assert list(dataset_trimmed.columns) == data_pipeline.INDEX_COLUMNS[1:]
+    assert dataset_trimmed.shape[0] == df.shape[0]
+
+
+def test_interactions_mapping_matches_test_case(data_pipeline, assert_test_case):
+    """_summary_
+    This function checks that 'interactions_mapped' holds the rows of its test
+    case after the whole data pipeline ran on 'leadscoring_test.csv'.
+    """
+    run_stages(data_pipeline)
+    assert_test_case(read_table(data_pipeline, 'interactions_mapped'), 'interactions_mapped_test_case')
+
+
+###############################################################################
+# Write test cases for the compact dtype plan
+# ##############################################################################
+
+def test_dtype_plan_of_contracts(data_pipeline):
+    """_summary_
+    This function checks the dtypes derived from the data contracts: flags
+    uint8, counts int16, the nullable ones UInt8 / Int16, strings category
+    and the storage dtype when the contract has one.
+    """
+    plan = data_pipeline.DTYPE_PLAN
+    assert plan['created_date'] == 'datetime64[ns]'
+    assert plan['city_mapped'] == 'category'
+    assert plan['first_platform_c'] == 'category'
+    assert plan['referred_lead'] == 'UInt8'
+    assert plan['total_leads_droppped'] == 'Int16'
+    assert plan['city_tier'] == 'float32'
+    assert plan['lead_id'] == 'int64'
+    assert plan['app_complete_flag'] == 'uint8'
+
+
+def test_compact_frame_keeps_values(data_pipeline, unit_test_cases):
+    """_summary_
+    This function checks that the loaded test case converted to the dtype
+    plan takes less memory and holds the same values, also when it is read
+    back from sqlite with the counts as object columns of ints and None.
+    """
+    loaded = unit_test_cases('loaded_data_test_case')
+    compact = data_pipeline.compact_frame(loaded.copy())
+    assert compact['total_leads_droppped'].dtype == 'Int16'
+    assert compact['first_platform_c'].dtype == 'category'
+    assert compact.memory_usage(deep=True).sum() < loaded.memory_usage(deep=True).sum() / 2
+    pd.testing.assert_frame_equal(compact.astype(object).where(compact.notna(), None)
+                                  .assign(created_date=compact['created_date'].astype(str)),
+                                  loaded.astype(object).where(loaded.notna(), None), check_dtype=False)
+
+    from_sqlite = pd.DataFrame({'total_leads_droppped': pd.Series([1, None, 3], dtype=object),
+                                'referred_lead': pd.Series([0, 1, None], dtype=object)})
+    compact = data_pipeline.apply_dtype_plan(from_sqlite)
+    assert compact['total_leads_droppped'].tolist() == [1, pd.NA, 3]
+    assert compact['referred_lead'].dtype == 'UInt8'
+
+
+def test_fractional_counts_are_not_truncated(data_pipeline):
+    """_summary_
+    This function checks that a count with a fraction raises instead of being
+    truncated to the integer dtype of the plan.
+    """
+    with pytest.raises(TypeError):
+        data_pipeline.apply_dtype_plan(pd.DataFrame({'total_leads_droppped': [1.5, None]}))
+
+
+###############################################################################
+# Write test cases for the partitioned execution
+# ##############################################################################
+
+@pytest.mark.parametrize('partition_by', ['month', 'hash'])
+def test_partitioned_stages_match_test_cases(data_pipeline, assert_test_case, monkeypatch, capsys, partition_by):
+    """_summary_
+    This function runs the mapping stages on the created_date partitions of
+    the test leads in 2 processes and checks that every table holds the rows
+    of its test case, in the order the single process writes them.
+    """
+    run_stages(data_pipeline)
+    single_process = {table_name: read_table(data_pipeline, table_name)
+                      for table_name in ('city_tier_mapped', 'categorical_variables_mapped', 'interactions_mapped')}
+
+    monkeypatch.setattr(data_pipeline, 'PARTITIONED_EXECUTION', True)
+    monkeypatch.setattr(data_pipeline, 'PARTITION_MIN_ROWS', 0)
+    monkeypatch.setattr(data_pipeline, 'PARTITION_WORKERS', 2)
+    monkeypatch.setattr(data_pipeline, 'PARTITION_BY', partition_by)
+    monkeypatch.setattr(data_pipeline, 'PARTITION_BUCKETS', 4)
+    written_at = written_times(data_pipeline)
+    capsys.readouterr()
+    run_stages(data_pipeline)
+    assert all(a != b for a, b in zip(written_at, written_times(data_pipeline)))
+    assert 'Running apply_categorical_mapping on' in capsys.readouterr().out
+
+    for table_name, expected in single_process.items():
+        partitioned = read_table(data_pipeline, table_name)
+        assert_test_case(partitioned, f'{table_name}_test_case')
+        pd.testing.assert_frame_equal(partitioned, expected)
+
+
+def test_run_partitioned_keeps_row_order(data_pipeline, unit_test_cases, monkeypatch):
+    """_summary_
+    This function checks that run_partitioned gives back the rows of every
+    partition in the row order of its input.
+    """
+    monkeypatch.setattr(data_pipeline, 'PARTITION_WORKERS', 2)
+    loaded = unit_test_cases('loaded_data_test_case')
+    assert len(data_pipeline.partition_positions(loaded)) > 1
+    mapped = data_pipeline.run_partitioned(loaded, data_pipeline.apply_categorical_mapping)
+    pd.testing.assert_frame_equal(mapped, data_pipeline.apply_categorical_mapping(loaded.copy()))
+
+
+###############################################################################
+# Write test cases for the out of core interactions_mapping()
+# ##############################################################################
+
+def out_of_core(utils, monkeypatch, spill_directory):
+    monkeypatch.setattr(utils, 'INTERACTIONS_OUT_OF_CORE', True)
+    monkeypatch.setattr(utils, 'INTERACTIONS_CHUNKSIZE', 30)
+    monkeypatch.setattr(utils, 'SPILL_PARTITIONS', 3)
+    monkeypatch.setattr(utils, 'SPILL_DIRECTORY', str(spill_directory))
+    spill_directory.mkdir()
+
+
+def test_out_of_core_interactions_match_test_case(data_pipeline, assert_test_case, monkeypatch, tmp_path):
+    """_summary_
+    This function maps the interactions in chunks of 30 rows spilled to disk
+    and checks that 'interactions_mapped' holds the rows of its test case,
+    'model_input' those written in memory, and that the spill files are
+    removed.
+    """
+    run_stages(data_pipeline)
+    model_input = read_table(data_pipeline, 'model_input')
+
+    out_of_core(data_pipeline, monkeypatch, tmp_path / 'spill')
+    written_at = written_times(data_pipeline)
+    data_pipeline.interactions_mapping()
+    assert written_times(data_pipeline)[2:] != written_at[2:]
+
+    assert_test_case(read_table(data_pipeline, 'interactions_mapped'), 'interactions_mapped_test_case')
+    assert_same_rows(read_table(data_pipeline, 'model_input'), model_input)
+    assert os.listdir(tmp_path / 'spill') == []
+
+
+def test_out_of_core_groups_by_index(data_pipeline, monkeypatch, tmp_path):
+    """_summary_
+    This function checks that with INTERACTIONS_GROUP_BY_INDEX the rows
+    sharing the same index columns are collapsed into one row holding the
+    sums of their interaction groups, over chunks and spill partitions. The
+    created_date of the test leads is cut to their month so that rows
+    share their index columns.
+    """
+    data_file = data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE
+    leads = data_pipeline.load_data(data_file)
+    leads['created_date'] = leads['created_date'].str[:7] + '-01 00:00:00'
+    leads.to_csv(data_file, index=False)
+    run_stages(data_pipeline)
+    index_columns = data_pipeline.INDEX_COLUMNS
+    expected = read_table(data_pipeline, 'interactions_mapped').drop(columns='lead_id')
+    expected = expected.groupby(index_columns, dropna=False, observed=True).sum().reset_index()
+
+    out_of_core(data_pipeline, monkeypatch, tmp_path / 'spill')
+    monkeypatch.setattr(data_pipeline, 'INTERACTIONS_GROUP_BY_INDEX', True)
+    data_pipeline.interactions_mapping()
+
+    grouped = read_table(data_pipeline, 'interactions_mapped').drop(columns='lead_id')
+    assert grouped.shape[0] == expected.shape[0] < leads.shape[0]
+    pd.testing.assert_frame_equal(grouped.sort_values(index_columns).reset_index(drop=True),
+                                  expected[grouped.columns].sort_values(index_columns).reset_index(drop=True),
+                                  check_dtype=False, check_categorical=False)
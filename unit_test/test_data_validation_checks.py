@@ -0,0 +1,168 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import pandas as pd
+import pytest
+
+import warnings
+warnings.filterwarnings("ignore")
+
+
+@pytest.fixture
+def validation_checks(data_pipeline, monkeypatch):
+    """_summary_
+    Returns the data_validation_checks module of the data pipeline, on the
+    stage store of the data_pipeline fixture and on 'leadscoring.csv', the
+    test leads written with an index column as the raw file is.
+    """
+    import Lead_scoring_data_pipeline.data_validation_checks as validation_checks
+
+    leads = data_pipeline.load_data(data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE)
+    leads.to_csv(data_pipeline.DATA_DIRECTORY + 'leadscoring.csv')
+    for name in ('DB_PATH', 'DATA_DIRECTORY', 'STAGE_STORE_DIRECTORY'):
+        monkeypatch.setattr(validation_checks, name, getattr(data_pipeline, name))
+    monkeypatch.setattr(validation_checks, 'DATA_FILE', 'leadscoring.csv')
+    return validation_checks
+
+
+def write_raw_file(validation_checks, leads):
+    leads.to_csv(validation_checks.DATA_DIRECTORY + validation_checks.DATA_FILE)
+
+
+def read_raw_file(validation_checks):
+    return pd.read_csv(validation_checks.DATA_DIRECTORY + validation_checks.DATA_FILE, index_col=[0])
+
+
+###############################################################################
+# Write test cases for the schema checks
+# ##############################################################################
+
+def test_raw_data_schema_check(validation_checks, capsys):
+    """_summary_
+    This function checks that the header of the raw file is found in line
+    with raw_data_schema, and no longer once a column is dropped.
+    """
+    validation_checks.raw_data_schema_check()
+    assert 'Raw datas schema is in line' in capsys.readouterr().out
+
+    write_raw_file(validation_checks, read_raw_file(validation_checks).drop(columns='city_mapped'))
+    validation_checks.raw_data_schema_check()
+    assert 'Raw datas schema is NOT in line' in capsys.readouterr().out
+
+
+def test_model_input_schema_check(data_pipeline, validation_checks, capsys):
+    """_summary_
+    This function checks that the 'model_input' table written by the data
+    pipeline is found in line with model_input_schema, from its columns
+    alone.
+    """
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    data_pipeline.map_categorical_vars()
+    data_pipeline.interactions_mapping()
+    capsys.readouterr()
+
+    validation_checks.model_input_schema_check()
+    assert 'Models input schema is in line' in capsys.readouterr().out
+
+    store = data_pipeline.open_stage_store()
+    try:
+        store.write(store.read('model_input').drop(columns='referred_lead'), 'model_input')
+    finally:
+        store.close()
+    validation_checks.model_input_schema_check()
+    output = capsys.readouterr().out
+    assert 'column_mismatch:  referred_lead' in output
+    assert 'Models input schema is NOT in line' in output
+
+
+###############################################################################
+# Write test cases for the data contract validator
+# ##############################################################################
+
+CONTRACT = {
+    'created_date': {'dtype': 'datetime', 'format': '%Y-%m-%d %H:%M:%S', 'nullable': False},
+    'city_tier': {'dtype': 'numeric', 'nullable': False, 'levels': [1.0, 2.0, 3.0]},
+    'total_leads_droppped': {'dtype': 'numeric', 'min': 0, 'max': 10, 'max_null_fraction': 0.25},
+    'lead_id': {'dtype': 'numeric', 'unique': True},
+    'app_complete_flag': {'dtype': 'numeric', 'required': False},
+    'referred_lead': {'dtype': 'numeric'},
+}
+
+
+def test_validate_frame_counts_violations(validation_checks):
+    """_summary_
+    This function checks the violations counted for every rule of a small
+    contract, over two chunks of a frame, and the report built from them.
+    """
+    df = pd.DataFrame({'created_date': ['2021-11-01 10:00:00', 'yesterday', None, '2021-11-02 10:00:00'],
+                       'city_tier': [1.0, 4.0, 2.0, None],
+                       'total_leads_droppped': ['1', 'many', -1, None],
+                       'lead_id': [1, 2, 2, 3]})
+    counts = validation_checks.validate_frame(df.iloc[:2], CONTRACT)
+    counts = validation_checks.validate_frame(df.iloc[2:], CONTRACT, counts)
+
+    assert counts['rows'] == 4
+    assert counts['violations'][('created_date', 'dtype')] == 1
+    assert counts['violations'][('created_date', 'nullable')] == 1
+    assert counts['violations'][('city_tier', 'levels')] == 1
+    assert counts['violations'][('city_tier', 'nullable')] == 1
+    assert counts['violations'][('total_leads_droppped', 'dtype')] == 1
+    assert counts['violations'][('total_leads_droppped', 'min')] == 1
+    assert counts['violations'][('total_leads_droppped', 'max')] == 0
+    # the duplicate is in the second chunk only
+    assert counts['violations'][('lead_id', 'unique')] == 0
+
+    report = validation_checks.contract_report('leads', df.columns, counts, CONTRACT).set_index(['column_name', 'rule'])
+    assert report.loc[('total_leads_droppped', 'max_null_fraction'), 'passed'] == 1
+    assert report.loc[('referred_lead', 'missing_column'), 'violations'] == 1
+    # not required
+    assert report.loc[('app_complete_flag', 'missing_column'), 'violations'] == 0
+
+
+def test_raw_data_contract_check(validation_checks):
+    """_summary_
+    This function checks that the test leads pass raw_data_contract, and that
+    a referred_lead out of its levels fails the check and is recorded in
+    the 'validation_report' table.
+    """
+    validation_checks.raw_data_contract_check()
+
+    leads = read_raw_file(validation_checks)
+    leads.loc[leads.index[:2], 'referred_lead'] = 5
+    write_raw_file(validation_checks, leads)
+    with pytest.raises(ValueError, match='raw_data is NOT in line with its data contract'):
+        validation_checks.raw_data_contract_check()
+
+    store = validation_checks.open_stage_store()
+    try:
+        report = store.read('validation_report')
+    finally:
+        store.close()
+    failed = report[report['passed'] == 0]
+    assert failed[['column_name', 'rule', 'violations']].values.tolist() == [['referred_lead', 'levels', 2]]
+
+
+def test_model_input_contract_check(data_pipeline, validation_checks):
+    """_summary_
+    This function checks that the 'model_input' table written by the data
+    pipeline passes model_input_contract, and fails it with a city_tier out
+    of its levels.
+    """
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    data_pipeline.map_categorical_vars()
+    data_pipeline.interactions_mapping()
+    validation_checks.model_input_contract_check()
+
+    store = data_pipeline.open_stage_store()
+    try:
+        model_input = store.read('model_input')
+        model_input['city_tier'] = model_input['city_tier'].astype('float64')
+        model_input.loc[model_input.index[0], 'city_tier'] = 4.0
+        store.write(model_input, 'model_input')
+    finally:
+        store.close()
+    with pytest.raises(ValueError, match='model_input is NOT in line with its data contract'):
+        validation_checks.model_input_contract_check()
@@ -0,0 +1,150 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import os
+
+import lightgbm as lgb
+import mlflow
+import numpy as np
+import pandas as pd
+import pytest
+
+from Lead_scoring_data_pipeline.stage_store import get_stage_store
+from Lead_scoring_training_pipeline.dataset_cache import dataset_cache_key, load_cached_datasets, \
+    save_cached_datasets
+
+import warnings
+warnings.filterwarnings("ignore")
+
+PARAMS = {'objective': 'binary', 'verbose': -1, 'max_bin': 63, 'learning_rate': 0.1}
+SPLIT = {'test_size': 0.2, 'random_state': 100}
+
+
+@pytest.fixture
+def store(tmp_path):
+    """_summary_
+    Returns a sqlite stage store holding a 'features' and a 'target' table.
+    """
+    store = get_stage_store('sqlite', f'{tmp_path}/', 'dataset_cache_test.db', f'{tmp_path}/stage_store/')
+    rng = np.random.default_rng(0)
+    store.write(pd.DataFrame(rng.normal(size=(200, 3)), columns=['a', 'b', 'c']), 'features')
+    store.write(pd.DataFrame({'app_complete_flag': rng.integers(0, 2, size=200)}), 'target')
+    yield store
+    store.close()
+
+
+def training_set(store, params=PARAMS):
+    X, y = store.read('features'), store.read('target')
+    return lgb.Dataset(X, label=np.ravel(y), params=params), (X.iloc[:10], y.iloc[:10], None, None)
+
+
+###############################################################################
+# Write test cases for dataset_cache_key()
+# ##############################################################################
+
+def test_dataset_cache_key(store):
+    """_summary_
+    This function checks that the key changes with the features, the
+    binning parameters, the split and the lgb.Dataset arguments, but not
+    with the parameters that only change the boosting.
+    """
+    key = dataset_cache_key(store, PARAMS, SPLIT, {})
+    assert key == dataset_cache_key(store, dict(PARAMS), dict(SPLIT), {})
+    assert key == dataset_cache_key(store, dict(PARAMS, learning_rate=0.3, num_leaves=7), SPLIT, {})
+    assert key != dataset_cache_key(store, dict(PARAMS, max_bin=255), SPLIT, {})
+    assert key != dataset_cache_key(store, dict(PARAMS, min_child_samples=5), SPLIT, {})
+    assert key != dataset_cache_key(store, PARAMS, dict(SPLIT, validation_size=0.2), {})
+    assert key != dataset_cache_key(store, PARAMS, SPLIT, {'categorical_feature': ['a']})
+
+    features = store.read('features')
+    store.write(features.assign(a=features['a'] + 1), 'features')
+    assert key != dataset_cache_key(store, PARAMS, SPLIT, {})
+    store.write(features, 'features')
+    assert key == dataset_cache_key(store, PARAMS, SPLIT, {})
+
+
+def test_no_key_without_versions(tmp_path):
+    """_summary_
+    This function checks that the training set is not cached when the
+    version of 'target' is unknown.
+    """
+    store = get_stage_store('sqlite', f'{tmp_path}/', 'dataset_cache_test.db', f'{tmp_path}/stage_store/')
+    try:
+        store.write(pd.DataFrame({'a': [1.0, 2.0]}), 'features')
+        assert dataset_cache_key(store, PARAMS, SPLIT, {}) is None
+    finally:
+        store.close()
+
+
+###############################################################################
+# Write test cases for save_cached_datasets() and load_cached_datasets()
+# ##############################################################################
+
+def test_cached_datasets_round_trip(store, tmp_path):
+    """_summary_
+    This function checks that the training set is loaded back binned, with
+    its rows, labels and bins, together with the held out rows, and that an
+    unknown or unreadable entry is a miss.
+    """
+    directory = f'{tmp_path}/dataset_cache/'
+    key = dataset_cache_key(store, PARAMS, SPLIT, {})
+    assert load_cached_datasets(directory, key, PARAMS, {}) is None
+
+    train_set, held_out = training_set(store)
+    save_cached_datasets(directory, key, train_set, held_out, 5)
+    assert sorted(os.listdir(directory)) == [f'{key}.bin', f'{key}.held_out.pkl']
+
+    cached_set, cached_held_out = load_cached_datasets(directory, key, PARAMS, {})
+    assert cached_set.num_data() == 200 and cached_set.num_feature() == 3
+    np.testing.assert_array_equal(cached_set.get_label(), train_set.get_label())
+    pd.testing.assert_frame_equal(cached_held_out[0], held_out[0])
+    pd.testing.assert_frame_equal(cached_held_out[1], held_out[1])
+    assert cached_held_out[2:] == (None, None)
+    booster = lgb.train(PARAMS, cached_set, num_boost_round=5)
+    expected = lgb.train(PARAMS, training_set(store)[0], num_boost_round=5)
+    np.testing.assert_allclose(booster.predict(store.read('features')), expected.predict(store.read('features')))
+
+    with open(os.path.join(directory, f'{key}.bin'), 'wb') as f:
+        f.write(b'not a lightgbm binary')
+    assert load_cached_datasets(directory, key, PARAMS, {}) is None
+
+
+def test_least_recently_used_entries_are_evicted(store, tmp_path):
+    """_summary_
+    This function checks that saving an entry beyond max_entries evicts the
+    entries used least recently, a load counting as a use.
+    """
+    directory = f'{tmp_path}/dataset_cache/'
+    train_set, held_out = training_set(store)
+    for age, key in enumerate(['first', 'second', 'third']):
+        save_cached_datasets(directory, key, training_set(store)[0], held_out, 3)
+        # the entries are a minute apart, older first
+        for path in (f'{directory}{key}.bin', f'{directory}{key}.held_out.pkl'):
+            os.utime(path, (1000000 + age * 60, 1000000 + age * 60))
+
+    assert load_cached_datasets(directory, 'first', PARAMS, {}) is not None
+    save_cached_datasets(directory, 'fourth', train_set, held_out, 3)
+    assert sorted(os.listdir(directory)) == ['first.bin', 'first.held_out.pkl', 'fourth.bin',
+                                             'fourth.held_out.pkl', 'third.bin', 'third.held_out.pkl']
+
+
+###############################################################################
+# Write test cases for the dataset cache of get_trained_model()
+# ##############################################################################
+
+def test_retraining_loads_the_cached_training_set(training_pipeline, capsys):
+    """_summary_
+    This function trains twice on the same features, the second run loads
+    the binned training set from the cache and trains the same model.
+    """
+    training_pipeline.encode_features()
+    training_pipeline.get_trained_model()
+    assert "Saving the binned training set to the dataset cache" in capsys.readouterr().out
+    training_pipeline.get_trained_model()
+    assert "loading the binned training set from the dataset cache" in capsys.readouterr().out
+
+    runs = mlflow.search_runs(search_all_experiments=True).sort_values('start_time')
+    assert runs['params.dataset_cache_hit'].tolist() == ['False', 'True']
+    for column in ('metrics.AUC', 'metrics.test_accuracy', 'metrics.num_trees'):
+        assert runs[column].iloc[0] == runs[column].iloc[1]
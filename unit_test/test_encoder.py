@@ -0,0 +1,250 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import json
+
+import mlflow
+import numpy as np
+import pandas as pd
+import pytest
+
+from Lead_scoring_training_pipeline.constants import FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES
+from Lead_scoring_training_pipeline.encoder import compile_encoder, one_hot_encode, one_hot_encode_sparse, \
+    category_codes, category_encode
+
+import warnings
+warnings.filterwarnings("ignore")
+
+
+def get_dummies_encode(df):
+    # the encoding of encode_features before the compiled encoder
+    df = df.copy()
+    df['city_tier'] = df.city_tier.astype('category')
+    encoded_df = pd.DataFrame(columns=ONE_HOT_ENCODED_FEATURES)
+    placeholder_df = pd.DataFrame()
+    for f in FEATURES_TO_ENCODE:
+        if f in df.columns:
+            encoded = pd.get_dummies(df[f])
+            encoded = encoded.add_prefix(f + '_')
+            placeholder_df = pd.concat([placeholder_df, encoded], axis=1)
+    for feature in encoded_df.columns:
+        if feature in df.columns:
+            encoded_df[feature] = df[feature]
+        if feature in placeholder_df.columns:
+            encoded_df[feature] = placeholder_df[feature]
+    encoded_df.fillna(0, inplace=True)
+    return encoded_df
+
+
+###############################################################################
+# Write test cases for compile_encoder()
+# ##############################################################################
+
+def test_compile_encoder():
+    """_summary_
+    This function checks the level positions and copied columns of the
+    compiled encoder, and that it is compiled once per set of features.
+    """
+    encoder = compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES))
+    assert encoder['columns'] == ONE_HOT_ENCODED_FEATURES
+    names, positions = encoder['levels']['city_tier']
+    assert names == ['1.0', '2.0', '3.0'] and positions.tolist() == [0, 1, 2]
+    names, positions = encoder['levels']['first_utm_source_c']
+    assert [ONE_HOT_ENCODED_FEATURES[position] for position in positions] == \
+        ['first_utm_source_c_' + name for name in names]
+    assert encoder['copied'] == {'total_leads_droppped': 38, 'referred_lead': 39}
+    assert compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES)) is encoder
+
+
+###############################################################################
+# Write test cases for one_hot_encode()
+# ##############################################################################
+
+def test_one_hot_encode_matches_get_dummies(unit_test_cases):
+    """_summary_
+    This function checks that one_hot_encode gives the values of the
+    get_dummies encoding on the mapped test leads, as uint8 columns, with
+    unknown levels and missing values left at 0.
+    """
+    df = unit_test_cases('categorical_variables_mapped_test_case')
+    df.loc[df.index[:3], 'first_platform_c'] = ['Level99', None, 'Level0']
+    df.loc[df.index[3], 'city_tier'] = np.nan
+
+    encoded = one_hot_encode(df, compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES)))
+    assert list(encoded.columns) == ONE_HOT_ENCODED_FEATURES
+    assert (encoded.dtypes == np.uint8).all()
+    pd.testing.assert_frame_equal(encoded.astype('int64'), get_dummies_encode(df).astype('int64'))
+    platform_columns = [column for column in ONE_HOT_ENCODED_FEATURES if column.startswith('first_platform_c_')]
+    assert encoded.loc[df.index[:2], platform_columns].sum().sum() == 0
+    assert encoded.loc[df.index[3], ['city_tier_1.0', 'city_tier_2.0', 'city_tier_3.0']].sum() == 0
+
+
+def test_copied_values_outside_uint8_are_refused():
+    """_summary_
+    This function checks that a copied column with a value above 255,
+    below 0 or with a fraction raises a ValueError in every encoding,
+    instead of being changed by the cast to uint8.
+    """
+    encoder = compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES))
+    codes = category_codes(FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES)
+    df = pd.DataFrame({'city_tier': [1.0, 2.0], 'total_leads_droppped': [255.0, None], 'referred_lead': [0, 1]})
+    assert one_hot_encode(df, encoder)['total_leads_droppped'].tolist() == [255, 0]
+
+    for value in [300.0, -1.0, 2.5]:
+        invalid = df.assign(total_leads_droppped=[1.0, value])
+        with pytest.raises(ValueError, match='total_leads_droppped'):
+            one_hot_encode(invalid, encoder)
+        with pytest.raises(ValueError, match='total_leads_droppped'):
+            one_hot_encode_sparse(invalid, encoder)
+        with pytest.raises(ValueError, match='total_leads_droppped'):
+            category_encode(invalid, codes, ['total_leads_droppped', 'referred_lead'])
+
+
+def test_training_and_inference_encode_alike(training_pipeline, inference_pipeline):
+    """_summary_
+    This function checks that the encode_features stages of the training
+    and of the inference pipeline write the same 'features' table.
+    """
+    training_pipeline.encode_features()
+    store = training_pipeline.open_stage_store()
+    try:
+        training_features = store.read('features')
+        store.cnx.execute('DROP TABLE features')
+    finally:
+        store.close()
+
+    inference_pipeline.encode_features()
+    store = inference_pipeline.open_stage_store()
+    try:
+        inference_features = store.read('features')
+    finally:
+        store.close()
+    assert list(training_features.columns) == ['lead_id'] + ONE_HOT_ENCODED_FEATURES
+    pd.testing.assert_frame_equal(training_features, inference_features)
+
+
+###############################################################################
+# Write test cases for the sparse feature matrix
+# ##############################################################################
+
+def test_sparse_encoding_matches_dense(unit_test_cases):
+    """_summary_
+    This function checks that one_hot_encode_sparse gives the values of
+    one_hot_encode, storing only the non-zero entries.
+    """
+    df = unit_test_cases('categorical_variables_mapped_test_case')
+    df.loc[df.index[:2], 'first_platform_c'] = ['Level99', None]
+    encoder = compile_encoder(tuple(FEATURES_TO_ENCODE), tuple(ONE_HOT_ENCODED_FEATURES))
+
+    dense = one_hot_encode(df, encoder)
+    matrix = one_hot_encode_sparse(df, encoder)
+    assert matrix.format == 'csr' and matrix.dtype == np.uint8
+    assert matrix.shape == dense.shape
+    assert matrix.nnz == np.count_nonzero(dense.to_numpy())
+    np.testing.assert_array_equal(matrix.toarray(), dense.to_numpy())
+    assert one_hot_encode_sparse(df.iloc[:0], encoder).shape == (0, len(ONE_HOT_ENCODED_FEATURES))
+
+
+def test_sparse_training_data(training_pipeline, monkeypatch):
+    """_summary_
+    This function checks that with SPARSE_FEATURES encode_features writes
+    'features.npz' with the rows of the dense 'features' table, and that the
+    training data read back from it is the float CSR matrix lightgbm takes
+    with the target of the same leads.
+    """
+    training_pipeline.encode_features()
+    store = training_pipeline.open_stage_store()
+    try:
+        dense, dense_target = training_pipeline.load_training_data(store, False)
+    finally:
+        store.close()
+
+    monkeypatch.setattr(training_pipeline, 'SPARSE_FEATURES', True)
+    training_pipeline.encode_features()
+    store = training_pipeline.open_stage_store()
+    try:
+        assert store.sparse_exists('features')
+        X, y = training_pipeline.load_training_data(store, True)
+        keys, columns = store.read_sparse('features')[1:]
+    finally:
+        store.close()
+    assert X.format == 'csr' and X.dtype == np.float32
+    assert columns == ONE_HOT_ENCODED_FEATURES
+    assert keys.tolist() == dense.index.tolist()
+    np.testing.assert_array_equal(X.toarray(), dense.to_numpy(dtype=np.float32))
+    pd.testing.assert_frame_equal(y, dense_target)
+
+
+###############################################################################
+# Write test cases for the native categorical mode
+# ##############################################################################
+
+def test_category_encode():
+    """_summary_
+    This function checks that the code dictionary has the levels of the one
+    hot encoding, and that category_encode gives their codes, -1 for
+    unknown levels, missing values and missing features, whatever the dtype
+    of a numeric feature.
+    """
+    codes = category_codes(FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES)
+    assert list(codes) == FEATURES_TO_ENCODE
+    assert codes['city_tier'] == ['1.0', '2.0', '3.0']
+    assert sum(len(names) for names in codes.values()) == len(ONE_HOT_ENCODED_FEATURES) - 2
+    assert json.loads(json.dumps(codes)) == codes
+
+    df = pd.DataFrame({'city_tier': [3.0, 1.0, None, 4.0],
+                       'first_platform_c': ['Level0', 'others', 'Level99', None],
+                       'first_utm_medium_c': ['Level0', 'Level9', 'Level0', 'Level0'],
+                       'total_leads_droppped': [1.0, None, 30.0, 0.0]},
+                      index=[10, 11, 12, 13])
+    encoded = category_encode(df, codes, ['total_leads_droppped', 'referred_lead'])
+    assert list(encoded.columns) == FEATURES_TO_ENCODE + ['total_leads_droppped', 'referred_lead']
+    assert encoded.index.tolist() == [10, 11, 12, 13]
+    assert encoded['city_tier'].tolist() == [2, 0, -1, -1]
+    assert encoded['first_platform_c'].tolist() == [0, codes['first_platform_c'].index('others'), -1, -1]
+    assert encoded['first_utm_medium_c'].tolist() == [0, codes['first_utm_medium_c'].index('Level9'), 0, 0]
+    assert encoded['first_utm_source_c'].tolist() == [-1] * 4
+    assert encoded['total_leads_droppped'].tolist() == [1, 0, 30, 0]
+    assert encoded['referred_lead'].tolist() == [0] * 4
+    assert (encoded[FEATURES_TO_ENCODE].dtypes == np.int32).all()
+    assert category_encode(df.assign(city_tier=df['city_tier'].astype(str)), codes, [])['city_tier'].tolist()[:2] == [2, 0]
+
+
+def test_native_categorical_training_and_prediction(training_pipeline, inference_pipeline, monkeypatch):
+    """_summary_
+    This function trains and predicts with NATIVE_CATEGORICAL: the model is
+    trained on the four category code columns as lightgbm categoricals, the
+    code dictionary is logged with it, and the inference pipeline encodes
+    model_input with that dictionary and predicts every lead.
+    """
+    monkeypatch.setattr(training_pipeline, 'NATIVE_CATEGORICAL', True)
+    monkeypatch.setattr(inference_pipeline, 'NATIVE_CATEGORICAL', True)
+    training_pipeline.encode_features()
+    store = training_pipeline.open_stage_store()
+    try:
+        features = store.read('features')
+    finally:
+        store.close()
+    assert list(features.columns) == ['lead_id'] + FEATURES_TO_ENCODE + ['total_leads_droppped', 'referred_lead']
+
+    training_pipeline.get_trained_model()
+    client = mlflow.tracking.MlflowClient()
+    version = client.get_latest_versions('LightGBM')[0]
+    client.transition_model_version_stage('LightGBM', version.version, 'Production')
+    assert mlflow.artifacts.load_dict(f'runs:/{version.run_id}/category_codes.json') == \
+        category_codes(FEATURES_TO_ENCODE, ONE_HOT_ENCODED_FEATURES)
+    model = mlflow.lightgbm.load_model(f'models:/LightGBM/{version.version}')
+    assert '[categorical_feature: 0,1,2,3]' in model.model_to_string().splitlines()
+
+    inference_pipeline.encode_features()
+    inference_pipeline.get_models_prediction()
+    store = inference_pipeline.open_stage_store()
+    try:
+        predictions = store.read('predictions')
+    finally:
+        store.close()
+    assert sorted(predictions['lead_id']) == sorted(features['lead_id'])
+    expected = (model.predict(features.set_index('lead_id')) > inference_pipeline.PREDICTION_THRESHOLD).astype(int)
+    np.testing.assert_array_equal(predictions.set_index('lead_id').loc[features['lead_id'], 'app_complete_flag'],
+                                  expected)
@@ -0,0 +1,170 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import pandas as pd
+import pytest
+
+from Lead_scoring_data_pipeline.stage_cache import cached_stage, STAGE_CACHE_TABLE
+from Lead_scoring_data_pipeline.stage_store import get_stage_store
+
+import warnings
+warnings.filterwarnings("ignore")
+
+# read by cached_stage from the globals of the stages below
+STAGE_CACHE_ENABLED = True
+STAGE_CACHE_MAX_ENTRIES = 20
+
+
+@pytest.fixture
+def stage(tmp_path):
+    """_summary_
+    Returns a cached stage doubling the 'numbers' table into 'doubled', with
+    a list of its runs and of the functions returning its extra input, the
+    last one is used.
+    """
+    def open_store():
+        return get_stage_store('sqlite', f'{tmp_path}/', 'stage_cache_test.db', f'{tmp_path}/stage_store/')
+
+    runs = []
+    extras = []
+
+    def model_version():
+        return extras[-1]()
+
+    @cached_stage('double', open_store, ['numbers'], ['doubled'], extra=model_version)
+    def double():
+        runs.append(1)
+        store = open_store()
+        try:
+            store.write(store.read('numbers') * 2, 'doubled')
+        finally:
+            store.close()
+
+    store = open_store()
+    store.write(pd.DataFrame({'n': [1, 2, 3]}), 'numbers')
+    store.close()
+    double.open_store, double.runs, double.extras = open_store, runs, extras
+    return double
+
+
+###############################################################################
+# Write test cases for the extra input of cached_stage()
+# ##############################################################################
+
+def test_unreachable_extra_runs_stage_uncached(stage):
+    """_summary_
+    This function checks that a stage whose extra input raises, e.g. when
+    the model registry cannot be reached, is run instead of failing and
+    that no cache entry is recorded for that run.
+    """
+    def unreachable():
+        raise ConnectionError('registry down')
+
+    stage.extras.append(unreachable)
+    stage()
+    stage()
+    assert len(stage.runs) == 2
+
+    store = stage.open_store()
+    try:
+        assert store.read('doubled')['n'].tolist() == [2, 4, 6]
+        assert not store.exists(STAGE_CACHE_TABLE)
+    finally:
+        store.close()
+
+
+def test_extra_change_reruns_stage(stage):
+    """_summary_
+    This function checks that a stage is skipped while its extra input is
+    the same and run again once it changes, e.g. a new production model.
+    """
+    stage.extras.append(lambda: [('1', 'run-a')])
+    stage()
+    stage()
+    assert len(stage.runs) == 1
+
+    stage.extras.append(lambda: [('2', 'run-b')])
+    stage()
+    assert len(stage.runs) == 2
+
+
+###############################################################################
+# Write test cases for the cache hits and misses of the data pipeline stages
+# ##############################################################################
+
+def written_at(utils, table_name):
+    store = utils.open_stage_store()
+    try:
+        return store.written_at(table_name)
+    finally:
+        store.close()
+
+
+def test_stage_cache_hits_and_misses(data_pipeline, monkeypatch, capsys):
+    """_summary_
+    This function checks that map_city_tier is skipped when run again on the
+    same 'loaded_data', and run again when 'loaded_data', one of the
+    constants of the pipeline or its own output table changed.
+
+    SAMPLE USAGE
+        pytest unit_test/test_stage_cache.py
+    """
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    first_write = written_at(data_pipeline, 'city_tier_mapped')
+
+    capsys.readouterr()
+    data_pipeline.map_city_tier()
+    assert 'Inputs of map_city_tier unchanged since its last run' in capsys.readouterr().out
+    assert written_at(data_pipeline, 'city_tier_mapped') == first_write
+
+    # another input table
+    data_file = data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE
+    data_pipeline.load_data(data_file).iloc[:50].to_csv(data_file, index=False)
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    assert 'unchanged' not in capsys.readouterr().out
+    assert written_at(data_pipeline, 'city_tier_mapped') != first_write
+
+    # another constant
+    monkeypatch.setattr(data_pipeline, 'CITY_FUZZY_THRESHOLD', 0.9)
+    data_pipeline.map_city_tier()
+    assert 'unchanged' not in capsys.readouterr().out
+
+    # the output table written by another run
+    store = data_pipeline.open_stage_store()
+    try:
+        store.write(store.read('city_tier_mapped').iloc[:10], 'city_tier_mapped')
+    finally:
+        store.close()
+    data_pipeline.map_city_tier()
+    assert 'unchanged' not in capsys.readouterr().out
+    store = data_pipeline.open_stage_store()
+    try:
+        assert store.read('city_tier_mapped').shape[0] == 50
+    finally:
+        store.close()
+
+
+def test_stage_cache_keeps_newest_entries(stage, monkeypatch):
+    """_summary_
+    This function checks that only the STAGE_CACHE_MAX_ENTRIES newest
+    entries of a stage are kept.
+    """
+    monkeypatch.setitem(globals(), 'STAGE_CACHE_MAX_ENTRIES', 3)
+    for version in range(5):
+        stage.extras.append(lambda version=version: version)
+        stage()
+
+    store = stage.open_store()
+    try:
+        assert store.read_table(STAGE_CACHE_TABLE).shape[0] == 3
+    finally:
+        store.close()
+    # the oldest versions were evicted, the newest one is still cached
+    stage.extras.append(lambda: 0)
+    stage()
+    stage.extras.append(lambda: 4)
+    stage()
+    assert len(stage.runs) == 6
@@ -0,0 +1,280 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Lead_scoring_data_pipeline.stage_store import get_stage_store, native_rows
+
+import warnings
+warnings.filterwarnings("ignore")
+
+
+def row_count(utils, table_name):
+    cnx = sqlite3.connect(utils.DB_PATH + utils.DB_FILE_NAME)
+    try:
+        return cnx.execute(f'select count(*) from {table_name}').fetchone()[0]
+    finally:
+        cnx.close()
+
+
+###############################################################################
+# Write test cases for the incremental load of load_data_into_db()
+# ##############################################################################
+
+def test_incremental_load_of_growing_file(data_pipeline, monkeypatch):
+    """_summary_
+    This function loads the first 60 leads of 'leadscoring_test.csv' and then
+    the whole file with INCREMENTAL_LOAD on and the file read in one piece.
+    The second load must append the 40 newer leads, the fingerprint lookup
+    of the first load must not leave a transaction open that makes the write
+    of the second one fail.
+
+    SAMPLE USAGE
+        pytest unit_test/test_stage_store.py
+    """
+    monkeypatch.setattr(data_pipeline, 'INCREMENTAL_LOAD', True)
+    monkeypatch.setattr(data_pipeline, 'LOAD_CHUNKSIZE', None)
+    data_file = data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE
+    leads = pd.read_csv(data_file).sort_values('created_date')
+
+    leads.iloc[:60].to_csv(data_file, index=False)
+    data_pipeline.load_data_into_db()
+    assert row_count(data_pipeline, 'loaded_data') == 60
+
+    leads.to_csv(data_file, index=False)
+    data_pipeline.load_data_into_db()
+    assert row_count(data_pipeline, 'loaded_data') == 100
+
+
+###############################################################################
+# Write test cases for the parquet stage store
+# ##############################################################################
+
+def open_store(backend, tmp_path):
+    return get_stage_store(backend, f'{tmp_path}/', 'stage_store_test.db', f'{tmp_path}/stage_store/')
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'parquet'])
+def test_store_round_trip(backend, tmp_path):
+    """_summary_
+    This function checks that both stores give back the rows and columns
+    written and appended, only some columns or the rows created after a
+    date when asked, and a new version whenever the content changes.
+    """
+    df = pd.DataFrame({'lead_id': [1, 2, 3],
+                       'created_date': ['2021-11-01 10:00:00', '2021-11-02 10:00:00', '2021-11-03 10:00:00'],
+                       'city_tier': [1.0, None, 3.0],
+                       'first_platform_c': ['Level0', 'others', None]})
+    store = open_store(backend, tmp_path)
+    try:
+        store.write(df, 'leads')
+        version = store.version('leads')
+        pd.testing.assert_frame_equal(store.read('leads'), df, check_dtype=False)
+        assert store.columns('leads') == list(df.columns)
+        assert store.read('leads', columns=['lead_id', 'city_tier']).columns.tolist() == ['lead_id', 'city_tier']
+
+        store.write(df.assign(lead_id=[4, 5, 6], created_date=df['created_date'].str.replace('11-0', '12-0')),
+                    'leads', if_exists='append')
+        assert store.read('leads')['lead_id'].tolist() == [1, 2, 3, 4, 5, 6]
+        assert store.read('leads', since='2021-11-03 10:00:00')['lead_id'].tolist() == [4, 5, 6]
+        assert store.version('leads') != version
+
+        store.write(df, 'leads')
+        assert store.version('leads') == version
+    finally:
+        store.close()
+
+
+def test_parquet_pipeline_matches_test_cases(data_pipeline, assert_test_case, monkeypatch):
+    """_summary_
+    This function runs the data pipeline with the parquet stage store and
+    checks that every stage table holds the rows of its test case.
+    """
+    monkeypatch.setattr(data_pipeline, 'STAGE_STORE_BACKEND', 'parquet')
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    data_pipeline.map_categorical_vars()
+    data_pipeline.interactions_mapping()
+
+    store = data_pipeline.open_stage_store()
+    try:
+        assert os.path.isdir(os.path.join(data_pipeline.STAGE_STORE_DIRECTORY, 'interactions_mapped'))
+        for table_name in ('loaded_data', 'city_tier_mapped', 'categorical_variables_mapped', 'interactions_mapped'):
+            assert_test_case(store.read(table_name), f'{table_name}_test_case')
+    finally:
+        store.close()
+
+
+###############################################################################
+# Write test cases for the row fingerprint index
+# ##############################################################################
+
+@pytest.mark.parametrize('backend', ['sqlite', 'parquet'])
+def test_fingerprint_index(backend, tmp_path):
+    """_summary_
+    This function checks that both stores find the fingerprints added in an
+    earlier run, keep them across a reopening, and forget them on a reset.
+    """
+    store = open_store(backend, tmp_path)
+    try:
+        assert not store.seen_fingerprints(np.array([1, 2], dtype=np.int64)).any()
+        store.add_fingerprints(np.array([5, -7, 2 ** 62], dtype=np.int64))
+    finally:
+        store.close()
+
+    store = open_store(backend, tmp_path)
+    try:
+        seen = store.seen_fingerprints(np.array([-7, 3, 2 ** 62, 5, 5], dtype=np.int64))
+        assert seen.tolist() == [True, False, True, True, True]
+        store.add_fingerprints(np.array([3], dtype=np.int64), reset=True)
+        assert store.seen_fingerprints(np.array([3, 5], dtype=np.int64)).tolist() == [True, False]
+    finally:
+        store.close()
+
+
+def test_loaded_rows_are_dropped(data_pipeline):
+    """_summary_
+    This function checks that the fingerprint of a row does not depend on the
+    dtypes it was read in, and that drop_loaded_rows drops the rows loaded
+    earlier in the run or, with the history, in an earlier run.
+    """
+    leads = data_pipeline.load_data(data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE)
+    np.testing.assert_array_equal(data_pipeline.row_fingerprints(leads),
+                                  data_pipeline.row_fingerprints(data_pipeline.compact_frame(leads.copy())))
+
+    store = data_pipeline.open_stage_store()
+    try:
+        run_fingerprints = [np.empty(0, dtype=np.int64)]
+        kept = data_pipeline.drop_loaded_rows(store, pd.concat([leads.iloc[:10], leads.iloc[5:20]]),
+                                              False, run_fingerprints)
+        assert kept.shape[0] == 20
+        kept = data_pipeline.drop_loaded_rows(store, leads.iloc[15:30], False, run_fingerprints)
+        assert kept.shape[0] == 10
+        # the fingerprints of the run stay sorted and unique
+        np.testing.assert_array_equal(run_fingerprints[0],
+                                      np.sort(data_pipeline.row_fingerprints(leads.iloc[:30])))
+        store.add_fingerprints(run_fingerprints[0])
+
+        kept = data_pipeline.drop_loaded_rows(store, leads.iloc[25:40], True, [np.empty(0, dtype=np.int64)])
+        assert kept.index.tolist() == leads.index[30:40].tolist()
+    finally:
+        store.close()
+
+
+def test_duplicate_rows_are_loaded_once(data_pipeline, monkeypatch):
+    """_summary_
+    This function checks that rows repeated in the raw file, in the same or
+    another chunk, are loaded once.
+    """
+    monkeypatch.setattr(data_pipeline, 'LOAD_CHUNKSIZE', 40)
+    data_file = data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE
+    leads = data_pipeline.load_data(data_file)
+    pd.concat([leads, leads.iloc[:50]]).to_csv(data_file, index=False)
+    data_pipeline.load_data_into_db()
+    assert row_count(data_pipeline, 'loaded_data') == 100
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'parquet'])
+def test_sparse_round_trip(backend, tmp_path):
+    """_summary_
+    This function checks that both stores give back the sparse matrix, the
+    lead_id of its rows and its columns, and version it by its content.
+    """
+    from scipy import sparse
+
+    matrix = sparse.csr_matrix(np.array([[1, 0, 0], [0, 0, 2], [0, 0, 0]], dtype=np.uint8))
+    store = open_store(backend, tmp_path)
+    try:
+        assert not store.sparse_exists('features')
+        store.write_sparse(matrix, [7, 8, 9], ['a', 'b', 'c'], 'features')
+        version = store.version('features')
+        read_matrix, keys, columns = store.read_sparse('features')
+        assert read_matrix.format == 'csr' and read_matrix.dtype == np.uint8
+        np.testing.assert_array_equal(read_matrix.toarray(), matrix.toarray())
+        assert keys.tolist() == [7, 8, 9] and columns == ['a', 'b', 'c']
+
+        store.write_sparse(matrix, [7, 8, 10], ['a', 'b', 'c'], 'features')
+        assert store.version('features') != version
+        assert [name for name in os.listdir(store.sparse_directory) if name.endswith('.npz')] == ['features.npz']
+    finally:
+        store.close()
+
+
+###############################################################################
+# Write test cases for the tables keyed by lead_id
+# ##############################################################################
+
+def test_keyed_sqlite_table(tmp_path):
+    """_summary_
+    This function checks that a sqlite table with a lead_id column has it as
+    its primary key, is indexed on created_date, and that a lead appended
+    again replaces its row.
+    """
+    df = pd.DataFrame({'lead_id': [1, 2, 3],
+                       'created_date': ['2021-11-01 10:00:00', '2021-11-02 10:00:00', '2021-11-03 10:00:00'],
+                       'city_tier': [1.0, 2.0, 3.0]})
+    store = open_store('sqlite', tmp_path)
+    try:
+        store.write(df, 'leads')
+        table_info = {row[1]: row for row in store.cnx.execute('PRAGMA table_info("leads")')}
+        assert table_info['lead_id'][2] == 'INTEGER' and table_info['lead_id'][5] == 1
+        assert 'ix_leads_created_date' in [row[1] for row in store.cnx.execute('PRAGMA index_list("leads")')]
+        plan = store.cnx.execute('EXPLAIN QUERY PLAN SELECT * FROM leads WHERE lead_id = 2').fetchall()
+        assert 'INTEGER PRIMARY KEY' in plan[0][-1]
+
+        store.write(pd.DataFrame({'lead_id': [2, 4], 'created_date': ['2021-11-05 10:00:00', '2021-11-06 10:00:00'],
+                                  'city_tier': [1.0, 3.0]}), 'leads', if_exists='append')
+        leads = store.read('leads').set_index('lead_id')
+        assert leads.index.tolist() == [1, 2, 3, 4]
+        assert leads.loc[2, 'created_date'] == '2021-11-05 10:00:00'
+    finally:
+        store.close()
+
+
+def test_native_rows():
+    """_summary_
+    This function checks that native_rows gives python values, None for the
+    missing ones and timestamps in the text to_sql writes.
+    """
+    df = pd.DataFrame({'created_date': pd.to_datetime(['2021-11-01 10:00:00', None]),
+                       'referred_lead': pd.array([1, None], dtype='Int8'),
+                       'city_tier': [1.0, np.nan],
+                       'first_platform_c': pd.Categorical(['Level0', None])})
+    rows = list(native_rows(df))
+    assert rows == [('2021-11-01 10:00:00', 1, 1.0, 'Level0'), (None, None, None, None)]
+    assert type(rows[0][1]) is int
+
+
+def test_lead_id_is_carried_through_the_stages(data_pipeline):
+    """_summary_
+    This function checks that the leads are numbered in file order when
+    loaded and keep their lead_id through the mapping stages, the grouped
+    tables keeping the lead_id of one of their leads.
+    """
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    data_pipeline.map_categorical_vars()
+    data_pipeline.interactions_mapping()
+
+    store = data_pipeline.open_stage_store()
+    try:
+        loaded = store.read('loaded_data')
+        assert loaded['lead_id'].tolist() == list(range(100))
+        for table_name in ('city_tier_mapped', 'categorical_variables_mapped'):
+            mapped = store.read(table_name)
+            assert sorted(mapped['lead_id']) == list(range(100))
+            joined = mapped[['lead_id', 'created_date']].merge(loaded[['lead_id', 'created_date']], on='lead_id')
+            assert (joined['created_date_x'] == joined['created_date_y']).all()
+        for table_name in ('interactions_mapped', 'model_input'):
+            lead_ids = store.read(table_name)['lead_id']
+            assert lead_ids.is_unique and set(lead_ids) <= set(range(100))
+            table_info = {row[1]: row for row in store.cnx.execute(f'PRAGMA table_info("{table_name}")')}
+            assert table_info['lead_id'][5] == 1
+    finally:
+        store.close()
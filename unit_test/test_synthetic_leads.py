@@ -0,0 +1,92 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import os
+
+import pandas as pd
+
+from benchmarks.synthetic_leads import fit_lead_profile, generate_leads, write_synthetic_leads, INTERACTION_COLUMNS
+from Lead_scoring_data_pipeline.schema import raw_data_schema
+
+import warnings
+warnings.filterwarnings("ignore")
+
+UNIT_TEST_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REFERENCE_FILES = [os.path.join(UNIT_TEST_DIRECTORY, 'leadscoring_test.csv')]
+
+
+###############################################################################
+# Write test cases for generate_leads()
+# ##############################################################################
+
+def test_synthetic_leads_follow_the_reference():
+    """_summary_
+    This function checks that the synthetic leads have the columns of
+    raw_data_schema, take their levels and interaction rows from the
+    reference file, and are created in order within its date range.
+    """
+    reference = pd.read_csv(REFERENCE_FILES[0])
+    profile = fit_lead_profile(REFERENCE_FILES)
+    chunks = list(generate_leads(profile, 250, chunksize=100, seed=7))
+
+    assert [chunk.shape[0] for chunk in chunks] == [100, 100, 50]
+    df = pd.concat(chunks)
+    assert list(df.columns) == raw_data_schema
+    assert df.index.tolist() == list(range(250))
+
+    assert set(df['city_mapped'].dropna()) <= set(reference['city_mapped'].dropna())
+    assert set(df['first_platform_c'].dropna()) <= set(reference['first_platform_c'].dropna())
+    reference_rows = set(map(tuple, reference[INTERACTION_COLUMNS].fillna(-1).to_numpy()))
+    assert set(map(tuple, df[INTERACTION_COLUMNS].fillna(-1).to_numpy())) <= reference_rows
+
+    created_date = pd.to_datetime(df['created_date'])
+    assert created_date.is_monotonic_increasing
+    assert created_date.min() >= pd.to_datetime(reference['created_date']).min().floor('s')
+    assert created_date.max() <= pd.to_datetime(reference['created_date']).max()
+
+
+###############################################################################
+# Write test cases for write_synthetic_leads()
+# ##############################################################################
+
+def test_synthetic_file_is_deterministic(tmp_path):
+    """_summary_
+    This function checks that the same seed and chunksize write the same
+    file, and another seed another one.
+    """
+    first = write_synthetic_leads(str(tmp_path / 'first.csv'), 250, 100, 7, REFERENCE_FILES)
+    second = write_synthetic_leads(str(tmp_path / 'second.csv'), 250, 100, 7, REFERENCE_FILES)
+    other = write_synthetic_leads(str(tmp_path / 'other.csv'), 250, 100, 8, REFERENCE_FILES)
+    with open(first) as f1, open(second) as f2, open(other) as f3:
+        first_text, second_text, other_text = f1.read(), f2.read(), f3.read()
+    assert first_text == second_text
+    assert first_text != other_text
+    assert pd.read_csv(first, index_col=[0]).shape == (250, len(raw_data_schema))
+
+
+def test_pipeline_runs_on_synthetic_leads(data_pipeline, tmp_path):
+    """_summary_
+    This function checks that the data pipeline stages run on a synthetic
+    file and keep one row per lead through to 'interactions_mapped'.
+    """
+    file_path = write_synthetic_leads(str(tmp_path / 'synthetic.csv'), 500, 200, 7, REFERENCE_FILES)
+    # the fixture reads its file without an index column, as the test file
+    pd.read_csv(file_path, index_col=[0]).to_csv(
+        data_pipeline.DATA_DIRECTORY + data_pipeline.DATA_FILE, index=False)
+
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+    data_pipeline.map_categorical_vars()
+    data_pipeline.interactions_mapping()
+
+    store = data_pipeline.open_stage_store()
+    try:
+        loaded = store.read_table('loaded_data')
+        mapped = store.read_table('interactions_mapped')
+    finally:
+        store.close()
+    assert loaded.shape[0] == 500
+    assert mapped.shape[0] == 500
+    assert mapped['city_tier'].notna().all()
+    assert loaded['lead_id'].is_unique
@@ -0,0 +1,121 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from Lead_scoring_data_pipeline.stage_store import get_stage_store
+from Lead_scoring_data_pipeline.telemetry import instrumented_stage, peak_rss_mb, PIPELINE_METRICS_TABLE
+
+import warnings
+warnings.filterwarnings("ignore")
+
+# read by instrumented_stage from the globals of the stages below
+TELEMETRY_ENABLED = True
+PROMETHEUS_TEXTFILE_DIRECTORY = None
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    def open_store():
+        return get_stage_store('sqlite', f'{tmp_path}/', 'telemetry_test.db', f'{tmp_path}/stage_store/')
+    return open_store
+
+
+def read_metrics(open_store):
+    store = open_store()
+    try:
+        return store.read_table(PIPELINE_METRICS_TABLE)
+    finally:
+        store.close()
+
+
+###############################################################################
+# Write test cases for instrumented_stage()
+# ##############################################################################
+
+def test_children_peak_recorded_apart(open_store):
+    """_summary_
+    This function checks that the peak memory of a worker process of an
+    earlier stage is recorded as children_peak_rss_mb and is not taken as
+    the peak of a later stage of the same task process.
+    """
+    # the worker peaks 300 MB above this process, whatever the earlier tests
+    # loaded into it
+    worker_mb = int(peak_rss_mb()) + 300
+
+    @instrumented_stage('telemetry_test', open_store)
+    def spawn_worker():
+        subprocess.run([sys.executable, '-c', f'block = b"x" * ({worker_mb} * 2 ** 20)'], check=True)
+
+    @instrumented_stage('telemetry_test', open_store)
+    def small_stage():
+        return sum(range(1000))
+
+    spawn_worker()
+    small_stage()
+
+    metrics = read_metrics(open_store).set_index('stage')
+    assert metrics.loc['spawn_worker', 'children_peak_rss_mb'] >= worker_mb
+    assert metrics.loc['small_stage', 'peak_rss_mb'] < metrics.loc['spawn_worker', 'children_peak_rss_mb']
+    assert (metrics['status'] == 'success').all()
+
+
+def test_metrics_table_gets_new_columns(open_store):
+    """_summary_
+    This function checks that a 'pipeline_metrics' table recorded before the
+    children_peak_rss_mb metric existed keeps its rows and gets the column.
+    """
+    store = open_store()
+    store.write_table(pd.DataFrame({'run_at': ['2023-01-01 00:00:00.000000'], 'dag': ['telemetry_test'],
+                                    'stage': ['old_stage'], 'status': ['success'],
+                                    'wall_seconds': [1.0], 'peak_rss_mb': [100.0]}), PIPELINE_METRICS_TABLE)
+    store.close()
+
+    @instrumented_stage('telemetry_test', open_store)
+    def new_stage():
+        return None
+
+    new_stage()
+
+    metrics = read_metrics(open_store)
+    assert metrics['stage'].tolist() == ['old_stage', 'new_stage']
+    assert pd.isna(metrics['children_peak_rss_mb'].iloc[0])
+    assert metrics['children_peak_rss_mb'].iloc[1] >= 0
+
+
+def test_pipeline_stages_are_recorded(data_pipeline, tmp_path, monkeypatch):
+    """_summary_
+    This function checks the 'pipeline_metrics' rows of the data pipeline
+    stages, a failed stage being recorded as such, and the prometheus
+    textfile written for every stage.
+    """
+    monkeypatch.setattr(data_pipeline, 'PROMETHEUS_TEXTFILE_DIRECTORY', str(tmp_path / 'prometheus'))
+    data_pipeline.load_data_into_db()
+    data_pipeline.map_city_tier()
+
+    @instrumented_stage('telemetry_test', data_pipeline.open_stage_store)
+    def failing_stage():
+        raise RuntimeError('stage failed')
+
+    with pytest.raises(RuntimeError):
+        failing_stage()
+
+    metrics = read_metrics(data_pipeline.open_stage_store).set_index('stage')
+    assert metrics.loc['load_data_into_db', 'dag'] == data_pipeline.TELEMETRY_DAG
+    assert metrics.loc['load_data_into_db', 'rows_out'] == 100
+    assert metrics.loc['map_city_tier', 'rows_in'] == 100
+    assert metrics.loc['map_city_tier', 'rows_out'] == 100
+    assert (metrics.loc[['load_data_into_db', 'map_city_tier'], 'status'] == 'success').all()
+    assert (metrics.loc[['load_data_into_db', 'map_city_tier'], 'wall_seconds'] > 0).all()
+    assert metrics.loc['failing_stage', 'status'] == 'failed'
+
+    textfile = tmp_path / 'prometheus' / f'lead_scoring_{data_pipeline.TELEMETRY_DAG}_map_city_tier.prom'
+    lines = textfile.read_text().splitlines()
+    labels = f'{{dag="{data_pipeline.TELEMETRY_DAG}",stage="map_city_tier"}}'
+    assert f'lead_scoring_stage_rows_out{labels} 100.0' in lines
+    assert f'lead_scoring_stage_success{labels} 1' in lines
@@ -0,0 +1,96 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import lightgbm as lgb
+import mlflow
+import mlflow.lightgbm
+import numpy as np
+
+from Lead_scoring_training_pipeline.constants import ONE_HOT_ENCODED_FEATURES, model_config
+from Lead_scoring_training_pipeline.utils import lightgbm_params
+
+import warnings
+warnings.filterwarnings("ignore")
+
+
+###############################################################################
+# Write test cases for the model logged by get_trained_model()
+# ##############################################################################
+
+def test_inference_predicts_with_the_logged_booster(training_pipeline, inference_pipeline):
+    """_summary_
+    This function checks that get_trained_model registers the booster of
+    lgb.train logged with mlflow.lightgbm, and that the inference pipeline
+    loads it from the Production stage and predicts the classes of its
+    probabilities cut at PREDICTION_THRESHOLD.
+    """
+    training_pipeline.encode_features()
+    training_pipeline.get_trained_model()
+    client = mlflow.tracking.MlflowClient()
+    version = client.get_latest_versions('LightGBM')[0]
+    client.transition_model_version_stage('LightGBM', version.version, 'Production')
+    model = mlflow.lightgbm.load_model(f'models:/LightGBM/{version.version}')
+    assert isinstance(model, lgb.Booster)
+
+    inference_pipeline.encode_features()
+    inference_pipeline.get_models_prediction()
+    store = inference_pipeline.open_stage_store()
+    try:
+        features = store.read('features')
+        predictions = store.read('predictions')
+    finally:
+        store.close()
+    assert sorted(predictions['lead_id']) == sorted(features['lead_id'])
+    probabilities = model.predict(features[ONE_HOT_ENCODED_FEATURES])
+    expected = (probabilities > inference_pipeline.PREDICTION_THRESHOLD).astype(int)
+    np.testing.assert_array_equal(predictions.set_index('lead_id').loc[features['lead_id'], 'app_complete_flag'],
+                                  expected)
+
+
+###############################################################################
+# Write test cases for the early stopping of get_trained_model()
+# ##############################################################################
+
+def training_run():
+    # metrics, params and logged model of the last training run
+    run = mlflow.search_runs(search_all_experiments=True).sort_values('start_time').iloc[-1]
+    model = mlflow.lightgbm.load_model(f'runs:/{run["run_id"]}/models')
+    return run, model
+
+
+def test_early_stopping_keeps_the_best_iteration(training_pipeline, monkeypatch):
+    """_summary_
+    This function checks that get_trained_model stops the boosting
+    EARLY_STOPPING_ROUNDS rounds after the best validation score and logs a
+    model cut at the best iteration.
+    """
+    monkeypatch.setattr(training_pipeline, 'EARLY_STOPPING_ROUNDS', 5)
+    training_pipeline.encode_features()
+    training_pipeline.get_trained_model()
+
+    run, model = training_run()
+    best_iteration, trained_rounds = run['metrics.best_iteration'], run['metrics.trained_rounds']
+    _, num_boost_round = lightgbm_params(model_config)
+    assert 1 <= best_iteration <= trained_rounds < num_boost_round
+    assert trained_rounds <= best_iteration + 5
+    assert run['metrics.num_trees'] == best_iteration
+    assert model.num_trees() == best_iteration
+    assert 0 <= run['metrics.validation_auc'] <= 1
+    assert run['params.early_stopping_rounds'] == '5'
+
+
+def test_training_without_early_stopping(training_pipeline, monkeypatch):
+    """_summary_
+    This function checks that with EARLY_STOPPING_ROUNDS None the model is
+    trained for every boosting round and keeps all its trees.
+    """
+    monkeypatch.setattr(training_pipeline, 'EARLY_STOPPING_ROUNDS', None)
+    monkeypatch.setattr(training_pipeline, 'model_config', dict(model_config, num_boost_round=30))
+    training_pipeline.encode_features()
+    training_pipeline.get_trained_model()
+
+    run, model = training_run()
+    assert run['metrics.trained_rounds'] == 30
+    assert run['metrics.num_trees'] == model.num_trees() == 30
+    assert 'metrics.best_iteration' not in run.index or np.isnan(run['metrics.best_iteration'])
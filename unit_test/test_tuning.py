@@ -0,0 +1,205 @@
+##############################################################################
+# Import the necessary modules
+# #############################################################################
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import lightgbm as lgb
+import mlflow
+import numpy as np
+import pandas as pd
+import pytest
+
+from Lead_scoring_data_pipeline.stage_store import get_stage_store
+from Lead_scoring_training_pipeline.tuning import rung_rounds, sample_configs, successive_halving, \
+    save_tuned_config, tuned_model_config
+
+import warnings
+warnings.filterwarnings("ignore")
+
+BASE_PARAMS = {'objective': 'binary', 'verbose': -1, 'min_data_in_leaf': 5, 'seed': 0}
+
+
+@pytest.fixture
+def tiny_dataset(tmp_path):
+    """_summary_
+    Returns the lightgbm binary file of 300 synthetic training leads and
+    100 validation leads, the target depending on two of the 4 features.
+    """
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(400, 4)), columns=['a', 'b', 'c', 'd'])
+    y = ((X['a'] - X['b'] + rng.normal(scale=0.5, size=400)) > 0).astype(int).to_numpy()
+    train_path = str(tmp_path / 'train.bin')
+    lgb.Dataset(X.iloc[:300], label=y[:300], params=BASE_PARAMS).save_binary(train_path)
+    return train_path, X.iloc[300:], y[300:]
+
+
+###############################################################################
+# Write test cases for sample_configs()
+# ##############################################################################
+
+def test_sample_configs():
+    """_summary_
+    This function checks that the configurations are drawn within the search
+    space, and the same ones for the same seed.
+    """
+    search_space = {'learning_rate': ('log_uniform', 0.01, 0.3), 'num_leaves': ('int', 8, 10),
+                    'colsample_bytree': ('uniform', 0.5, 1.0), 'boosting_type': ('choice', ['gbdt', 'dart'])}
+    configs = sample_configs(search_space, 50, 42)
+    assert len(configs) == 50
+    assert configs == sample_configs(search_space, 50, 42)
+    assert configs != sample_configs(search_space, 50, 43)
+    assert all(0.01 <= config['learning_rate'] <= 0.3 for config in configs)
+    assert {config['num_leaves'] for config in configs} == {8, 9, 10}
+    assert all(0.5 <= config['colsample_bytree'] <= 1.0 for config in configs)
+    assert {config['boosting_type'] for config in configs} == {'gbdt', 'dart'}
+    with pytest.raises(ValueError):
+        sample_configs({'num_leaves': ('normal', 8, 10)}, 1, 42)
+
+
+###############################################################################
+# Write test cases for rung_rounds()
+# ##############################################################################
+
+def test_rung_rounds():
+    """_summary_
+    This function checks the boosting rounds of the rungs, min_rounds times
+    the powers of eta up to max_rounds, which is always the last rung.
+    """
+    assert rung_rounds(25, 200, 3) == [25, 75, 200]
+    assert rung_rounds(10, 90, 3) == [10, 30, 90]
+    assert rung_rounds(4, 16, 2) == [4, 8, 16]
+    assert rung_rounds(200, 200, 3) == [200]
+
+
+###############################################################################
+# Write test cases for successive_halving()
+# ##############################################################################
+
+def test_promotion_and_pruning(tiny_dataset):
+    """_summary_
+    This function races 8 configurations over the rungs of 4, 8 and 16
+    rounds, keeping half of them at every rung. The best of each rung are
+    promoted to the next one, the others are pruned, and the best trial is
+    the one promoted at the last rung.
+    """
+    train_path, X_valid, y_valid = tiny_dataset
+    configs = sample_configs({'num_leaves': ('int', 2, 16), 'learning_rate': ('log_uniform', 0.01, 0.3)}, 8, 0)
+    best, results = successive_halving(configs, BASE_PARAMS, train_path, {}, X_valid, y_valid,
+                                       4, 16, 2, 1, 120)
+
+    results = pd.DataFrame(results)
+    assert results.groupby('rung').size().tolist() == [8, 4, 2]
+    assert results.groupby('rung')['rounds'].max().tolist() == [4, 8, 16]
+    for rung, rung_results in results.groupby('rung'):
+        promoted = rung_results[rung_results['status'] == 'promoted']
+        assert len(promoted) == max(1, len(rung_results) // 2)
+        assert set(rung_results['status']) <= {'promoted', 'pruned'}
+        pruned = rung_results[rung_results['status'] == 'pruned']
+        assert promoted['validation_auc'].min() >= pruned['validation_auc'].max()
+        if rung > 0:
+            previous = results[(results['rung'] == rung - 1) & (results['status'] == 'promoted')]
+            assert set(rung_results['trial']) == set(previous['trial'])
+
+    last = results[(results['rung'] == 2) & (results['status'] == 'promoted')].iloc[0]
+    assert best['trial'] == last['trial'] and best['rounds'] == 16
+    assert best['params'] == configs[best['trial']]
+
+
+def test_dead_worker_ends_search(tmp_path):
+    """_summary_
+    This function checks that a worker dying at start, here on a missing
+    training set file, ends the search with no result instead of failing
+    or hanging.
+    """
+    X_valid, y_valid = pd.DataFrame({'a': [0.0, 1.0]}), np.array([0, 1])
+    best, results = successive_halving(sample_configs({'num_leaves': ('int', 2, 16)}, 2, 0), BASE_PARAMS,
+                                       str(tmp_path / 'missing.bin'), {}, X_valid, y_valid, 4, 16, 2, 1, 120)
+    assert best is None
+    assert results == []
+
+
+def test_unguarded_script_does_not_hang(tiny_dataset, tmp_path):
+    """_summary_
+    This function runs successive_halving from a script without the
+    if __name__ == '__main__' guard, whose spawned workers run the script
+    again and die, and checks that it returns.
+    """
+    train_path, X_valid, y_valid = tiny_dataset
+    pd.DataFrame(X_valid).assign(target=y_valid).to_csv(tmp_path / 'valid.csv', index=False)
+    script = tmp_path / 'unguarded.py'
+    script.write_text(textwrap.dedent(f'''
+        import sys
+        sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+        import pandas as pd
+        from Lead_scoring_training_pipeline.tuning import successive_halving
+        valid = pd.read_csv({str(tmp_path / 'valid.csv')!r})
+        best, results = successive_halving([{{'num_leaves': 4}}], {BASE_PARAMS!r}, {train_path!r}, {{}},
+                                           valid.drop(columns='target'), valid['target'].to_numpy(),
+                                           4, 16, 2, 1, 30)
+        print('tuning returned', best)
+    '''))
+    completed = subprocess.run([sys.executable, str(script)], capture_output=True, text=True, timeout=300)
+    assert 'tuning returned None' in completed.stdout
+
+
+###############################################################################
+# Write test cases for the tuned configuration
+# ##############################################################################
+
+def test_tuned_config_follows_the_features(tmp_path):
+    """_summary_
+    This function checks that the tuned configuration is only used for the
+    features and target it was tuned on.
+    """
+    store = get_stage_store('sqlite', f'{tmp_path}/', 'tuning_test.db', f'{tmp_path}/stage_store/')
+    try:
+        assert tuned_model_config(store) is None
+        store.write(pd.DataFrame({'a': [1.0, 2.0]}), 'features')
+        store.write(pd.DataFrame({'app_complete_flag': [0, 1]}), 'target')
+        save_tuned_config(store, {'num_leaves': 7, 'learning_rate': 0.05}, 0.8)
+        assert tuned_model_config(store) == {'num_leaves': 7, 'learning_rate': 0.05}
+
+        store.write(pd.DataFrame({'app_complete_flag': [1, 1]}), 'target')
+        assert tuned_model_config(store) is None
+    finally:
+        store.close()
+
+
+def test_tuning_stages(training_pipeline, monkeypatch):
+    """_summary_
+    This function runs tune_model_config on the test leads, which saves the
+    best configuration and logs every trial in a nested mlflow run, then
+    checks that get_trained_model trains with the saved configuration.
+    """
+    monkeypatch.setattr(training_pipeline, 'TUNING_ENABLED', True)
+    monkeypatch.setattr(training_pipeline, 'TUNING_TRIALS', 4)
+    monkeypatch.setattr(training_pipeline, 'TUNING_MIN_ROUNDS', 5)
+    monkeypatch.setattr(training_pipeline, 'TUNING_ETA', 2)
+    monkeypatch.setattr(training_pipeline, 'TUNING_WORKERS', 2)
+    monkeypatch.setattr(training_pipeline, 'TUNING_BUDGET_SECONDS', 120)
+    training_pipeline.encode_features()
+    training_pipeline.tune_model_config()
+
+    store = training_pipeline.open_stage_store()
+    try:
+        tuned_config = tuned_model_config(store)
+        # a configuration that predicts both classes on the few test leads
+        save_tuned_config(store, dict(tuned_config, num_leaves=7, min_child_samples=5), 0.8)
+    finally:
+        store.close()
+    assert set(tuned_config) == set(training_pipeline.model_config)
+    assert 8 <= tuned_config['num_leaves'] <= 128
+    runs = mlflow.search_runs(search_all_experiments=True)
+    trials = runs[runs['tags.mlflow.runName'].str.startswith('trial_')]
+    assert len(trials) == 4
+    assert set(trials['tags.status']) <= {'promoted', 'pruned'}
+
+    training_pipeline.get_trained_model()
+    runs = mlflow.search_runs(search_all_experiments=True)
+    training_run = runs[runs['params.tuned'] == 'True'].iloc[0]
+    assert training_run['params.num_leaves'] == '7'
+    assert training_run['params.min_child_samples'] == '5'